@@ -64,6 +64,7 @@ void qdr_core_free(qdr_core_t *core);
  ******************************************************************************
  */
 void qdr_core_add_router(qdr_core_t *core, const char *address, int router_maskbit);
+void qdr_core_add_border_router(qdr_core_t *core, const char *address, int router_maskbit);
 void qdr_core_del_router(qdr_core_t *core, int router_maskbit);
 void qdr_core_set_link(qdr_core_t *core, int router_maskbit, int link_maskbit);
 void qdr_core_remove_link(qdr_core_t *core, int router_maskbit);
@@ -74,8 +75,60 @@ void qdr_core_set_valid_origins(qdr_core_t *core, int router_maskbit, qd_bitmask
 void qdr_core_map_destination(qdr_core_t *core, int router_maskbit, const char *address_hash);
 void qdr_core_unmap_destination(qdr_core_t *core, int router_maskbit, const char *address_hash);
 
-typedef void (*qdr_mobile_added_t)   (void *context, const char *address_hash);
-typedef void (*qdr_mobile_removed_t) (void *context, const char *address_hash);
+/**
+ * A set of changes to the route to one remote router.  Fields that are not being
+ * changed are set to -1 (nh_router_maskbit), 0 (cost) or null (the bitmasks).
+ *
+ * next_hops is the set of equal-cost next hops to the router; a set with fewer than two
+ * members means that the single next hop (or the router itself, if it is a neighbor) is
+ * used.  ecmp_origins is the set of origins, in addition to the valid origins, that may
+ * reach the router through this router over one of their equal-cost paths.
+ */
+typedef struct {
+    int           router_maskbit;
+    int           nh_router_maskbit;
+    int           cost;
+    qd_bitmask_t *valid_origins;
+    qd_bitmask_t *next_hops;
+    qd_bitmask_t *ecmp_origins;
+} qdr_route_update_t;
+
+/**
+ * Apply a batch of route changes in a single action on the core thread.
+ *
+ * @param core Pointer to the core object
+ * @param updates Array of route changes allocated with malloc.  Ownership of the array
+ *                and of its bitmasks passes to the core.
+ * @param count Number of entries in the updates array
+ */
+void qdr_core_set_routes(qdr_core_t *core, qdr_route_update_t *updates, int count);
+
+/**
+ * Record the number of route computations that the control plane has folded into
+ * an already scheduled computation.  The value is reported on the router entity.
+ *
+ * @param core Pointer to the core object
+ * @param count Running total of avoided route computations
+ */
+void qdr_core_set_recomputes_avoided(qdr_core_t *core, uint64_t count);
+
+/**
+ * Record the number of link-state and mobile-address requests that the control plane
+ * has queued and sent.  The values are reported on the router entity.
+ *
+ * @param core Pointer to the core object
+ * @param queued Number of requests currently held back by the request rate
+ * @param sent Running total of requests sent
+ */
+void qdr_core_set_request_counters(qdr_core_t *core, uint64_t queued, uint64_t sent);
+
+/**
+ * Mobile address handlers are called with a batch of address hashes that were added
+ * (or removed) consecutively.  The array and the strings are owned by the caller and
+ * are only valid for the duration of the call.
+ */
+typedef void (*qdr_mobile_added_t)   (void *context, const char **address_hashes, int count);
+typedef void (*qdr_mobile_removed_t) (void *context, const char **address_hashes, int count);
 typedef void (*qdr_link_lost_t)      (void *context, int link_maskbit);
 
 void qdr_core_route_table_handlers(qdr_core_t           *core, 
@@ -648,9 +701,9 @@ void qdr_manage_update(qdr_core_t *core, void *context, qd_router_entity_type_t
 /**
  * Sequence for running a query:
  *
- * 1) Locate the attributeNames field in the body of the QUERY request
+ * 1) Locate the attributeNames and filter fields in the body of the QUERY request
  * 2) Create a composed field for the body of the reply message
- * 3) Call qdr_manage_query with the attributeNames field and the response body
+ * 3) Call qdr_manage_query with the attributeNames and filter fields and the response body
  * 4) Start the body map, add the "attributeNames" key
  * 5) Call qdr_query_add_attribute_names.  This will add the attribute names list
  * 6) Add the "results" key, start the outer list
@@ -661,7 +714,8 @@ void qdr_manage_update(qdr_core_t *core, void *context, qd_router_entity_type_t
  */
 
 qdr_query_t *qdr_manage_query(qdr_core_t *core, void *context, qd_router_entity_type_t type, 
-                              qd_parsed_field_t *attribute_names, qd_composed_field_t *body);
+                              qd_parsed_field_t *attribute_names, qd_parsed_field_t *filter,
+                              qd_composed_field_t *body);
 void qdr_query_add_attribute_names(qdr_query_t *query);
 void qdr_query_get_first(qdr_query_t *query, int offset);
 void qdr_query_get_next(qdr_query_t *query);
@@ -168,14 +168,17 @@ class Node(object):
         Result returned by L{query}.
         @ivar attribute_names: List of attribute names for the results.
         @ivar results: list of lists of attribute values in same order as attribute_names
+        @ivar continuation: Value to pass to L{query} to get the results that follow,
+            None if there are no more results.
         """
-        def __init__(self, node, attribute_names, results):
+        def __init__(self, node, attribute_names, results, continuation=None):
             """
             @param response: the respose message to a query.
             """
             self.node = node
             self.attribute_names = attribute_names
             self.results = results
+            self.continuation = continuation
 
         def iter_dicts(self, clean=False):
             """
@@ -204,7 +207,8 @@ class Node(object):
         def __repr__(self):
             return "QueryResponse(attribute_names=%r, results=%r"%(self.attribute_names, self.results)
 
-    def query(self, type=None, attribute_names=None, offset=None, count=None):
+    def query(self, type=None, attribute_names=None, offset=None, count=None, continuation=None,
+              filter=None):
         """
         Send an AMQP management query message and return the response.
         At least one of type, attribute_names must be specified.
@@ -212,14 +216,22 @@ class Node(object):
         @keyword attribute_names: A list of attribute names to query.
         @keyword offset: An integer offset into the list of results to return.
         @keyword count: A count of the maximum number of results to return.
+        @keyword continuation: The L{QueryResponse.continuation} of a previous query,
+            to return the results that follow it.
+        @keyword filter: A condition such as 'undeliveredCount>0', or a list of conditions,
+            that the entities returned must match.
         @return: A L{QueryResponse}
         """
+        body = {u'attributeNames': attribute_names or []}
+        if filter is not None: body[u'filter'] = filter
         request = self.node_request(
-            {u'attributeNames': attribute_names or []},
-            operation=u'QUERY', entityType=type, offset=offset, count=count)
+            body,
+            operation=u'QUERY', entityType=type, offset=offset, count=count,
+            continuation=continuation)
 
         response = self.call(request)
-        return Node.QueryResponse(self, response.body[u'attributeNames'], response.body[u'results'])
+        return Node.QueryResponse(self, response.body[u'attributeNames'], response.body[u'results'],
+                                  response.body.get(u'continuation'))
 
     def create(self, attributes=None, type=None, name=None):
         """
@@ -54,8 +54,10 @@ class DisplayNameService(object):
         self.io_adapter = None
         self.log_adapter = LogAdapter("DISPLAYNAME")
 
-    def log(self, level, text):
+    def log(self, level, text, *args):
+        if not self.log_adapter.enabled(level): return
         info = traceback.extract_stack(limit=2)[0] # Caller frame info
+        if args: text = text % args
         self.log_adapter.log(level, text, info[0], info[1])
 
     def add(self, profile_name, profile_file_location):
@@ -80,8 +82,8 @@ class DisplayNameService(object):
             self.reload_all()
 
     def query(self, profile_name, user_id):
-        self.log(LOG_TRACE, "Received query for profile name %s, user id %s to DisplayNameService" %
-                 (profile_name, user_id))
+        self.log(LOG_TRACE, "Received query for profile name %s, user id %s to DisplayNameService",
+                 profile_name, user_id)
         ssl_profile = self.profile_dict.get(profile_name)
         if ssl_profile:
             profile_cache = self.profile_dict.get(profile_name).cache
@@ -66,8 +66,8 @@ Temporary solution is to lock the entire dispatch router lock during full refres
 Better solution coming soon...
 """
 
-import traceback, json, pstats
-from itertools import ifilter, chain
+import traceback, json, pstats, re, operator
+from itertools import ifilter, dropwhile
 from traceback import format_exc
 from threading import Lock
 from cProfile import Profile
@@ -80,6 +80,7 @@ from qpid_dispatch.management.error import ManagementError, OK, CREATED, NO_CONT
 from qpid_dispatch.management.entity import camelcase
 from .schema import ValidationError, SchemaEntity, EntityType
 from .qdrouter import QdSchema
+from ..compat import OrderedDict
 from ..router.message import Message
 from ..router.address import Address
 from ..policy.policy_manager import PolicyManager
@@ -534,10 +535,26 @@ class AllocatorEntity(EntityAdapter):
 class EntityCache(object):
     """
     Searchable cache of entities, can be refreshed from implementation objects.
+
+    Entities are indexed by identity, by name and by entity type. An entity is
+    indexed under its own type and all of its base types. Each entity is given a
+    sequence number when it is added, entities are kept in sequence number order so
+    queries can be resumed after a given entity.
+
+    The values of unique attributes are indexed by (type, attribute, value), where
+    type is the entity type that defines the attribute, so a new entity is checked
+    for uniqueness without validating the existing entities again.
     """
 
     def __init__(self, agent):
-        self.entities = []
+        self.entities = OrderedDict()   # sequence number => entity
+        self.indexes = {'identity': {}, 'name': {}} # attribute => {value => entity}
+        self.by_type = {}               # type name => OrderedDict sequence number => entity
+        self.unique = {}                # (type name, attribute, value) => entity
+        self.added = {}                 # id(entity) => (sequence number, unique keys when added)
+        self.not_interior = {}          # sequence number => router entity with mode other than interior
+        self.inter_router = {}          # sequence number => listener or connector with role inter-router
+        self.next_seq = 0
         self.implementations = {}
         self.agent = agent
         self.qd = self.agent.qd
@@ -546,23 +563,77 @@ class EntityCache(object):
 
     def map_filter(self, function, test):
         """Filter with test then apply function."""
-        return map(function, ifilter(test, self.entities))
+        return map(function, ifilter(test, self.entities.itervalues()))
 
     def map_type(self, function, type):
         """Apply function to all entities of type, if type is None do all entities"""
         if type is None:
-            return map(function, self.entities)
+            return map(function, self.entities.itervalues())
+        else:
+            if not isinstance(type, EntityType): type = self.schema.entity_type(type)
+            return map(function, self.by_type.get(type.name, {}).itervalues())
+
+    def iter_type(self, type, after=None):
+        """
+        Iterate over (sequence number, entity) for the entities of type in the order they
+        were added, if type is None do all entities. If after is not None start with the
+        first entity added after the one with that sequence number.
+        """
+        if type is None:
+            entities = self.entities
         else:
             if not isinstance(type, EntityType): type = self.schema.entity_type(type)
-            return map(function, ifilter(lambda e: e.entity_type.is_a(type), self.entities))
+            entities = self.by_type.get(type.name, {})
+        items = entities.iteritems()
+        if after is not None:
+            items = dropwhile(lambda item: item[0] <= after, items)
+        return items
+
+    def find(self, attribute, value):
+        """Return the entity with the 'identity' or 'name' attribute value, None if not found"""
+        return self.indexes[attribute].get(value)
+
+    def _entity_types(self, entity):
+        """The names of the types an entity is indexed under"""
+        return [entity.entity_type.name] + [t.name for t in entity.entity_type.all_bases]
+
+    def _unique_keys(self, entity):
+        """The (type name, attribute, value) keys of the unique attributes of entity"""
+        return [(a.defined_in.name, a.name, entity.attributes[a.name])
+                for a in entity.entity_type.attributes.itervalues()
+                if a.unique and entity.attributes.get(a.name) is not None]
+
+    def _validate_add(self, entity, keys):
+        """Validate a new entity in the context of the existing entities"""
+        entity_type = entity.entity_type
+        if entity_type.singleton and self.by_type.get(entity_type.name):
+            raise ValidationError("Multiple instances of singleton '%s'" % entity_type.name)
+        for type_name, attribute, value in keys:
+            if (type_name, attribute, value) in self.unique:
+                raise ValidationError("%s: Duplicate value '%s' for unique attribute '%s'" %
+                                      (entity_type, value, attribute))
+        if self.schema.is_inter_router(entity) and self.not_interior:
+            raise self.schema.inter_router_error(entity)
+        if self.schema.is_not_interior(entity) and self.inter_router:
+            raise self.schema.inter_router_error(self.inter_router.itervalues().next())
 
     def add(self, entity):
         """Add an entity to the agent"""
-        self.log(LOG_DEBUG, "Add entity: %s" % entity)
+        self.log(LOG_DEBUG, "Add entity: %s", entity)
         entity.validate()       # Fill in defaults etc.
-        # Validate in the context of the existing entities for uniqueness
-        self.schema.validate_full(chain(iter([entity]), iter(self.entities)))
-        self.entities.append(entity)
+        keys = self._unique_keys(entity)
+        self._validate_add(entity, keys)
+        seq = self.next_seq
+        self.next_seq += 1
+        self.entities[seq] = entity
+        self.added[id(entity)] = (seq, keys)
+        for key in keys:
+            self.unique[key] = entity
+            if key[1] in self.indexes: self.indexes[key[1]][key[2]] = entity
+        if self.schema.is_not_interior(entity): self.not_interior[seq] = entity
+        if self.schema.is_inter_router(entity): self.inter_router[seq] = entity
+        for type_name in self._entity_types(entity):
+            self.by_type.setdefault(type_name, OrderedDict())[seq] = entity
 
     def _add_implementation(self, implementation, adapter=None):
         """Create an adapter to wrap the implementation object and add it"""
@@ -573,16 +644,25 @@ class EntityCache(object):
         adapter._add_implementation(implementation)
         adapter._refresh()
         self.add(adapter)
+        return adapter
 
     def add_implementation(self, implementation, adapter=None):
         self._add_implementation(implementation, adapter=adapter)
 
     def _remove(self, entity):
-        try:
-            self.entities.remove(entity)
-            self.log(LOG_DEBUG, "Remove %s entity: %s" %
-                     (entity.entity_type.short_name, entity.attributes['identity']))
-        except ValueError: pass
+        if id(entity) not in self.added:
+            return
+        seq, keys = self.added.pop(id(entity))
+        del self.entities[seq]
+        for key in keys:
+            del self.unique[key]
+            if key[1] in self.indexes: del self.indexes[key[1]][key[2]]
+        self.not_interior.pop(seq, None)
+        self.inter_router.pop(seq, None)
+        for type_name in self._entity_types(entity):
+            del self.by_type[type_name][seq]
+        self.log(LOG_DEBUG, "Remove %s entity: %s",
+                 entity.entity_type.short_name, entity.attributes['identity'])
 
     def remove(self, entity):
         self._remove(entity)
@@ -596,8 +676,20 @@ class EntityCache(object):
     def remove_implementation(self, key):
         self._remove_implementation(key)
 
-    def refresh_from_c(self):
-        """Refresh entities from the C dispatch runtime"""
+    def refresh_from_c(self, select=None):
+        """
+        Refresh entities from the C dispatch runtime.
+
+        Entities added and removed in C since the last refresh are always applied, new
+        entities are refreshed as they are added. Existing entities are only refreshed
+        if they are returned by select(), which is called once the cache is up to date.
+        If select is None all entities are refreshed. Each entity is refreshed at most
+        once, as soon as select() returns it, so select() can be a generator that looks
+        at the refreshed attributes to decide what to refresh next.
+
+        The C runtime only reports entities being added and removed, not changes to
+        their attributes, so only an entity added by this refresh is known to be fresh.
+        """
         REMOVE, ADD = 0, 1
 
         def remove_redundant(events):
@@ -621,18 +713,92 @@ class EntityCache(object):
             events = []
             self.qd.qd_entity_refresh_begin(events)
             remove_redundant(events)
+            fresh = set()       # id() of the entities refreshed by this call
             for action, type, pointer in events:
                 if action == REMOVE:
                     self._remove_implementation(pointer)
                 elif action == ADD:
                     entity_type = self.schema.entity_type(type)
-                    self._add_implementation(CImplementation(self.qd, entity_type, pointer))
+                    fresh.add(id(self._add_implementation(CImplementation(self.qd, entity_type, pointer))))
             # Refresh the entity values while the lock is still held.
-            for e in self.entities: e._refresh()
+            if select is None: targets = self.entities.itervalues()
+            else: targets = select()
+            for e in targets:
+                if id(e) not in fresh:
+                    fresh.add(id(e))
+                    e._refresh()
         finally:
             self.qd.qd_entity_refresh_end()
             self.qd.qd_dispatch_router_unlock(self.agent.dispatch)
 
+class QueryFilter(object):
+    """
+    Filter for the entities returned by a QUERY. The filter is a condition, or a list
+    of conditions that must all match, of the form <attribute><operator><value> where the
+    operator is one of = != < <= > >= or ^= (prefix), e.g. 'undeliveredCount>0'.
+
+    Order comparisons are numeric. = and != compare numeric attributes as numbers and
+    other attributes as text. Attributes that are missing, or are neither numbers nor
+    text, only match !=.
+    """
+
+    TERM = re.compile(r'^([\w.]+)(!=|<=|>=|\^=|=|<|>)(.*)$', re.DOTALL)
+    ORDER = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+    def __init__(self, expression):
+        if isinstance(expression, basestring): expression = [expression]
+        if not isinstance(expression, (list, tuple)):
+            raise BadRequestStatus("Invalid filter %r" % (expression,))
+        self.terms = []
+        for term in expression:
+            match = isinstance(term, basestring) and self.TERM.match(term)
+            if not match:
+                raise BadRequestStatus("Invalid filter condition %r" % (term,))
+            name, op, text = match.groups()
+            number = self._number(text)
+            if op in self.ORDER and number is None:
+                raise BadRequestStatus("Filter condition %r compares with a value that is not a number" % term)
+            self.terms.append((name, op, text, number))
+
+    @staticmethod
+    def _number(text):
+        for convert in (int, float):
+            try: return convert(text)
+            except ValueError: pass
+        return None
+
+    def attributes(self):
+        """The names of the attributes the filter refers to"""
+        return set(term[0] for term in self.terms)
+
+    def match(self, attributes):
+        """True if an entity with attributes passes the filter"""
+        for name, op, text, number in self.terms:
+            value = attributes.get(name)
+            if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                if number is None or op == '^=':
+                    matched = op == '!='
+                elif op == '=':
+                    matched = value == number
+                elif op == '!=':
+                    matched = value != number
+                else:
+                    matched = self.ORDER[op](value, number)
+            else:
+                if isinstance(value, bool): value = value and 'true' or 'false'
+                if not isinstance(value, basestring):
+                    matched = op == '!='
+                elif op == '=':
+                    matched = value == text
+                elif op == '!=':
+                    matched = value != text
+                elif op == '^=':
+                    matched = value.startswith(text)
+                else:
+                    matched = False
+            if not matched: return False
+        return True
+
 class ManagementEntity(EntityAdapter):
     """An entity representing the agent itself. It is a singleton created by the agent."""
 
@@ -647,7 +813,20 @@ class ManagementEntity(EntityAdapter):
         else: return None
 
     def query(self, request):
-        """Management node query operation"""
+        """
+        Management node query operation.
+
+        Results are in the order the entities were added. The 'offset' and 'count'
+        request properties select a page of the results. If there are more results
+        after the page the response body has a 'continuation' value; a request with
+        that value as its 'continuation' property returns the results that follow,
+        unaffected by entities added or removed in the meantime.
+
+        A 'filter' in the request body selects the entities returned, see L{QueryFilter}.
+
+        Only the entities the query looks at are refreshed, and they are refreshed as
+        the query reaches them: all candidates up to the end of the page.
+        """
         entity_type = self.requested_type(request)
         if entity_type:
             all_attrs = set(entity_type.attributes.keys())
@@ -666,17 +845,49 @@ class ManagementEntity(EntityAdapter):
         else:
             names = all_attrs
 
-        results = []
-        def add_result(entity):
-            result = []
-            non_empty = False
-            for name in names:
-                result.append(entity.attributes.get(name))
-                if result[-1] is not None: non_empty = True
-            if non_empty: results.append(result)
+        query_filter = request.body.get('filter')
+        if query_filter is not None:
+            query_filter = QueryFilter(query_filter)
+            unknown = query_filter.attributes() - all_attrs
+            if unknown:
+                raise NotFoundStatus("Unknown filter attributes %s." % list(unknown))
 
-        self._agent.entities.map_type(add_result, entity_type)
-        return (OK, {'attributeNames': list(names), 'results': results})
+        offset = self._intprop(request, 'offset') or 0
+        count = self._intprop(request, 'count')
+        if count is not None and count < 0: count = None
+        continuation = self._intprop(request, 'continuation')
+
+        results = []
+        page = {'last': None, 'more': False}
+
+        def examine():
+            """
+            Yield each entity to be refreshed before looking at its attributes, stop
+            once the page is complete.
+            """
+            offset_left = offset
+            for seq, entity in self._agent.entities.iter_type(entity_type, after=continuation):
+                yield entity
+                if query_filter and not query_filter.match(entity.attributes): continue
+                result = []
+                non_empty = False
+                for name in names:
+                    result.append(entity.attributes.get(name))
+                    if result[-1] is not None: non_empty = True
+                if not non_empty: continue
+                if offset_left:
+                    offset_left -= 1
+                    continue
+                if count is not None and len(results) == count:
+                    page['more'] = True
+                    return
+                results.append(result)
+                page['last'] = seq
+
+        self._agent.entities.refresh_from_c(examine)
+        body = {'attributeNames': list(names), 'results': results}
+        if page['more'] and page['last'] is not None: body['continuation'] = page['last']
+        return (OK, body)
 
     def get_types(self, request):
         type = self.requested_type(request)
@@ -713,8 +924,10 @@ class ManagementEntity(EntityAdapter):
 
     def _intprop(self, request, prop):
         value = request.properties.get(prop)
-        if value is not None: value = int(value)
-        return value
+        if value is None: return None
+        try: return int(value)
+        except (TypeError, ValueError):
+            raise BadRequestStatus("'%s' property must be an integer: %r" % (prop, value))
 
     def get_json_schema(self, request):
         return (OK, json.dumps(self._schema.dump(), indent=self._intprop(request, "indent")))
@@ -768,14 +981,17 @@ class Agent(object):
         self.management = self.create_entity({"type": "management"})
         self.add_entity(self.management)
 
-    def log(self, level, text):
+    def log(self, level, text, *args):
+        """Log text % args, formatting only if level is enabled"""
+        if not self.log_adapter.enabled(level): return
         info = traceback.extract_stack(limit=2)[0] # Caller frame info
+        if args: text = text % args
         self.log_adapter.log(level, text, info[0], info[1])
 
     def activate(self, address):
         """Register the management address to receive management requests"""
         self.entities.refresh_from_c()
-        self.log(LOG_INFO, "Activating management agent on %s" % address)
+        self.log(LOG_INFO, "Activating management agent on %s", address)
         self.io = IoAdapter(self.receive, address, 'L', '0', TREATMENT_ANYCAST_CLOSEST)
 
     def entity_class(self, entity_type):
@@ -806,11 +1022,11 @@ class Agent(object):
             correlation_id=request.correlation_id,
             properties={'statusCode': status, 'statusDescription': description},
             body=body)
-        self.log(LOG_DEBUG, "Agent response:\n  %s\n  Responding to: \n  %s"%(response, request))
+        self.log(LOG_DEBUG, "Agent response:\n  %s\n  Responding to: \n  %s", response, request)
         try:
             self.io.send(response)
         except:
-            self.log(LOG_ERROR, "Can't respond to %s: %s"%(request, format_exc()))
+            self.log(LOG_ERROR, "Can't respond to %s: %s", request, format_exc())
 
     def receive(self, request, unused_link_id, unused_cost):
         """Called when a management request is received."""
@@ -826,8 +1042,10 @@ class Agent(object):
         # Coarse locking, handle one request at a time.
         with self.request_lock:
             try:
-                self.entities.refresh_from_c()
-                self.log(LOG_DEBUG, "Agent request %s"% request)
+                # A QUERY refreshes the entities it looks at as it goes.
+                if (request.properties.get('operation') or '').upper() != 'QUERY':
+                    self.entities.refresh_from_c(lambda: self.refresh_targets(request))
+                self.log(LOG_DEBUG, "Agent request %s", request)
                 status, body = self.handle(request)
                 self.respond(request, status=status, body=body)
             except ManagementError, e:
@@ -837,6 +1055,26 @@ class Agent(object):
             except Exception, e:
                 error(InternalServerErrorStatus("%s: %s"%(type(e).__name__, e)), format_exc())
 
+    def refresh_targets(self, request):
+        """
+        Return the entities whose attributes must be refreshed to handle request:
+        the target entity of an entity operation. A QUERY refreshes the entities it
+        looks at itself, see L{ManagementEntity.query}.
+        """
+        operation = (request.properties.get('operation') or '').upper()
+        if operation == 'CREATE':
+            return []
+        try:
+            target = self.find_entity(request)
+            if target is not self.management:
+                return [target]
+        except (ManagementError, ValidationError):
+            # The request itself will fail with the same error, nothing to refresh.
+            return []
+        if operation == 'GET-MGMT-NODES':
+            return self.find_entity_by_type('router') + self.find_entity_by_type('router.node')
+        return []
+
     def entity_type(self, type):
         try: return self.schema.entity_type(type)
         except ValidationError, e: raise NotFoundStatus(str(e))
@@ -937,13 +1175,8 @@ class Agent(object):
             return " ".join(["%s=%r" % (k, v) for k, v in ids.iteritems()])
 
         k, v = ids.iteritems().next() # Get the first id attribute
-        found = self.entities.map_filter(None, lambda e: e.attributes.get(k) == v)
-        if len(found) == 1:
-            entity = found[0]
-        elif len(found) > 1:
-            raise InternalServerErrorStatus(
-                "Duplicate (%s) entities with %s=%r" % (len(found), k, v))
-        else:
+        entity = self.entities.find(k, v)
+        if entity is None:
             raise NotFoundStatus("No entity with %s" % attrvals())
 
         for k, v in ids.iteritems():
@@ -59,13 +59,24 @@ class QdSchema(schema.Schema):
         super(QdSchema, self).validate_all(entities, **kwargs)
         inter_router = not_interior = None
         for e in entities:
-            if self.short_name(e.type) == "router" and e.mode != "interior":
+            if self.is_not_interior(e):
                 not_interior = e.mode
-            if self.short_name(e.type) in ["listener", "connector"] and e.role == "inter-router":
+            if self.is_inter_router(e):
                 inter_router = e
             if not_interior and inter_router:
-                raise schema.ValidationError(
-                    "role='inter-router' only allowed with router mode='interior' for %s." % inter_router)
+                raise self.inter_router_error(inter_router)
+
+    def is_not_interior(self, entity):
+        """True if entity is a router with a mode other than interior"""
+        return self.short_name(entity.type) == "router" and entity.mode != "interior"
+
+    def is_inter_router(self, entity):
+        """True if entity is a listener or connector with role inter-router"""
+        return self.short_name(entity.type) in ["listener", "connector"] and entity.role == "inter-router"
+
+    def inter_router_error(self, inter_router):
+        return schema.ValidationError(
+            "role='inter-router' only allowed with router mode='interior' for %s." % inter_router)
 
     def is_configuration(self, entity_type):
         return entity_type and self.configuration_entity in entity_type.all_bases
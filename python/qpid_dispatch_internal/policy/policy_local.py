@@ -664,7 +664,7 @@ class PolicyLocal(object):
             if groupname not in ruleset[PolicyKeys.KW_GROUPS]:
                 self._manager.log_trace(
                         "lookup_settings fail for vhost '%s', user group '%s': "
-                        "This vhost has no settings for the user group" % (vhost, groupname))
+                        "This vhost has no settings for the user group", vhost, groupname)
                 return False
 
             upolicy.update(ruleset[PolicyKeys.KW_GROUPS][groupname])
@@ -687,7 +687,7 @@ class PolicyLocal(object):
                 del self._connections[conn_id]
         except Exception, e:
             self._manager.log_trace(
-                "Policy internal error closing connection id %s. %s" % (conn_id, str(e)))
+                "Policy internal error closing connection id %s. %s", conn_id, e)
 
     #
     #
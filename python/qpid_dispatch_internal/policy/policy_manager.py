@@ -44,25 +44,29 @@ class PolicyManager(object):
         self._policy_local = PolicyLocal(self)
         self.log_adapter = LogAdapter("POLICY")
 
-    def log(self, level, text):
+    def log(self, level, text, *args):
+        if not self.log_adapter.enabled(level): return
         info = traceback.extract_stack(limit=2)[0] # Caller frame info
+        if args: text = text % args
         self.log_adapter.log(level, text, info[0], info[1])
 
-    def _log(self, level, text):
+    def _log(self, level, text, args):
+        if not self.log_adapter.enabled(level): return
         info = traceback.extract_stack(limit=3)[0] # Caller's caller frame info
+        if args: text = text % args
         self.log_adapter.log(level, text, info[0], info[1])
 
-    def log_debug(self, text):
-        self._log(LOG_DEBUG, text)
+    def log_debug(self, text, *args):
+        self._log(LOG_DEBUG, text, args)
 
-    def log_info(self, text):
-        self._log(LOG_INFO, text)
+    def log_info(self, text, *args):
+        self._log(LOG_INFO, text, args)
 
-    def log_trace(self, text):
-        self._log(LOG_TRACE, text)
+    def log_trace(self, text, *args):
+        self._log(LOG_TRACE, text, args)
 
-    def log_error(self, text):
-        self._log(LOG_ERROR, text)
+    def log_error(self, text, *args):
+        self._log(LOG_ERROR, text, args)
 
     def get_agent(self):
         return self._agent
@@ -0,0 +1,464 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from ..dispatch import LOG_INFO, LOG_TRACE, LOG_DEBUG
+from data import MessageASU, MessageASR, getInterval
+
+##
+## The backbone area.  Every other area is attached directly to the backbone.
+##
+BACKBONE_AREA = '0'
+
+##
+## Shortest time in seconds between two computations of the summaries sent by this router
+##
+SUMMARY_MIN_INTERVAL = 1.0
+
+
+def summary_addresses(summary):
+    """
+    Return the set of address hashes covered by an area summary: the area address of each
+    summarized area and the mobile addresses attached in it.
+    """
+    addrs = set()
+    for area, entry in summary.items():
+        addrs.add('A' + area)
+        addrs.update(entry['addrs'])
+    return addrs
+
+
+def summary_delta(old, new):
+    """
+    Return the changes from summary old to summary new as the update and remove fields of a
+    differential ASU.
+    """
+    update = {}
+    for area, entry in new.items():
+        old_entry = old.get(area)
+        if old_entry:
+            old_addrs = set(old_entry['addrs'])
+        else:
+            old_addrs = set()
+        addrs = set(entry['addrs'])
+        added   = sorted(addrs - old_addrs)
+        deleted = sorted(old_addrs - addrs)
+        if not old_entry or old_entry['cost'] != entry['cost'] or added or deleted:
+            update[area] = {'cost' : entry['cost'], 'add' : added, 'del' : deleted}
+    return update, sorted(area for area in old if area not in new)
+
+
+def apply_summary_delta(summary, update, remove):
+    """
+    Return the summary that results from applying the changes of a differential ASU to summary
+    """
+    result = dict((area, entry) for area, entry in summary.items() if area not in remove)
+    for area, change in update.items():
+        entry = result.get(area)
+        if entry:
+            addrs = set(entry['addrs'])
+        else:
+            addrs = set()
+        addrs.difference_update(change['del'])
+        addrs.update(change['add'])
+        result[area] = {'cost' : change['cost'], 'addrs' : sorted(addrs)}
+    return result
+
+
+class AreaEngine(object):
+    """
+    This module is responsible for routing between areas.
+
+    Routers exchange link state and mobile addresses only with the routers in their own area.
+    Area '0' is the backbone and every other area is attached to it by border adjacencies:
+    neighbors, discovered by the HELLO protocol, that are in a different area.  A border
+    adjacency between two non-backbone areas is not used.
+
+    Across a border, each router sends its neighbor an Area Summary Update (ASU) carrying, for
+    each area it can reach, a cost and the mobile addresses attached in that area.  A router in
+    a non-backbone area summarizes only its own area; a backbone router also summarizes the
+    other areas it knows of, except the area of the neighbor it is sending to.  Within its own
+    area, a router with border neighbors floods an ASU for the areas reached through them.
+
+    The summarized destinations are mapped in the router core to the router through which they
+    are reached, so the link-state computation covers only the routers of the area and MAUs are
+    only flooded within it.  Mobile addresses are forwarded across the border, not summarized:
+    the core has no prefix matching for them, so every router still holds every mobile address
+    in the network, but learns those in other areas from the few border routers of its area.
+
+    Summaries are recomputed only when something they are built from changes: a border
+    neighbor or its summary, or the mobile addresses, area summaries or routes of the routers
+    in this area.  Recomputations are spaced by at least SUMMARY_MIN_INTERVAL.  A changed summary
+    is sent as the differences from the previous one.  The only periodic work is advertising
+    the sequence of the current summaries every raInterval, like an RA; a router that doesn't
+    hold that sequence sends an Area Summary Request (ASR) and is sent the whole summary.
+    """
+    def __init__(self, container, node_tracker):
+        self.container        = container
+        self.node_tracker     = node_tracker
+        self.id               = container.id
+        self.area             = container.area
+        self.neighbor_max_age = getInterval(container.config, 'helloMaxAge')
+        self.resend_interval  = getInterval(container.config, 'raInterval')
+        self.neighbors        = {}     # node-id => BorderNeighbor
+        self.neighbors_by_link_id = {} # link-id => BorderNeighbor
+        self.rejected         = set()  # (node-id, area) pairs of unusable adjacencies already logged
+        self.exports          = {}     # to-area => [summary, seq, last-advertised-time]
+        self.seq              = 0
+        self.last_export      = -SUMMARY_MIN_INTERVAL
+        self.next_export      = None
+
+
+    def tick(self, now):
+        self._expire_neighbors(now)
+
+        ##
+        ## The node tracker flags changes in the mobile addresses, area summaries and routes
+        ## of the routers in this area, from which the summaries sent across the border are
+        ## built.
+        ##
+        if self.node_tracker.summary_changed:
+            self.node_tracker.summary_changed = False
+            if self.neighbors:
+                self._schedule_export(now)
+
+        if self.next_export != None and now >= self.next_export:
+            self.last_export = now
+            self.next_export = None
+            targets = {self.area : self._intra_summary()}
+            for neighbor in self.neighbors.values():
+                if neighbor.area not in targets:
+                    targets[neighbor.area] = self._border_summary(neighbor.area)
+            for to_area, summary in targets.items():
+                self._export(to_area, summary, now)
+            for to_area in self.exports.keys():
+                if to_area not in targets:
+                    self.exports.pop(to_area)
+
+        ##
+        ## Advertising the sequence of the current summaries is the only periodic work
+        ##
+        for to_area, export in self.exports.items():
+            if now - export[2] >= self.resend_interval:
+                export[2] = now
+                self._send(to_area, MessageASU(None, self.id, self.area, to_area, export[1]))
+
+
+    def next_deadline(self, now):
+        """
+        Return the time at which this engine next needs a tick, or None if it has nothing
+        scheduled.
+        """
+        deadline = self.next_export
+        if self.node_tracker.summary_changed and self.neighbors:
+            due = max(now, self.last_export + SUMMARY_MIN_INTERVAL)
+            if deadline == None or due < deadline:
+                deadline = due
+        for export in self.exports.values():
+            if deadline == None or export[2] + self.resend_interval < deadline:
+                deadline = export[2] + self.resend_interval
+        for neighbor in self.neighbors.values():
+            expires = neighbor.refresh_time + self.neighbor_max_age
+            if deadline == None or expires < deadline:
+                deadline = expires
+        return deadline
+
+
+    def neighbor_refresh(self, node_id, area, instance, link_id, cost, now):
+        """
+        Invoked when the hello protocol has confirmed bi-directional connectivity with a
+        neighbor router in a different area.
+        """
+        if BACKBONE_AREA not in (area, self.area):
+            if (node_id, area) not in self.rejected:
+                self.rejected.add((node_id, area))
+                self.container.log(LOG_INFO, "Ignoring neighbor %s in area %s: only the backbone may border other areas",
+                                   node_id, area)
+            return
+
+        neighbor = self.neighbors.get(node_id)
+        if neighbor and (neighbor.area != area or neighbor.instance != instance):
+            self._remove(neighbor, now)
+            neighbor = None
+        if not neighbor:
+            neighbor = BorderNeighbor(self, node_id, area, instance)
+            self.neighbors[node_id] = neighbor
+            self.exports.pop(area, None)
+            self._schedule_export(now)
+            self.container.log(LOG_INFO, "Area border neighbor %s in area %s", node_id, area)
+
+        if neighbor.set_link_id(link_id):
+            self.neighbors_by_link_id[link_id] = neighbor
+        if neighbor.set_cost(cost):
+            self._schedule_export(now)
+        neighbor.refresh_time = now
+
+
+    def link_lost(self, link_id, now):
+        neighbor = self.neighbors_by_link_id.get(link_id)
+        if neighbor:
+            self._remove(neighbor, now)
+
+
+    def handle_asu(self, msg, now):
+        if msg.id == self.id or msg.to_area != self.area:
+            return
+
+        if msg.area == self.area:
+            ##
+            ## A summary from a border router in this area.  Map the summarized destinations
+            ## to that router.
+            ##
+            node = self.node_tracker.nodes.get(msg.id)
+            if not node:
+                return
+            summary = self._received(msg, node.summary_seq, node.area_summary)
+            if summary == None:
+                return
+            node.summary_seq  = msg.seq
+            node.area_summary = summary
+            node.set_summary(summary_addresses(summary))
+        else:
+            ##
+            ## A summary from a neighbor across the area border
+            ##
+            neighbor = self.neighbors.get(msg.id)
+            if not neighbor or neighbor.area != msg.area:
+                return
+            summary = self._received(msg, neighbor.summary_seq, neighbor.summary)
+            if summary == None:
+                return
+            neighbor.set_summary(msg.seq, summary)
+
+        if self.neighbors:
+            self._schedule_export(now)
+
+
+    def handle_asr(self, msg, now):
+        if msg.target != self.id:
+            return
+        if msg.area == self.area:
+            self.summary_requested(msg.id)
+        else:
+            neighbor = self.neighbors.get(msg.id)
+            export   = self.exports.get(msg.area)
+            if neighbor and neighbor.area == msg.area and export:
+                self._send(msg.area, MessageASU(None, self.id, self.area, msg.area, export[1], export[0]))
+
+
+    def summary_requested(self, node_id):
+        """
+        Invoked when a router in this area has requested our link state or our summary.  Send
+        it our whole summary so that it does not have to wait for the next advertisement.
+        """
+        export = self.exports.get(self.area)
+        if export:
+            self._send(self.area, MessageASU(None, self.id, self.area, self.area, export[1], export[0]),
+                       'amqp:/_topo/%s/%s/qdrouter' % (self.area, node_id))
+
+
+    def _received(self, msg, have_seq, have_summary):
+        """
+        Return the summary given by an ASU from a router whose summary at have_seq is held, or
+        None if there is nothing new to apply.  A router whose summary can't be brought up to
+        date from the ASU is asked for its whole summary.
+        """
+        if msg.seq == have_seq:
+            return None
+        if msg.summary != None:
+            return msg.summary
+        if msg.base != None and msg.base == have_seq:
+            return apply_summary_delta(have_summary, msg.update, msg.remove)
+        self._send(msg.area, MessageASR(None, self.id, self.area, msg.id),
+                   'amqp:/_topo/%s/%s/qdrouter' % (self.area, msg.id))
+        return None
+
+
+    def _schedule_export(self, now):
+        due = max(now, self.last_export + SUMMARY_MIN_INTERVAL)
+        if self.next_export == None or due < self.next_export:
+            self.next_export = due
+
+
+    def _expire_neighbors(self, now):
+        for neighbor in self.neighbors.values():
+            if now >= neighbor.refresh_time + self.neighbor_max_age:
+                self._remove(neighbor, now)
+
+
+    def _remove(self, neighbor, now):
+        self.neighbors.pop(neighbor.id)
+        if self.neighbors_by_link_id.get(neighbor.link_id) == neighbor:
+            self.neighbors_by_link_id.pop(neighbor.link_id)
+        neighbor.delete()
+        self._schedule_export(now)
+        self.container.log(LOG_INFO, "Area border neighbor %s in area %s lost", neighbor.id, neighbor.area)
+
+
+    def _add_area(self, summary, area, cost, addrs):
+        entry = summary.get(area)
+        if entry == None:
+            summary[area] = {'cost' : cost, 'addrs' : set(addrs)}
+        else:
+            entry['cost'] = min(entry['cost'], cost)
+            entry['addrs'].update(addrs)
+
+
+    def _finish(self, summary):
+        for entry in summary.values():
+            entry['cost']  = long(entry['cost'])
+            entry['addrs'] = sorted(entry['addrs'])
+        return summary
+
+
+    def _intra_summary(self):
+        """
+        The summary flooded into this area: the areas reached through this router's own
+        border neighbors.
+        """
+        summary = {}
+        for neighbor in self.neighbors.values():
+            for area, entry in neighbor.summary.items():
+                if area != self.area:
+                    self._add_area(summary, area, neighbor.cost + entry['cost'], entry['addrs'])
+        return self._finish(summary)
+
+
+    def _border_summary(self, to_area):
+        """
+        The summary sent to the border neighbors in to_area: this area and, if this router is
+        in the backbone, the other areas known to it.
+        """
+        addrs = set(self.container.mobile_address_engine.local_addrs)
+        for node in self.node_tracker.nodes.values():
+            addrs.update(node.mobile_addresses)
+        summary = {self.area : {'cost' : 0, 'addrs' : addrs}}
+
+        if self.area == BACKBONE_AREA:
+            for neighbor in self.neighbors.values():
+                for area, entry in neighbor.summary.items():
+                    if area not in (to_area, self.area):
+                        self._add_area(summary, area, neighbor.cost + entry['cost'], entry['addrs'])
+            for node in self.node_tracker.nodes.values():
+                if node.cost == None or not node.is_reachable():
+                    continue
+                for area, entry in node.area_summary.items():
+                    if area not in (to_area, self.area):
+                        self._add_area(summary, area, node.cost + entry['cost'], entry['addrs'])
+        return self._finish(summary)
+
+
+    def _export(self, to_area, summary, now):
+        """
+        Send a summary if it has changed since it was last sent, as the differences from the
+        last one if there was one
+        """
+        export = self.exports.get(to_area)
+        if export and export[0] == summary:
+            return
+        if not export and not summary:
+            return
+        self.seq += 1
+        if export:
+            update, remove = summary_delta(export[0], summary)
+            msg = MessageASU(None, self.id, self.area, to_area, self.seq, _base=export[1],
+                             _update=update, _remove=remove)
+        else:
+            msg = MessageASU(None, self.id, self.area, to_area, self.seq, summary)
+        self.exports[to_area] = [summary, self.seq, now]
+        self._send(to_area, msg)
+
+
+    def _send(self, to_area, msg, dest=None):
+        if to_area != self.area:
+            ##
+            ## Messages for other areas go to the neighbors on the other side of the border.
+            ## They are sent link-local like HELLOs; only the routers they are meant for
+            ## accept them.
+            ##
+            dest = 'amqp:/_local/qdhello'
+        elif not dest:
+            dest = 'amqp:/_topo/%s/all/qdrouter' % self.area
+        self.container.send(dest, msg)
+        self.container.log_ls(LOG_TRACE, "SENT: %r", msg)
+
+
+
+class BorderNeighbor(object):
+    """
+    BorderNeighbor tracks a neighbor router in a different area.  It is known to the router
+    core as a border router, which does not take part in the flooding of this area's control
+    messages, and the destinations it summarizes are mapped to it.
+    """
+
+    def __init__(self, parent, node_id, area, instance):
+        self.parent       = parent
+        self.adapter      = parent.container.router_adapter
+        self.log          = parent.container.log
+        self.id           = node_id
+        self.area         = area
+        self.instance     = instance
+        self.maskbit      = parent.node_tracker._allocate_maskbit()
+        self.link_id      = None
+        self.cost         = None
+        self.refresh_time = 0.0
+        self.summary      = {}
+        self.summary_seq  = None
+        self.addresses    = set()
+        self.adapter.add_border_router("amqp:/_topo/%s/%s@%s/qdrouter" % (parent.area, node_id, area), self.maskbit)
+        self.log(LOG_TRACE, "Border node %s created: area=%s maskbit=%d", self.id, self.area, self.maskbit)
+
+
+    def set_link_id(self, link_id):
+        if self.link_id == link_id:
+            return False
+        self.link_id = link_id
+        self.adapter.set_link(self.maskbit, link_id)
+        return True
+
+
+    def set_cost(self, cost):
+        if self.cost != cost:
+            self.cost = cost
+            self.adapter.set_routes([(self.maskbit, -1, cost, None, None, None)])
+            return True
+        return False
+
+
+    def set_summary(self, seq, summary):
+        self.summary_seq = seq
+        self.summary     = summary
+        addrs   = summary_addresses(summary)
+        added   = addrs - self.addresses
+        deleted = self.addresses - addrs
+        self.addresses = addrs
+        for a in added:
+            self.adapter.map_destination(a, self.maskbit)
+        for a in deleted:
+            self.adapter.unmap_destination(a, self.maskbit)
+        if added or deleted:
+            self.log(LOG_DEBUG, "Border node %s summarizes %d destinations", self.id, len(addrs))
+
+
+    def delete(self):
+        for a in self.addresses:
+            self.adapter.unmap_destination(a, self.maskbit)
+        self.addresses = set()
+        self.adapter.del_router(self.maskbit)
+        self.parent.node_tracker._free_maskbit(self.maskbit)
+        self.log(LOG_TRACE, "Border node %s deleted", self.id)
@@ -41,21 +41,34 @@ def getOptional(data, key, default=None, cls=None):
     return default
 
 
+def getInterval(config, name):
+    """
+    Get a time interval from the router configuration in seconds.  If the millisecond form
+    of the attribute (name + 'Ms') is set, it takes precedence over the whole-second form.
+    """
+    msec = config.attributes.get(name + 'Ms')
+    if msec != None:
+        return msec / 1000.0
+    return float(config[name])
+
+
 class LinkState(object):
     """
     The link-state of a single router.  The link state consists of a list of neighbor routers reachable from
     the reporting router.  The link-state-sequence number is incremented each time the link state changes.
     """
-    def __init__(self, body, _id=None, _ls_seq=None, _peers=None):
+    __slots__ = ('last_seen', 'id', 'area', 'ls_seq', 'peers')
+
+    def __init__(self, body, _id=None, _ls_seq=None, _peers=None, _area='0'):
         self.last_seen = 0
         if body:
             self.id = getMandatory(body, 'id', str)
-            self.area = '0'
+            self.area = getOptional(body, 'area', '0', str)
             self.ls_seq = getMandatory(body, 'ls_seq', long)
             self.peers = getMandatory(body, 'peers', dict)
         else:
             self.id = _id
-            self.area = '0'
+            self.area = _area
             self.ls_seq = long(_ls_seq)
             self.peers = _peers
 
@@ -100,16 +113,22 @@ class MessageHELLO(object):
     scope: neighbors only - HELLO messages travel at most one hop
     This message is used by directly connected routers to determine with whom they have
     bidirectional connectivity.
+
+    HELLOs are sent unchanged every hello interval, so the encoded body is cached.  A
+    message must not be modified once it has been encoded.
     """
-    def __init__(self, body, _id=None, _seen_peers=None, _instance=long(0)):
+    __slots__ = ('id', 'area', 'seen_peers', 'instance', '_body')
+
+    def __init__(self, body, _id=None, _seen_peers=None, _instance=long(0), _area='0'):
+        self._body = None
         if body:
             self.id = getMandatory(body, 'id', str)
-            self.area = '0'
+            self.area = getOptional(body, 'area', '0', str)
             self.seen_peers = getMandatory(body, 'seen', list)
             self.instance = getOptional(body, 'instance', 0, long)
         else:
             self.id   = _id
-            self.area = '0'
+            self.area = _area
             self.seen_peers = _seen_peers
             self.instance = _instance
 
@@ -120,10 +139,12 @@ class MessageHELLO(object):
         return 'HELLO'
 
     def to_dict(self):
-        return {'id'       : self.id,
-                'area'     : self.area,
-                'instance' : self.instance,
-                'seen'     : self.seen_peers}
+        if self._body is None:
+            self._body = {'id'       : self.id,
+                          'area'     : self.area,
+                          'instance' : self.instance,
+                          'seen'     : self.seen_peers}
+        return self._body
 
     def is_seen(self, _id):
         return self.seen_peers.count(_id) > 0
@@ -135,17 +156,23 @@ class MessageRA(object):
     scope: all routers in the area and all designated routers
     This message is sent periodically to indicate the originating router's sequence numbers
     for link-state and mobile-address-state.
+
+    As with HELLO, the encoded body is cached and the message must not be modified once
+    it has been encoded.
     """
-    def __init__(self, body, _id=None, _ls_seq=None, _mobile_seq=None, _instance=long(0)):
+    __slots__ = ('id', 'area', 'ls_seq', 'mobile_seq', 'instance', '_body')
+
+    def __init__(self, body, _id=None, _ls_seq=None, _mobile_seq=None, _instance=long(0), _area='0'):
+        self._body = None
         if body:
             self.id = getMandatory(body, 'id', str)
-            self.area = '0'
+            self.area = getOptional(body, 'area', '0', str)
             self.ls_seq = getMandatory(body, 'ls_seq', long)
             self.mobile_seq = getMandatory(body, 'mobile_seq', long)
             self.instance = getOptional(body, 'instance', 0, long)
         else:
             self.id = _id
-            self.area = '0'
+            self.area = _area
             self.ls_seq = long(_ls_seq)
             self.mobile_seq = long(_mobile_seq)
             self.instance = _instance
@@ -158,85 +185,197 @@ class MessageRA(object):
                 (self.id, self.area, self.instance, self.ls_seq, self.mobile_seq)
 
     def to_dict(self):
-        return {'id'         : self.id,
-                'area'       : self.area,
-                'instance'   : self.instance,
-                'ls_seq'     : self.ls_seq,
-                'mobile_seq' : self.mobile_seq}
+        if self._body is None:
+            self._body = {'id'         : self.id,
+                          'area'       : self.area,
+                          'instance'   : self.instance,
+                          'ls_seq'     : self.ls_seq,
+                          'mobile_seq' : self.mobile_seq}
+        return self._body
 
 
 class MessageLSU(object):
     """
+    Link State Update (LSU) Message
+    A full LSU carries the link state of the originating router nested in the ls field.  The
+    compact encoding, sent only to routers that asked for it, refers to routers by their index
+    in the originating router's ID dictionary and carries the peers as a flat list of index and
+    cost pairs.  The dictionary entries from ids_base onwards are sent along (ids), so that the
+    requester can extend the copy of the dictionary it already holds.  A compact LSU with a base
+    carries only the peers that were added or changed (add) and removed (del) since the link
+    state at sequence base.
     """
-    def __init__(self, body, _id=None, _ls_seq=None, _ls=None, _instance=long(0)):
+    __slots__ = ('id', 'area', 'ls_seq', 'ls', 'instance', 'compact', 'base', 'peers', 'del_peers',
+                 'ids_base', 'ids')
+
+    def __init__(self, body, _id=None, _ls_seq=None, _ls=None, _instance=long(0), _area='0',
+                 _compact=False, _base=None, _peers=None, _del_peers=None, _ids_base=0, _ids=None):
         if body:
             self.id = getMandatory(body, 'id', str)
-            self.area = '0'
+            self.area = getOptional(body, 'area', '0', str)
             self.ls_seq = getMandatory(body, 'ls_seq', long)
-            self.ls = LinkState(getMandatory(body, 'ls', dict))
             self.instance = getOptional(body, 'instance', 0, long)
+            self.compact = 'ls' not in body
+            self.ls = None
+            self.base = None
+            self.peers = None
+            self.del_peers = None
+            self.ids_base = 0
+            self.ids = None
+            if not self.compact:
+                self.ls = LinkState(getMandatory(body, 'ls', dict))
+            else:
+                self.ids_base = getOptional(body, 'ids_base', 0, long)
+                self.ids = getOptional(body, 'ids', [], list)
+                self.base = getOptional(body, 'base', None, long)
+                if self.base == None:
+                    self.peers = getMandatory(body, 'peers', list)
+                else:
+                    self.peers = getOptional(body, 'add', [], list)
+                    self.del_peers = getOptional(body, 'del', [], list)
         else:
             self.id = _id
-            self.area = '0'
+            self.area = _area
             self.ls_seq = long(_ls_seq)
             self.ls = _ls
             self.instance = _instance
+            self.compact = _compact
+            self.base = _base
+            self.peers = _peers
+            self.del_peers = _del_peers
+            self.ids_base = _ids_base
+            self.ids = _ids
 
     def get_opcode(self):
         return 'LSU'
 
     def __repr__(self):
-        return "LSU(id=%s area=%s inst=%d ls_seq=%d ls=%r)" % \
-                (self.id, self.area, self.instance, self.ls_seq, self.ls)
+        if not self.compact:
+            return "LSU(id=%s area=%s inst=%d ls_seq=%d ls=%r)" % \
+                    (self.id, self.area, self.instance, self.ls_seq, self.ls)
+        if self.base != None:
+            return "LSU(id=%s area=%s inst=%d ls_seq=%d base=%d add=%r del=%r ids_base=%d ids=%r)" % \
+                    (self.id, self.area, self.instance, self.ls_seq, self.base, self.peers, self.del_peers,
+                     self.ids_base, self.ids)
+        return "LSU(id=%s area=%s inst=%d ls_seq=%d peers=%r ids_base=%d ids=%r)" % \
+                (self.id, self.area, self.instance, self.ls_seq, self.peers, self.ids_base, self.ids)
 
     def to_dict(self):
-        return {'id'       : self.id,
+        body = {'id'       : self.id,
                 'area'     : self.area,
                 'instance' : self.instance,
-                'ls_seq'   : self.ls_seq,
-                'ls'       : self.ls.to_dict()}
+                'ls_seq'   : self.ls_seq}
+        if not self.compact:
+            body['ls'] = self.ls.to_dict()
+            return body
+        body['ids_base'] = long(self.ids_base)
+        body['ids']      = self.ids or []
+        if self.base == None:
+            body['peers'] = self.peers
+        else:
+            body['base'] = long(self.base)
+            body['add']  = self.peers or []
+            body['del']  = self.del_peers or []
+        return body
+
+    def decode(self, ids, link_state=None):
+        """
+        Return the link state described by a compact LSU, given the originating router's ID
+        dictionary and, for an LSU with a base, the link state at that base sequence.  None is
+        returned if the LSU refers to a router that is not in the dictionary.
+        """
+        if link_state:
+            peers = dict(link_state.peers)
+        else:
+            peers = {}
+        for index in self.del_peers or []:
+            if not 0 <= index < len(ids):
+                return None
+            peers.pop(ids[index], None)
+        encoded = self.peers or []
+        for i in range(0, len(encoded) - 1, 2):
+            index = encoded[i]
+            if not 0 <= index < len(ids):
+                return None
+            peers[ids[index]] = long(encoded[i + 1])
+        return LinkState(None, self.id, self.ls_seq, peers, self.area)
 
 
 class MessageLSR(object):
     """
+    Link State Request (LSR) Message
+    The compact flag indicates that the requester accepts the compact LSU encoding.  If the
+    requester holds a link state of the router it is asking, have_seq is its sequence and a
+    compact LSU may carry only the changes since then.  have_ids is the number of entries of
+    the asked router's ID dictionary that the requester already holds.
     """
-    def __init__(self, body, _id=None):
+    __slots__ = ('id', 'area', 'have_seq', 'compact', 'have_ids')
+
+    def __init__(self, body, _id=None, _area='0', _have_seq=None, _compact=False, _have_ids=0):
         if body:
             self.id = getMandatory(body, 'id', str)
-            self.area = '0'
+            self.area = getOptional(body, 'area', '0', str)
+            self.have_seq = getOptional(body, 'have_seq', None, long)
+            self.compact = getOptional(body, 'compact', 0L, long) != 0
+            self.have_ids = getOptional(body, 'have_ids', 0L, long)
         else:
             self.id = _id
-            self.area = '0'
+            self.area = _area
+            self.have_seq = _have_seq
+            self.compact = _compact
+            self.have_ids = _have_ids
 
     def get_opcode(self):
         return 'LSR'
 
     def __repr__(self):
-        return "LSR(id=%s area=%s)" % (self.id, self.area)
+        have = ''
+        if self.have_seq != None: have = ' have_seq=%d' % self.have_seq
+        if self.have_ids:         have += ' have_ids=%d' % self.have_ids
+        return "LSR(id=%s area=%s%s%s)" % (self.id, self.area, have, ' compact' if self.compact else '')
 
     def to_dict(self):
-        return {'id'     : self.id,
+        body = {'id'     : self.id,
                 'area'   : self.area}
+        if self.compact:            body['compact']  = 1L
+        if self.have_seq != None:   body['have_seq'] = long(self.have_seq)
+        if self.have_ids:           body['have_ids'] = long(self.have_ids)
+        return body
 
 
 class MessageMAU(object):
     """
+    Mobile Address Update (MAU) Message
+    A differential MAU carries add and del lists, an absolute MAU carries the exist list.  A large
+    absolute MAU may be split into fragments; each fragment carries part of the exist list along
+    with its index (frag) and the total number of fragments (frags).  A differential MAU that merges
+    several consecutive deltas carries the sequence it applies on top of (base); otherwise the base
+    is implicitly one less than mobile_seq.
     """
-    def __init__(self, body, _id=None, _seq=None, _add_list=None, _del_list=None, _exist_list=None):
+    __slots__ = ('id', 'area', 'mobile_seq', 'add_list', 'del_list', 'exist_list', 'frag', 'frags', 'base')
+
+    def __init__(self, body, _id=None, _seq=None, _add_list=None, _del_list=None, _exist_list=None,
+                 _frag=None, _frags=None, _base=None, _area='0'):
         if body:
             self.id = getMandatory(body, 'id', str)
-            self.area = '0'
+            self.area = getOptional(body, 'area', '0', str)
             self.mobile_seq = getMandatory(body, 'mobile_seq', long)
             self.add_list = getOptional(body, 'add', None, list)
             self.del_list = getOptional(body, 'del', None, list)
             self.exist_list = getOptional(body, 'exist', None, list)
+            self.frag = getOptional(body, 'frag', None, long)
+            self.frags = getOptional(body, 'frags', None, long)
+            self.base = getOptional(body, 'base', None, long)
         else:
             self.id = _id
-            self.area = '0'
+            self.area = _area
             self.mobile_seq = long(_seq)
             self.add_list = _add_list
             self.del_list = _del_list
             self.exist_list = _exist_list
+            self.frag = _frag
+            self.frags = _frags
+            self.base = _base
 
     def get_opcode(self):
         return 'MAU'
@@ -248,6 +387,8 @@ class MessageMAU(object):
         if self.add_list != None:   _add   = ' add=%r'   % self.add_list
         if self.del_list != None:   _del   = ' del=%r'   % self.del_list
         if self.exist_list != None: _exist = ' exist=%r' % self.exist_list
+        if self.frags != None:      _exist += ' frag=%d/%d' % (self.frag, self.frags)
+        if self.base != None:       _add    = ' base=%d%s' % (self.base, _add)
         return "MAU(id=%s area=%s mobile_seq=%d%s%s%s)" % \
                 (self.id, self.area, self.mobile_seq, _add, _del, _exist)
 
@@ -258,29 +399,137 @@ class MessageMAU(object):
         if self.add_list != None:   body['add']   = self.add_list
         if self.del_list != None:   body['del']   = self.del_list
         if self.exist_list != None: body['exist'] = self.exist_list
+        if self.frags != None:
+            body['frag']  = long(self.frag)
+            body['frags'] = long(self.frags)
+        if self.base != None:       body['base']  = long(self.base)
         return body
 
 
 class MessageMAR(object):
     """
+    Mobile Address Request (MAR) Message
+    The merge flag indicates that the requester accepts a single differential MAU merged from
+    several consecutive deltas.
     """
-    def __init__(self, body, _id=None, _have_seq=None):
+    __slots__ = ('id', 'area', 'have_seq', 'merge')
+
+    def __init__(self, body, _id=None, _have_seq=None, _merge=False, _area='0'):
         if body:
             self.id = getMandatory(body, 'id', str)
-            self.area = '0'
+            self.area = getOptional(body, 'area', '0', str)
             self.have_seq = getMandatory(body, 'have_seq', long)
+            self.merge = getOptional(body, 'merge', 0L, long) != 0
         else:
             self.id = _id
-            self.area = '0'
+            self.area = _area
             self.have_seq = long(_have_seq)
+            self.merge = _merge
 
     def get_opcode(self):
         return 'MAR'
 
     def __repr__(self):
-        return "MAR(id=%s area=%s have_seq=%d)" % (self.id, self.area, self.have_seq)
+        return "MAR(id=%s area=%s have_seq=%d%s)" % \
+                (self.id, self.area, self.have_seq, ' merge' if self.merge else '')
 
     def to_dict(self):
-        return {'id'       : self.id,
+        body = {'id'       : self.id,
                 'area'     : self.area,
                 'have_seq' : self.have_seq}
+        if self.merge: body['merge'] = 1L
+        return body
+
+
+class MessageASU(object):
+    """
+    Area Summary Update (ASU) Message
+    scope: all routers in the area, or the neighbor across an area border
+    This message is sent by area border routers.  The summary of the areas reachable through
+    the originating router gives, for each area, the cost from the originator and the mobile
+    addresses attached in that area.  The to_area field names the area in which the summary is
+    to be used.
+
+    An absolute ASU carries the whole summary.  A differential ASU carries the changes since the
+    summary at its base sequence: the areas that were added or changed (update), each with its
+    cost and the addresses added and deleted, and the areas that were removed (remove).  An ASU
+    with neither only advertises the sequence of the originator's current summary.
+    """
+    __slots__ = ('id', 'area', 'to_area', 'seq', 'summary', 'base', 'update', 'remove')
+
+    def __init__(self, body, _id=None, _area='0', _to_area='0', _seq=None, _summary=None,
+                 _base=None, _update=None, _remove=None):
+        if body:
+            self.id = getMandatory(body, 'id', str)
+            self.area = getOptional(body, 'area', '0', str)
+            self.to_area = getMandatory(body, 'to_area', str)
+            self.seq = getMandatory(body, 'seq', long)
+            self.summary = getOptional(body, 'summary', None, dict)
+            self.base = getOptional(body, 'base', None, long)
+            self.update = getOptional(body, 'update', {}, dict)
+            self.remove = getOptional(body, 'remove', [], list)
+        else:
+            self.id = _id
+            self.area = _area
+            self.to_area = _to_area
+            self.seq = long(_seq)
+            self.summary = _summary
+            self.base = _base
+            self.update = _update or {}
+            self.remove = _remove or []
+
+    def get_opcode(self):
+        return 'ASU'
+
+    def __repr__(self):
+        if self.summary != None:
+            content = ' summary=%r' % self.summary
+        elif self.base != None:
+            content = ' base=%d update=%r remove=%r' % (self.base, self.update, self.remove)
+        else:
+            content = ''
+        return "ASU(id=%s area=%s to_area=%s seq=%d%s)" % \
+                (self.id, self.area, self.to_area, self.seq, content)
+
+    def to_dict(self):
+        body = {'id'      : self.id,
+                'area'    : self.area,
+                'to_area' : self.to_area,
+                'seq'     : self.seq}
+        if self.summary != None:
+            body['summary'] = self.summary
+        elif self.base != None:
+            body['base']   = long(self.base)
+            body['update'] = self.update
+            body['remove'] = self.remove
+        return body
+
+
+class MessageASR(object):
+    """
+    Area Summary Request (ASR) Message
+    Sent to an area border router, in the requester's area or across the border, whose summary
+    the requester does not hold.  The target answers with an absolute ASU.
+    """
+    __slots__ = ('id', 'area', 'target')
+
+    def __init__(self, body, _id=None, _area='0', _target=None):
+        if body:
+            self.id = getMandatory(body, 'id', str)
+            self.area = getOptional(body, 'area', '0', str)
+            self.target = getMandatory(body, 'target', str)
+        else:
+            self.id = _id
+            self.area = _area
+            self.target = _target
+
+    def get_opcode(self):
+        return 'ASR'
+
+    def __repr__(self):
+        return "ASR(id=%s area=%s target=%s)" % (self.id, self.area, self.target)
+
+    def to_dict(self):
+        return {'id'     : self.id,
+                'area'   : self.area,
+                'target' : self.target}
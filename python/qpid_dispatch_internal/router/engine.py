@@ -17,16 +17,18 @@
 # under the License.
 #
 
-from data import MessageHELLO, MessageRA, MessageLSU, MessageMAU, MessageMAR, MessageLSR
+from data import MessageHELLO, MessageRA, MessageLSU, MessageMAU, MessageMAR, MessageLSR, MessageASU, MessageASR
 from hello import HelloProtocol
 from link import LinkStateEngine
 from path import PathEngine
 from mobile import MobileAddressEngine
 from node import NodeTracker
+from area import AreaEngine
 from message import Message
 
 from traceback import format_exc, extract_stack
 import time
+import math
 
 ##
 ## Import the Dispatch adapters from the environment.  If they are not found
@@ -35,6 +37,11 @@ import time
 from ..dispatch import IoAdapter, LogAdapter, LOG_TRACE, LOG_INFO, LOG_ERROR, LOG_STACK_LIMIT
 from ..dispatch import TREATMENT_MULTICAST_FLOOD, TREATMENT_MULTICAST_ONCE
 
+##
+## Longest time in seconds the router timer is allowed to sleep between ticks
+##
+MAX_TICK_INTERVAL = 10.0
+
 class RouterEngine:
     """
     """
@@ -62,8 +69,9 @@ class RouterEngine:
         self.id             = router_id
         self.instance       = long(time.time())
         self.area           = area
-        self.log(LOG_INFO, "Router Engine Instantiated: id=%s instance=%d max_routers=%d" %
-                 (self.id, self.instance, self.max_routers))
+        self.next_tick      = 0.0
+        self.log(LOG_INFO, "Router Engine Instantiated: id=%s instance=%d max_routers=%d",
+                 self.id, self.instance, self.max_routers)
 
         ##
         ## Launch the sub-module engines
@@ -73,6 +81,7 @@ class RouterEngine:
         self.link_state_engine     = LinkStateEngine(self)
         self.path_engine           = PathEngine(self)
         self.mobile_address_engine = MobileAddressEngine(self, self.node_tracker)
+        self.area_engine           = AreaEngine(self, self.node_tracker)
 
 
     ##========================================================================================
@@ -91,40 +100,90 @@ class RouterEngine:
             except IndexError: raise ValueError("No router configuration found")
         return self._config
 
-    def addressAdded(self, addr):
+    def addressAdded(self, addrs):
         """
+        Invoked by the router core with a list of consecutively added addresses.
         """
         try:
-            if addr[0] in 'MCD':
-                self.mobile_address_engine.add_local_address(addr)
+            for addr in addrs:
+                if addr[0] in 'MCD':
+                    self.mobile_address_engine.add_local_address(addr)
+            self._wake(time.time())
         except Exception:
-            self.log_ma(LOG_ERROR, "Exception in new-address processing\n%s" % format_exc(LOG_STACK_LIMIT))
+            self.log_ma(LOG_ERROR, "Exception in new-address processing\n%s", format_exc(LOG_STACK_LIMIT))
 
-    def addressRemoved(self, addr):
+    def addressRemoved(self, addrs):
         """
+        Invoked by the router core with a list of consecutively removed addresses.
         """
         try:
-            if addr[0] in 'MCD':
-                self.mobile_address_engine.del_local_address(addr)
+            for addr in addrs:
+                if addr[0] in 'MCD':
+                    self.mobile_address_engine.del_local_address(addr)
+            self._wake(time.time())
         except Exception:
-            self.log_ma(LOG_ERROR, "Exception in del-address processing\n%s" % format_exc(LOG_STACK_LIMIT))
+            self.log_ma(LOG_ERROR, "Exception in del-address processing\n%s", format_exc(LOG_STACK_LIMIT))
 
     def linkLost(self, link_id):
         """
         """
+        now = time.time()
         self.node_tracker.link_lost(link_id)
+        self.area_engine.link_lost(link_id, now)
+        self._wake(now)
 
 
     def handleTimerTick(self):
         """
+        Run the protocol engines and return the number of milliseconds until the
+        router timer should next fire.
         """
+        now = time.time()
         try:
-            now = time.time()
             self.hello_protocol.tick(now)
             self.link_state_engine.tick(now)
             self.node_tracker.tick(now)
+            self.area_engine.tick(now)
+            return self._tick_delay(self._next_deadline(now), now)
         except Exception:
-            self.log(LOG_ERROR, "Exception in timer processing\n%s" % format_exc(LOG_STACK_LIMIT))
+            self.log(LOG_ERROR, "Exception in timer processing\n%s", format_exc(LOG_STACK_LIMIT))
+        return self._tick_delay(now + 1.0, now)
+
+
+    def _next_deadline(self, now):
+        """
+        Return the earliest time at which any of the engines has work to do
+        """
+        deadline = min(self.hello_protocol.next_deadline(now),
+                       self.link_state_engine.next_deadline(now),
+                       now + MAX_TICK_INTERVAL)
+        for engine in (self.node_tracker, self.area_engine):
+            engine_deadline = engine.next_deadline(now)
+            if engine_deadline != None and engine_deadline < deadline:
+                deadline = engine_deadline
+        return deadline
+
+
+    def _tick_delay(self, deadline, now):
+        """
+        Record the time of the next tick and return its delay in milliseconds
+        """
+        delay = max(0, int(math.ceil((deadline - now) * 1000)))
+        self.next_tick = now + delay / 1000.0
+        return delay
+
+
+    def _wake(self, now):
+        """
+        Bring the next tick forward if the event just processed has made work due
+        before the currently scheduled tick.
+        """
+        deadline = self.node_tracker.next_deadline(now)
+        area_deadline = self.area_engine.next_deadline(now)
+        if deadline == None or (area_deadline != None and area_deadline < deadline):
+            deadline = area_deadline
+        if deadline != None and deadline < self.next_tick:
+            self.router_adapter.schedule_tick(self._tick_delay(deadline, now))
 
     def handleControlMessage(self, opcode, body, link_id, cost):
         """
@@ -133,36 +192,53 @@ class RouterEngine:
             now = time.time()
             if   opcode == 'HELLO':
                 msg = MessageHELLO(body)
-                self.log_hello(LOG_TRACE, "RCVD: %r" % msg)
+                self.log_hello(LOG_TRACE, "RCVD: %r", msg)
                 self.hello_protocol.handle_hello(msg, now, link_id, cost)
 
             elif opcode == 'RA':
                 msg = MessageRA(body)
-                self.log_ls(LOG_TRACE, "RCVD: %r" % msg)
-                self.link_state_engine.handle_ra(msg, now)
+                self.log_ls(LOG_TRACE, "RCVD: %r", msg)
+                if msg.area == self.area:
+                    self.link_state_engine.handle_ra(msg, now)
 
             elif opcode == 'LSU':
                 msg = MessageLSU(body)
-                self.log_ls(LOG_TRACE, "RCVD: %r" % msg)
-                self.link_state_engine.handle_lsu(msg, now)
+                self.log_ls(LOG_TRACE, "RCVD: %r", msg)
+                if msg.area == self.area:
+                    self.link_state_engine.handle_lsu(msg, now)
 
             elif opcode == 'LSR':
                 msg = MessageLSR(body)
-                self.log_ls(LOG_TRACE, "RCVD: %r" % msg)
-                self.link_state_engine.handle_lsr(msg, now)
+                self.log_ls(LOG_TRACE, "RCVD: %r", msg)
+                if msg.area == self.area:
+                    self.link_state_engine.handle_lsr(msg, now)
 
             elif opcode == 'MAU':
                 msg = MessageMAU(body)
-                self.log_ma(LOG_TRACE, "RCVD: %r" % msg)
-                self.mobile_address_engine.handle_mau(msg, now)
+                self.log_ma(LOG_TRACE, "RCVD: %r", msg)
+                if msg.area == self.area:
+                    self.mobile_address_engine.handle_mau(msg, now)
 
             elif opcode == 'MAR':
                 msg = MessageMAR(body)
-                self.log_ma(LOG_TRACE, "RCVD: %r" % msg)
-                self.mobile_address_engine.handle_mar(msg, now)
+                self.log_ma(LOG_TRACE, "RCVD: %r", msg)
+                if msg.area == self.area:
+                    self.mobile_address_engine.handle_mar(msg, now)
+
+            elif opcode == 'ASU':
+                msg = MessageASU(body)
+                self.log_ls(LOG_TRACE, "RCVD: %r", msg)
+                self.area_engine.handle_asu(msg, now)
+
+            elif opcode == 'ASR':
+                msg = MessageASR(body)
+                self.log_ls(LOG_TRACE, "RCVD: %r", msg)
+                self.area_engine.handle_asr(msg, now)
+
+            self._wake(now)
 
         except Exception:
-            self.log(LOG_ERROR, "Control message error: opcode=%s body=%r\n%s" % (opcode, body, format_exc(LOG_STACK_LIMIT)))
+            self.log(LOG_ERROR, "Control message error: opcode=%s body=%r\n%s", opcode, body, format_exc(LOG_STACK_LIMIT))
 
     def receive(self, message, link_id, cost):
         """
@@ -171,8 +247,8 @@ class RouterEngine:
         try:
             self.handleControlMessage(message.properties['opcode'], message.body, link_id, cost)
         except Exception:
-            self.log(LOG_ERROR, "Exception in raw message processing: properties=%r body=%r\n%s" %
-                     (message.properties, message.body, format_exc(LOG_STACK_LIMIT)))
+            self.log(LOG_ERROR, "Exception in raw message processing: properties=%r body=%r\n%s",
+                     message.properties, message.body, format_exc(LOG_STACK_LIMIT))
 
     def getRouterData(self, kind):
         """
@@ -196,36 +272,45 @@ class RouterEngine:
     ##========================================================================================
     ## Adapter Calls - outbound calls to Dispatch
     ##========================================================================================
-    def log(self, level, text):
+    def _log(self, adapter, level, text, args):
+        """
+        Emit a log message if its level is enabled.  The caller's frame info is only
+        extracted, and the text only formatted with args, for enabled levels.
+        """
+        if not adapter.enabled(level):
+            return
+        info = extract_stack(limit=3)[0] # Caller's caller frame info
+        if args:
+            text = text % args
+        adapter.log(level, text, info[0], info[1])
+
+
+    def log(self, level, text, *args):
         """
         Emit a log message to the host's event log
         """
-        info = extract_stack(limit=2)[0] # Caller frame info
-        self._log_general.log(level, text, info[0], info[1])
+        self._log(self._log_general, level, text, args)
 
 
-    def log_hello(self, level, text):
+    def log_hello(self, level, text, *args):
         """
         Emit a log message to the host's event log
         """
-        info = extract_stack(limit=2)[0] # Caller frame info
-        self._log_hello.log(level, text, info[0], info[1])
+        self._log(self._log_hello, level, text, args)
 
 
-    def log_ls(self, level, text):
+    def log_ls(self, level, text, *args):
         """
         Emit a log message to the host's event log
         """
-        info = extract_stack(limit=2)[0] # Caller frame info
-        self._log_ls.log(level, text, info[0], info[1])
+        self._log(self._log_ls, level, text, args)
 
 
-    def log_ma(self, level, text):
+    def log_ma(self, level, text, *args):
         """
         Emit a log message to the host's event log
         """
-        info = extract_stack(limit=2)[0] # Caller frame info
-        self._log_ma.log(level, text, info[0], info[1])
+        self._log(self._log_ma, level, text, args)
 
 
     def send(self, dest, msg):
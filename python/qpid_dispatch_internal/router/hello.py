@@ -17,7 +17,7 @@
 # under the License.
 #
 
-from data import MessageHELLO
+from data import MessageHELLO, getInterval
 from qpid_dispatch_internal.dispatch import LOG_INFO, LOG_TRACE, LOG_CRITICAL
 
 class HelloProtocol(object):
@@ -28,33 +28,52 @@ class HelloProtocol(object):
         self.container        = container
         self.node_tracker     = node_tracker
         self.id               = self.container.id
-        self.ticks            = 0.0
-        self.last_hello_ticks = 0.0
-        self.hello_interval   = container.config.helloInterval
-        self.hello_max_age    = container.config.helloMaxAge
+        self.last_hello_time  = 0.0
+        self.hello_interval   = getInterval(container.config, 'helloInterval')
+        self.hello_max_age    = getInterval(container.config, 'helloMaxAge')
         self.hellos           = {}
+        self.hello_msg        = None
         self.dup_reported     = False
 
 
     def tick(self, now):
         self._expire_hellos(now)
-        self.ticks += 1.0
-        if self.ticks - self.last_hello_ticks >= self.hello_interval:
-            self.last_hello_ticks = self.ticks
-            msg = MessageHELLO(None, self.id, self.hellos.keys(), self.container.instance)
+        if now - self.last_hello_time >= self.hello_interval:
+            self.last_hello_time = now
+            ##
+            ## Reuse the previous HELLO, and with it its encoded body, unless the set of
+            ## seen peers has changed since it was built.
+            ##
+            msg = self.hello_msg
+            if not msg:
+                msg = MessageHELLO(None, self.id, self.hellos.keys(), self.container.instance,
+                                   self.container.area)
+                self.hello_msg = msg
             self.container.send('amqp:/_local/qdhello', msg)
-            self.container.log_hello(LOG_TRACE, "SENT: %r" % msg)
+            self.container.log_hello(LOG_TRACE, "SENT: %r", msg)
+
+
+    def next_deadline(self, now):
+        """
+        Return the time at which the next HELLO is due
+        """
+        return self.last_hello_time + self.hello_interval
 
 
     def handle_hello(self, msg, now, link_id, cost):
         if msg.id == self.id:
             if not self.dup_reported and (msg.instance != self.container.instance):
                 self.dup_reported = True
-                self.container.log_hello(LOG_CRITICAL, "Detected Neighbor Router with a Duplicate ID - %s" % msg.id)
+                self.container.log_hello(LOG_CRITICAL, "Detected Neighbor Router with a Duplicate ID - %s", msg.id)
             return
+        if msg.id not in self.hellos:
+            self.hello_msg = None
         self.hellos[msg.id] = now
         if msg.is_seen(self.id):
-            self.node_tracker.neighbor_refresh(msg.id, msg.instance, link_id, cost, now)
+            if msg.area == self.container.area:
+                self.node_tracker.neighbor_refresh(msg.id, msg.instance, link_id, cost, now)
+            else:
+                self.container.area_engine.neighbor_refresh(msg.id, msg.area, msg.instance, link_id, cost, now)
 
 
     def _expire_hellos(self, now):
@@ -65,5 +84,6 @@ class HelloProtocol(object):
         for key, last_seen in self.hellos.items():
             if now - last_seen > self.hello_max_age:
                 self.hellos.pop(key)
-                self.container.log_hello(LOG_TRACE, "HELLO peer expired: %s" % key)
+                self.hello_msg = None
+                self.container.log_hello(LOG_TRACE, "HELLO peer expired: %s", key)
 
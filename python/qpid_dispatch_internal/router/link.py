@@ -17,21 +17,39 @@
 # under the License.
 #
 
-from data import MessageRA, MessageLSU, MessageLSR
+from data import MessageRA, MessageLSU, MessageLSR, getInterval
 from ..dispatch import LOG_TRACE
 
+##
+## Number of our own recently sent link states kept for building compact delta LSUs
+##
+LS_HISTORY_DEPTH = 8
+
 class LinkStateEngine(object):
     """
     This module is responsible for running the Link State protocol.
+
+    Requests for link state are answered with the compact LSU encoding if the requester asks
+    for it.  The peers of each link state we send are remembered by sequence number so that a
+    requester that already holds one of them can be sent only the peers that changed.
+
+    Compact LSUs refer to routers by their index in our router ID dictionary.  Entries are only
+    ever appended to the dictionary, so a requester's copy stays valid for as long as we are the
+    same instance and only the entries it doesn't have yet are sent.  Maskbits are not used as
+    the index because they are reused once a router goes away.
     """
     def __init__(self, container):
         self.container = container
         self.node_tracker = container.node_tracker
         self.id = self.container.id
-        self.ra_interval_stable = self.container.config.raInterval
-        self.ra_interval_flux   = self.container.config.raIntervalFlux
+        self.ra_interval_stable = getInterval(self.container.config, 'raInterval')
+        self.ra_interval_flux   = getInterval(self.container.config, 'raIntervalFlux')
         self.last_ra_time = 0
         self.mobile_seq   = 0
+        self.ra_msg       = None
+        self.ls_history   = {}    # ls_seq => peers of our link state as sent at that sequence
+        self.peer_ids     = []    # Router ID dictionary: index => router ID
+        self.peer_index   = {}    # router ID => index in the router ID dictionary
 
 
     def set_mobile_seq(self, mobile_seq):
@@ -46,6 +64,16 @@ class LinkStateEngine(object):
             self.send_ra(now)
 
 
+    def next_deadline(self, now):
+        """
+        Return the time at which the next RA is due
+        """
+        interval = self.ra_interval_stable
+        if self.node_tracker.in_flux_mode(now):
+            interval = self.ra_interval_flux
+        return self.last_ra_time + interval
+
+
     def handle_ra(self, msg, now):
         if msg.id == self.id:
             return
@@ -55,28 +83,113 @@ class LinkStateEngine(object):
     def handle_lsu(self, msg, now):
         if msg.id == self.id:
             return
-        self.node_tracker.link_state_received(msg.id, msg.ls, msg.instance, now)
+        if msg.compact:
+            self.node_tracker.compact_link_state_received(msg, now)
+        else:
+            self.node_tracker.link_state_received(msg.id, msg.ls, msg.instance, now)
 
 
     def handle_lsr(self, msg, now):
         if msg.id == self.id:
             return
         self.node_tracker.router_learned(msg.id)
-        my_ls = self.node_tracker.link_state
-        smsg = MessageLSU(None, self.id, my_ls.ls_seq, my_ls, self.container.instance)
+        smsg = self._link_state_update(msg)
         self.container.send('amqp:/_topo/%s/%s/qdrouter' % (msg.area, msg.id), smsg)
-        self.container.log_ls(LOG_TRACE, "SENT: %r" % smsg)
+        self.container.log_ls(LOG_TRACE, "SENT: %r", smsg)
+        self.container.area_engine.summary_requested(msg.id)
 
 
-    def send_lsr(self, _id):
-        msg = MessageLSR(None, self.id)
-        self.container.send('amqp:/_topo/0/%s/qdrouter' % _id, msg)
-        self.container.log_ls(LOG_TRACE, "SENT: %r to: %s" % (msg, _id))
+    def _link_state_update(self, lsr):
+        """
+        Build the LSU that answers a link state request
+        """
+        my_ls = self.node_tracker.link_state
+
+        ##
+        ## Remember the peers as of the sequence being sent.  A sequence lower than the
+        ## ones remembered means that our link state was reset and the history is void.
+        ##
+        ## Our peers change as soon as a neighbor comes or goes but the sequence is only
+        ## bumped at the next tick, so in between they are not the peers of the current
+        ## sequence.  They are only recorded while no change is pending, and a compact LSU
+        ## sent in between carries the peers recorded for the sequence it advertises.
+        ##
+        if self.ls_history and my_ls.ls_seq < max(self.ls_history):
+            self.ls_history = {}
+        if not self.node_tracker.link_state_changed and my_ls.ls_seq not in self.ls_history:
+            self.ls_history[my_ls.ls_seq] = dict(my_ls.peers)
+            if len(self.ls_history) > LS_HISTORY_DEPTH:
+                self.ls_history.pop(min(self.ls_history))
+
+        if not lsr.compact:
+            return MessageLSU(None, self.id, my_ls.ls_seq, my_ls, self.container.instance, self.container.area)
+
+        my_peers  = self.ls_history.get(my_ls.ls_seq, my_ls.peers)
+        base      = self.ls_history.get(lsr.have_seq)
+        peers     = None
+        del_peers = None
+        if base != None:
+            add_peers = dict((p, c) for p, c in my_peers.items() if base.get(p) != c)
+            removed   = [p for p in base if p not in my_peers]
+            if len(add_peers) + len(removed) < len(my_peers):
+                peers     = self._encode_peers(add_peers)
+                del_peers = [long(self._peer_index(p)) for p in removed]
+            else:
+                base = None
+        if base == None:
+            peers = self._encode_peers(my_peers)
+
+        ##
+        ## A requester claiming more of the dictionary than we have holds the dictionary of an
+        ## earlier instance of this router and is sent all of it.
+        ##
+        ids_base = lsr.have_ids
+        if ids_base > len(self.peer_ids):
+            ids_base = 0
+        return MessageLSU(None, self.id, my_ls.ls_seq, None, self.container.instance, self.container.area,
+                          True, lsr.have_seq if base != None else None, peers, del_peers,
+                          ids_base, self.peer_ids[ids_base:])
+
+
+    def _peer_index(self, _id):
+        """
+        Return the index of a router ID in our dictionary, adding it if it isn't there yet
+        """
+        index = self.peer_index.get(_id)
+        if index == None:
+            index = len(self.peer_ids)
+            self.peer_ids.append(_id)
+            self.peer_index[_id] = index
+        return index
+
+
+    def _encode_peers(self, peers):
+        """
+        Encode a peer map as a flat list of dictionary index and cost pairs
+        """
+        encoded = []
+        for _id, cost in peers.items():
+            encoded.append(long(self._peer_index(_id)))
+            encoded.append(cost)
+        return encoded
+
+
+    def send_lsr(self, _id, have_seq=None, have_ids=0):
+        msg = MessageLSR(None, self.id, self.container.area, have_seq, True, have_ids)
+        self.container.send('amqp:/_topo/%s/%s/qdrouter' % (self.container.area, _id), msg)
+        self.container.log_ls(LOG_TRACE, "SENT: %r to: %s", msg, _id)
 
 
     def send_ra(self, now):
         self.last_ra_time = now
         ls_seq = self.node_tracker.link_state.ls_seq
-        msg = MessageRA(None, self.id, ls_seq, self.mobile_seq, self.container.instance)
-        self.container.send('amqp:/_topo/0/all/qdrouter', msg)
-        self.container.log_ls(LOG_TRACE, "SENT: %r" % msg)
+        msg = self.ra_msg
+        ##
+        ## Reuse the previous RA, and with it its encoded body, if the sequence numbers
+        ## it advertises have not changed.
+        ##
+        if not msg or msg.ls_seq != ls_seq or msg.mobile_seq != self.mobile_seq:
+            msg = MessageRA(None, self.id, ls_seq, self.mobile_seq, self.container.instance, self.container.area)
+            self.ra_msg = msg
+        self.container.send('amqp:/_topo/%s/all/qdrouter' % self.container.area, msg)
+        self.container.log_ls(LOG_TRACE, "SENT: %r", msg)
@@ -17,27 +17,38 @@
 # under the License.
 #
 
+from collections import OrderedDict, deque
 from data import MessageMAR, MessageMAU
 from ..dispatch import LOG_TRACE
 
-MAX_KEPT_DELTAS = 10
-
 class MobileAddressEngine(object):
     """
     This module is responsible for maintaining an up-to-date list of mobile addresses in the domain.
     It runs the Mobile-Address protocol and generates an un-optimized routing table for mobile addresses.
     Note that this routing table maps from the mobile address to the remote router where that address
     is directly bound.
+
+    The local address set and the pending added/deleted deltas are kept in hashed containers so
+    that adding and deleting addresses is constant-time regardless of the number of addresses.
+    The pending deltas are ordered so they go out on the wire in the order they occurred.
+
+    Sent deltas are kept in a log bounded both by count and by the total number of addresses
+    they carry.  A peer that has fallen behind within the log is caught up from it, with a single
+    merged delta if the peer indicates in its MAR that it accepts one.
     """
     def __init__(self, container, node_tracker):
         self.container     = container
         self.node_tracker  = node_tracker
         self.id            = self.container.id
         self.mobile_seq    = 0
-        self.local_addrs   = []
-        self.added_addrs   = []
-        self.deleted_addrs = []
-        self.sent_deltas   = {}
+        self.local_addrs   = set()
+        self.added_addrs   = OrderedDict()
+        self.deleted_addrs = OrderedDict()
+        self.sent_deltas   = deque()
+        self.delta_addrs   = 0
+        self.max_deltas    = self.container.config.mobileAddrMaxDeltas
+        self.delta_budget  = self.container.config.mobileAddrMaxDeltaAddresses
+        self.chunk_size    = self.container.config.mobileAddrChunkSize
 
 
     def tick(self, now):
@@ -47,48 +58,89 @@ class MobileAddressEngine(object):
         ##
         if len(self.added_addrs) > 0 or len(self.deleted_addrs) > 0:
             self.mobile_seq += 1
-            msg = MessageMAU(None, self.id, self.mobile_seq, self.added_addrs, self.deleted_addrs)
-
-            self.sent_deltas[self.mobile_seq] = msg
-            if len(self.sent_deltas) > MAX_KEPT_DELTAS:
-                self.sent_deltas.pop(self.mobile_seq - MAX_KEPT_DELTAS)
-
-            self.container.send('amqp:/_topo/0/all/qdrouter.ma', msg)
-            self.container.log_ma(LOG_TRACE, "SENT: %r" % msg)
-            self.local_addrs.extend(self.added_addrs)
-            for addr in self.deleted_addrs:
-                self.local_addrs.remove(addr)
-            self.added_addrs   = []
-            self.deleted_addrs = []
+            msg = MessageMAU(None, self.id, self.mobile_seq, self.added_addrs.keys(), self.deleted_addrs.keys(),
+                             _area=self.container.area)
+
+            self._keep_delta(msg)
+
+            self.container.send('amqp:/_topo/%s/all/qdrouter.ma' % self.container.area, msg)
+            self.container.log_ma(LOG_TRACE, "SENT: %r", msg)
+            self.local_addrs.update(self.added_addrs)
+            self.local_addrs.difference_update(self.deleted_addrs)
+            self.node_tracker.summary_changed = True
+            self.added_addrs   = OrderedDict()
+            self.deleted_addrs = OrderedDict()
         return self.mobile_seq
 
 
+    def has_changes(self):
+        """
+        Return True if there are local address changes waiting to be sent
+        """
+        return len(self.added_addrs) > 0 or len(self.deleted_addrs) > 0
+
+
+    def _keep_delta(self, msg):
+        """
+        Append a sent delta to the log and trim the oldest entries to stay within the
+        configured bounds.  The newest delta is always kept.
+        """
+        self.sent_deltas.append(msg)
+        self.delta_addrs += len(msg.add_list) + len(msg.del_list)
+        while len(self.sent_deltas) > 1 and \
+              (len(self.sent_deltas) > self.max_deltas or
+               (self.delta_budget > 0 and self.delta_addrs > self.delta_budget)):
+            old = self.sent_deltas.popleft()
+            self.delta_addrs -= len(old.add_list) + len(old.del_list)
+
+
+    def _merge_deltas(self, have_seq):
+        """
+        Merge the kept deltas that follow have_seq into a single differential MAU.  Addresses
+        added and later deleted (or deleted and later re-added) cancel out.
+        """
+        added   = OrderedDict()
+        deleted = OrderedDict()
+        for delta in self.sent_deltas:
+            if delta.mobile_seq <= have_seq:
+                continue
+            for a in delta.add_list:
+                if a in deleted:
+                    del deleted[a]
+                else:
+                    added[a] = None
+            for a in delta.del_list:
+                if a in added:
+                    del added[a]
+                else:
+                    deleted[a] = None
+        return MessageMAU(None, self.id, self.mobile_seq, added.keys(), deleted.keys(), _base=have_seq,
+                          _area=self.container.area)
+
+
     def add_local_address(self, addr):
         """
         """
-        if self.local_addrs.count(addr) == 0:
-            if self.added_addrs.count(addr) == 0:
-                self.added_addrs.append(addr)
+        if addr not in self.local_addrs:
+            self.added_addrs[addr] = None
         else:
-            if self.deleted_addrs.count(addr) > 0:
-                self.deleted_addrs.remove(addr)
+            self.deleted_addrs.pop(addr, None)
 
 
     def del_local_address(self, addr):
         """
         """
-        if self.local_addrs.count(addr) > 0:
-            if self.deleted_addrs.count(addr) == 0:
-                self.deleted_addrs.append(addr)
+        if addr in self.local_addrs:
+            self.deleted_addrs[addr] = None
         else:
-            if self.added_addrs.count(addr) > 0:
-                self.added_addrs.remove(addr)
+            self.added_addrs.pop(addr, None)
 
 
     def handle_mau(self, msg, now):
         ##
-        ## If the MAU is differential, we can only use it if its sequence is exactly one greater
-        ## than our stored sequence.  If not, we will ignore the content and schedule a MAR.
+        ## If the MAU is differential, we can only use it if its base sequence (normally one less
+        ## than its own sequence) is our stored sequence.  If not, we will ignore the content and
+        ## schedule a MAR.
         ##
         ## If the MAU is absolute, we can use it in all cases.
         ##
@@ -102,17 +154,29 @@ class MobileAddressEngine(object):
             ##
             if msg.mobile_seq == node.mobile_address_sequence:
                 return
+            addrs = msg.exist_list
+            if msg.frags != None:
+                ##
+                ## Fragment of a chunked absolute MAU.  Nothing is applied until the last
+                ## fragment has arrived.
+                ##
+                addrs = node.address_fragment_received(msg.mobile_seq, msg.frag, msg.frags, addrs)
+                if addrs == None:
+                    return
             node.mobile_address_sequence = msg.mobile_seq
-            node.overwrite_addresses(msg.exist_list)
+            node.overwrite_addresses(addrs)
         else:
             ##
             ## Differential MAU
             ##
-            if node.mobile_address_sequence + 1 == msg.mobile_seq:
+            base = msg.base
+            if base == None:
+                base = msg.mobile_seq - 1
+            if node.mobile_address_sequence == base:
                 ##
-                ## This message represents the next expected sequence, incorporate the deltas
+                ## This message follows on from our stored sequence, incorporate the deltas
                 ##
-                node.mobile_address_sequence += 1
+                node.mobile_address_sequence = msg.mobile_seq
                 for a in msg.add_list:
                     node.map_address(a)
                 for a in msg.del_list:
@@ -137,26 +201,45 @@ class MobileAddressEngine(object):
             return
         if msg.have_seq == self.mobile_seq:
             return
-        if self.mobile_seq - (msg.have_seq + 1) < len(self.sent_deltas):
+        if msg.have_seq < self.mobile_seq and len(self.sent_deltas) > 0 and \
+           self.sent_deltas[0].mobile_seq <= msg.have_seq + 1:
             ##
-            ## We can catch the peer up with a series of stored differential updates
+            ## We can catch the peer up with stored differential updates, merged into one
+            ## if the peer accepts that.
             ##
-            for s in range(msg.have_seq + 1, self.mobile_seq + 1):
-                self.container.send('amqp:/_topo/0/%s/qdrouter.ma' % msg.id, self.sent_deltas[s])
-                self.container.log_ma(LOG_TRACE, "SENT: %r" % self.sent_deltas[s])
+            if msg.merge and self.mobile_seq - msg.have_seq > 1:
+                deltas = [self._merge_deltas(msg.have_seq)]
+            else:
+                deltas = [d for d in self.sent_deltas if d.mobile_seq > msg.have_seq]
+            for delta in deltas:
+                self.container.send('amqp:/_topo/%s/%s/qdrouter.ma' % (msg.area, msg.id), delta)
+                self.container.log_ma(LOG_TRACE, "SENT: %r", delta)
             return
 
         ##
-        ## The peer needs to be sent an absolute update with the whole address list
+        ## The peer needs to be sent an absolute update with the whole address list.  If the
+        ## list is longer than the configured chunk size, send it as a series of fragments.
         ##
-        smsg = MessageMAU(None, self.id, self.mobile_seq, None, None, self.local_addrs)
-        self.container.send('amqp:/_topo/0/%s/qdrouter.ma' % msg.id, smsg)
-        self.container.log_ma(LOG_TRACE, "SENT: %r" % smsg)
+        addrs = list(self.local_addrs)
+        chunk = self.chunk_size
+        if chunk <= 0 or len(addrs) <= chunk:
+            smsg = MessageMAU(None, self.id, self.mobile_seq, None, None, addrs, _area=self.container.area)
+            self.container.send('amqp:/_topo/%s/%s/qdrouter.ma' % (msg.area, msg.id), smsg)
+            self.container.log_ma(LOG_TRACE, "SENT: %r", smsg)
+            return
+
+        frags = (len(addrs) + chunk - 1) // chunk
+        for frag in range(frags):
+            smsg = MessageMAU(None, self.id, self.mobile_seq, None, None,
+                              addrs[frag * chunk:(frag + 1) * chunk], frag, frags,
+                              _area=self.container.area)
+            self.container.send('amqp:/_topo/%s/%s/qdrouter.ma' % (msg.area, msg.id), smsg)
+            self.container.log_ma(LOG_TRACE, "SENT: %r", smsg)
 
 
     def send_mar(self, node_id, seq):
-        msg = MessageMAR(None, self.id, seq)
-        self.container.send('amqp:/_topo/0/%s/qdrouter.ma' % node_id, msg)
-        self.container.log_ma(LOG_TRACE, "SENT: %r" % msg)
+        msg = MessageMAR(None, self.id, seq, True, self.container.area)
+        self.container.send('amqp:/_topo/%s/%s/qdrouter.ma' % (self.container.area, node_id), msg)
+        self.container.log_ma(LOG_TRACE, "SENT: %r", msg)
 
 
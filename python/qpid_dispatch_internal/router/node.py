@@ -17,10 +17,65 @@
 # under the License.
 #
 
+import heapq
 from ..dispatch import LOG_INFO, LOG_TRACE, LOG_DEBUG
-from data import LinkState
+from data import LinkState, getInterval
 from .address import Address
 
+##
+## Kinds of scheduled expiration check
+##
+EXPIRE_NEIGHBOR   = 0
+EXPIRE_LINK_STATE = 1
+
+##
+## Interval in seconds between checks of the keep-alive count of unreferenced routers
+##
+ORPHAN_SWEEP_INTERVAL = 1.0
+
+
+class TokenBucket(object):
+    """
+    Token bucket that paces the requests sent to other routers.  Tokens accumulate at rate
+    per second up to burst, and each request sent takes one.  A rate of zero disables pacing.
+    """
+    def __init__(self, rate, burst):
+        self.rate   = float(rate)
+        self.burst  = float(max(burst, 1))
+        self.tokens = self.burst
+        self.last   = None
+
+
+    def _tokens(self, now):
+        if self.last == None:
+            return self.tokens
+        return min(self.burst, self.tokens + (now - self.last) * self.rate)
+
+
+    def refill(self, now):
+        self.tokens = self._tokens(now)
+        self.last   = now
+
+
+    def take(self):
+        if self.rate == 0:
+            return True
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+    def ready_time(self, now):
+        """
+        Return the time at which the next token is available
+        """
+        tokens = self._tokens(now)
+        if self.rate == 0 or tokens >= 1.0:
+            return now
+        return now + (1.0 - tokens) / self.rate
+
+
 class NodeTracker(object):
     """
     This module is responsible for tracking the set of router nodes that are known to this
@@ -28,26 +83,61 @@ class NodeTracker(object):
 
     This module is also responsible for assigning a unique mask bit value to each router.
     The mask bit is used in the main router to represent sets of valid destinations for addresses.
+
+    Expirations are driven by a heap of deadlines rather than by sweeping every node on every tick.
+    A deadline is only a hint: when it passes, the node's current refresh time is checked and the
+    check is rescheduled if the node has been refreshed since.  A reverse-peer index (node id =>
+    ids of the nodes whose link state lists it) is used to find nodes that are no longer referenced
+    by anyone without scanning all link states.
+
+    Route computations are damped with hold-down timers in the manner of OSPF SPF throttling.
+    The first change after a quiet period is computed after spfInitialDelayMs.  Changes arriving
+    while a computation is scheduled are folded into it, and consecutive computations are spaced
+    by a hold time that starts at spfHoldMs and doubles, up to spfMaxWaitMs, for as long as
+    changes keep arriving.
+
+    Link-state and mobile-address requests are paced by a token bucket (controlRequestRate
+    and controlRequestBurst) so that a restart does not send a request to every router at
+    once.  Requests that are due are sent to neighbors first and then in order of increasing
+    cost; the rest stay queued until tokens are available.
     """
     def __init__(self, container, max_routers):
         self.container             = container
         self.my_id                 = container.id
         self.max_routers           = max_routers
-        self.link_state            = LinkState(None, self.my_id, 0, {})
+        self.link_state            = LinkState(None, self.my_id, 0, {}, container.area)
         self.link_state_changed    = False
         self.recompute_topology    = False
+        self.summary_changed       = False  # Addresses, area summaries or routes changed since the last area export
         self.last_topology_change  = 0
         self.flux_mode             = False
         self.nodes                 = {}  # id => RouterNode
         self.nodes_by_link_id      = {}  # link-id => node-id
-        self.maskbits              = []
-        self.next_maskbit          = 1   # Reserve bit '0' to represent this router
-        for i in range(max_routers):
-            self.maskbits.append(None)
-        self.maskbits[0]      = True
-        self.neighbor_max_age = self.container.config.helloMaxAge
-        self.ls_max_age       = self.container.config.remoteLsMaxAge
-        self.flux_interval    = self.container.config.raIntervalFlux * 2
+        self.advertisers           = {}  # node-id => set of node-ids whose link state lists it
+        self.deadlines             = []  # heap of (deadline, kind, node-id)
+        self.scheduled             = set()  # (kind, node-id) pairs present in deadlines
+        self.orphans               = set()  # node-ids that may no longer be referenced
+        self.next_orphan_sweep     = 0.0
+        self.pending_requests      = set()  # node-ids with an outstanding LSR or MAR to send
+        self.free_maskbits         = []  # heap of released maskbits
+        self.next_maskbit          = 1   # Lowest never-allocated maskbit; bit '0' represents this router
+        self.neighbor_max_age = getInterval(self.container.config, 'helloMaxAge')
+        self.ls_max_age       = getInterval(self.container.config, 'remoteLsMaxAge')
+        self.flux_interval    = getInterval(self.container.config, 'raIntervalFlux') * 2
+        self.spf_initial      = self.container.config.spfInitialDelayMs / 1000.0
+        self.spf_hold         = self.container.config.spfHoldMs / 1000.0
+        self.spf_max_wait     = self.container.config.spfMaxWaitMs / 1000.0
+        self.spf_hold_current = self.spf_hold
+        self.spf_due          = None  # time at which the scheduled route computation is run
+        self.last_spf_time    = None
+        self.last_spf_request = None
+        self.spf_avoided      = 0
+        self.spf_avoided_sent = 0
+        self.request_bucket   = TokenBucket(self.container.config.controlRequestRate,
+                                            self.container.config.controlRequestBurst)
+        self.requests_queued  = 0   # requests due but held back by the token bucket
+        self.requests_sent    = 0
+        self.request_counters_sent = (0, 0)
         self.container.router_adapter.get_agent().add_implementation(self, "router.node")
 
 
@@ -60,56 +150,168 @@ class NodeTracker(object):
             "nextHop":  "(self)",
             "validOrigins": [],
             "address": Address.topological(self.my_id, area=self.container.area),
-            "lastTopoChange" : self.last_topology_change
+            "lastTopoChange" : int(round(self.last_topology_change))
         })
 
 
-    def _do_expirations(self, now):
+    def _schedule(self, kind, node_id, deadline):
+        """
+        Schedule an expiration check for a node unless one is already pending
+        """
+        if (kind, node_id) not in self.scheduled:
+            self.scheduled.add((kind, node_id))
+            heapq.heappush(self.deadlines, (deadline, kind, node_id))
+
+
+    def _new_node(self, node_id, instance):
+        node = RouterNode(self, node_id, instance)
+        self.nodes[node_id] = node
+        self.orphans.add(node_id)
+        return node
+
+
+    def _set_link_state(self, node, link_state):
         """
-        Run through the list of routers and check for expired conditions
+        Replace a node's link state, keeping the reverse-peer index up to date.
         """
-        for node_id, node in self.nodes.items():
+        for peer in node.link_state.peers:
+            if peer not in link_state.peers:
+                self._unadvertise(node.id, peer)
+        for peer in link_state.peers:
+            self.advertisers.setdefault(peer, set()).add(node.id)
+        node.link_state = link_state
+        if not link_state.has_peers():
+            self.orphans.add(node.id)
+
+
+    def _clear_link_state(self, node):
+        """
+        Remove all peers from a node's link state, keeping the reverse-peer index up to date.
+        """
+        for peer in node.link_state.peers:
+            self._unadvertise(node.id, peer)
+        node.link_state.del_all_peers()
+        self.orphans.add(node.id)
+
+
+    def _unadvertise(self, node_id, peer):
+        advertisers = self.advertisers.get(peer)
+        if advertisers:
+            advertisers.discard(node_id)
+            if not advertisers:
+                self.advertisers.pop(peer)
+                self.orphans.add(peer)
+
+
+    def _spf_deadline(self, now):
+        """
+        Return the time at which a route computation requested now should be run, and
+        advance the hold time.
+        """
+        if self.last_spf_request == None or now - self.last_spf_request >= self.spf_max_wait:
             ##
-            ## If the node is a neighbor, check the neighbor refresh time to see
-            ## if we've waited too long for a refresh.  If so, disconnect the link
-            ## and remove the node from the local link state.
+            ## Quiet period: the hold time starts over
             ##
-            if node.is_neighbor():
-                if now - node.neighbor_refresh_time > self.neighbor_max_age:
+            hold = self.spf_hold
+            self.spf_hold_current = hold
+        else:
+            hold = self.spf_hold_current
+            self.spf_hold_current = min(hold * 2, self.spf_max_wait)
+        deadline = now + self.spf_initial
+        if self.last_spf_time != None:
+            deadline = max(deadline, self.last_spf_time + hold)
+        return deadline
+
+
+    def _do_expirations(self, now):
+        """
+        Process the expiration checks that have come due and look for unreferenced routers
+        """
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, kind, node_id = heapq.heappop(self.deadlines)
+            self.scheduled.discard((kind, node_id))
+            node = self.nodes.get(node_id)
+            if not node:
+                continue
+
+            if kind == EXPIRE_NEIGHBOR:
+                ##
+                ## If the node is still a neighbor, check the neighbor refresh time to see
+                ## if we've waited too long for a refresh.  If so, disconnect the link
+                ## and remove the node from the local link state.
+                ##
+                if not node.is_neighbor():
+                    continue
+                deadline = node.neighbor_refresh_time + self.neighbor_max_age
+                if now >= deadline:
                     node.remove_link()
+                    self.orphans.add(node_id)
                     if self.link_state.del_peer(node_id):
                         self.link_state_changed = True
-
-            ##
-            ## Check the age of the node's link state.  If it's too old, clear it out.
-            ##
-            if now - node.link_state.last_seen > self.ls_max_age:
-                if node.link_state.has_peers():
-                    node.link_state.del_all_peers()
+                else:
+                    self._schedule(kind, node_id, deadline)
+
+            else:
+                ##
+                ## Check the age of the node's link state.  If it's too old, clear it out.
+                ##
+                if not node.link_state.has_peers():
+                    continue
+                deadline = node.link_state.last_seen + self.ls_max_age
+                if now >= deadline:
+                    self._clear_link_state(node)
                     self.recompute_topology = True
+                else:
+                    self._schedule(kind, node_id, deadline)
+
+        ##
+        ## If a node has empty link state, is not a neighbor and does not appear in any other
+        ## node's link state, then delete the node.  Only nodes whose state has changed in one
+        ## of these respects since they were last found to be referenced are examined.
+        ##
+        if now < self.next_orphan_sweep:
+            return
+        self.next_orphan_sweep = now + ORPHAN_SWEEP_INTERVAL
+        for node_id in list(self.orphans):
+            node = self.nodes.get(node_id)
+            if not node or node.link_state.has_peers() or node.is_neighbor() or node_id in self.advertisers:
+                self.orphans.discard(node_id)
+                continue
 
             ##
-            ## If the node has empty link state, check to see if it appears in any other
-            ## node's link state.  If it does not, then delete the node.
+            ## The keep_alive_count is set to zero when a new node is first
+            ## discovered.  Since we can learn about a node before we receive
+            ## its link state, the keep_alive_count is used to prevent the
+            ## node from being deleted before we can learn more about it.
             ##
-            if not node.link_state.has_peers() and not node.is_neighbor():
-                delete_node = True
-                for _id, _n in self.nodes.items():
-                    if _id != node_id:
-                        if _n.link_state.is_peer(node_id):
-                            delete_node = False
-                            break
-                if delete_node:
-                    ##
-                    ## The keep_alive_count is set to zero when a new node is first
-                    ## discovered.  Since we can learn about a node before we receive
-                    ## its link state, the keep_alive_count is used to prevent the
-                    ## node from being deleted before we can learn more about it.
-                    ##
-                    node.keep_alive_count += 1
-                    if node.keep_alive_count > 2:
-                        node.delete()
-                        self.nodes.pop(node_id)
+            node.keep_alive_count += 1
+            if node.keep_alive_count > 2:
+                node.delete()
+                self.nodes.pop(node_id)
+                self.orphans.discard(node_id)
+
+
+    def next_deadline(self, now):
+        """
+        Return the time at which this tracker next needs a tick, or None if it has nothing
+        scheduled.  Pending topology or local address changes are due immediately.
+        """
+        if self.link_state_changed or self.recompute_topology or \
+           self.container.mobile_address_engine.has_changes():
+            return now
+        deadline = self.spf_due
+        if self.deadlines and (deadline == None or self.deadlines[0][0] < deadline):
+            deadline = self.deadlines[0][0]
+        if self.orphans and (deadline == None or self.next_orphan_sweep < deadline):
+            deadline = self.next_orphan_sweep
+        for node_id in self.pending_requests:
+            node = self.nodes.get(node_id)
+            if node and node.is_reachable():
+                ready = self.request_bucket.ready_time(now)
+                if deadline == None or ready < deadline:
+                    deadline = ready
+                break
+        return deadline
 
 
     def tick(self, now):
@@ -124,7 +326,7 @@ class NodeTracker(object):
         ## Enter flux mode if things are changing
         ##
         if self.link_state_changed or self.recompute_topology:
-            self.last_topology_change = int(round(now))
+            self.last_topology_change = now
             if not self.flux_mode:
                 self.flux_mode = True
                 self.container.log(LOG_TRACE, "Entered Router Flux Mode")
@@ -137,42 +339,61 @@ class NodeTracker(object):
             self.link_state.bump_sequence()
             self.recompute_topology = True
             send_ra = True
-            self.container.log_ls(LOG_TRACE, "Local Link State: %r" % self.link_state)
+            self.container.log_ls(LOG_TRACE, "Local Link State: %r", self.link_state)
 
         ##
-        ## Recompute the topology
+        ## Schedule a route computation, or fold the request into the one already scheduled
         ##
         if self.recompute_topology:
             self.recompute_topology = False
+            if self.spf_due == None:
+                self.spf_due = self._spf_deadline(now)
+            else:
+                self.spf_avoided += 1
+            self.last_spf_request = now
+
+        ##
+        ## Recompute the topology
+        ##
+        if self.spf_due != None and now >= self.spf_due:
+            self.spf_due       = None
+            self.last_spf_time = now
             collection = {self.my_id : self.link_state}
             for node_id, node in self.nodes.items():
                 collection[node_id] = node.link_state
-            next_hops, costs, valid_origins = self.container.path_engine.calculate_routes(collection)
-            self.container.log_ls(LOG_TRACE, "Computed next hops: %r" % next_hops)
-            self.container.log_ls(LOG_TRACE, "Computed costs: %r" % costs)
-            self.container.log_ls(LOG_TRACE, "Computed valid origins: %r" % valid_origins)
+            next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = \
+                self.container.path_engine.calculate_routes(collection)
+            self.container.log_ls(LOG_TRACE, "Computed next hops: %r", next_hops)
+            self.container.log_ls(LOG_TRACE, "Computed costs: %r", costs)
+            self.container.log_ls(LOG_TRACE, "Computed valid origins: %r", valid_origins)
+            self.container.log_ls(LOG_TRACE, "Computed equal-cost next hops: %r", ecmp_next_hops)
 
             ##
-            ## Update the next hops and valid origins for each node
+            ## Update the next hops and valid origins for each node.  The changes are
+            ## collected and handed to the router core in a single batch.
             ##
+            updates = []
             for node_id, next_hop_id in next_hops.items():
                 node     = self.nodes[node_id]
                 next_hop = self.nodes[next_hop_id]
                 vo       = valid_origins[node_id]
                 cost     = costs[node_id]
-                node.set_next_hop(next_hop)
-                node.set_valid_origins(vo)
-                node.set_cost(cost)
+                update   = node.update_route(next_hop, vo, cost,
+                                             ecmp_next_hops.get(node_id, []), ecmp_origins[node_id])
+                if update:
+                    updates.append(update)
+            if updates:
+                self.container.router_adapter.set_routes(updates)
+                self.summary_changed = True
+            if self.spf_avoided != self.spf_avoided_sent:
+                self.spf_avoided_sent = self.spf_avoided
+                self.container.router_adapter.set_recomputes_avoided(self.spf_avoided)
 
         ##
         ## Send link-state requests and mobile-address requests to the nodes
         ## that have pending requests and are reachable
         ##
-        for node_id, node in self.nodes.items():
-            if node.link_state_requested():
-                self.container.link_state_engine.send_lsr(node_id)
-            if node.mobile_address_requested():
-                self.container.mobile_address_engine.send_mar(node_id, node.mobile_address_sequence)
+        self._send_requests(now)
 
         ##
         ## If local changes have been made to the list of mobile addresses, send
@@ -198,7 +419,7 @@ class NodeTracker(object):
         ## If the node id is not known, create a new RouterNode to track it.
         ##
         if node_id not in self.nodes:
-            self.nodes[node_id] = RouterNode(self, node_id, instance)
+            self._new_node(node_id, instance)
         node = self.nodes[node_id]
 
         ##
@@ -215,6 +436,7 @@ class NodeTracker(object):
         ## Update the refresh time for later expiration checks
         ##
         node.neighbor_refresh_time = now
+        self._schedule(EXPIRE_NEIGHBOR, node_id, now + self.neighbor_max_age)
 
         ##
         ## If the instance was updated (i.e. the neighbor restarted suddenly),
@@ -229,12 +451,13 @@ class NodeTracker(object):
         """
         Invoked when an inter-router link is dropped.
         """
-        self.container.log_ls(LOG_INFO, "Link to Neighbor Router Lost - link_tag=%d" % link_id)
+        self.container.log_ls(LOG_INFO, "Link to Neighbor Router Lost - link_tag=%d", link_id)
         node_id = self.link_id_to_node_id(link_id)
         if node_id:
             self.nodes_by_link_id.pop(link_id)
             node = self.nodes[node_id]
             node.remove_link()
+            self.orphans.add(node_id)
             if self.link_state.del_peer(node_id):
                 self.link_state_changed = True
 
@@ -255,7 +478,7 @@ class NodeTracker(object):
         ## If the node id is not known, create a new RouterNode to track it.
         ##
         if node_id not in self.nodes:
-            self.nodes[node_id] = RouterNode(self, node_id, instance)
+            self._new_node(node_id, instance)
         node = self.nodes[node_id]
 
         ##
@@ -276,7 +499,7 @@ class NodeTracker(object):
         ## not up to date.
         ##
         if node.link_state.ls_seq < ls_seq:
-            self.container.link_state_engine.send_lsr(node_id)
+            node.request_link_state()
 
         ##
         ## Check the mobile sequence.  Send a mobile-address-request if we are
@@ -291,7 +514,7 @@ class NodeTracker(object):
         Invoked when we learn about another router by any means
         """
         if node_id not in self.nodes and node_id != self.my_id:
-            self.nodes[node_id] = RouterNode(self, node_id, None)
+            self._new_node(node_id, None)
 
 
     def link_state_received(self, node_id, link_state, instance, now):
@@ -302,7 +525,7 @@ class NodeTracker(object):
         ## If the node id is not known, create a new RouterNode to track it.
         ##
         if node_id not in self.nodes:
-            self.nodes[node_id] = RouterNode(self, node_id, instance)
+            self._new_node(node_id, instance)
         node = self.nodes[node_id]
 
         ##
@@ -310,9 +533,12 @@ class NodeTracker(object):
         ## update it and schedule a topology recompute.
         ##
         if link_state.ls_seq > node.link_state.ls_seq:
-            node.link_state = link_state
+            self._set_link_state(node, link_state)
             node.link_state.last_seen = now
+            node.ls_delta_failed      = False
             self.recompute_topology = True
+            if link_state.has_peers():
+                self._schedule(EXPIRE_LINK_STATE, node_id, now + self.ls_max_age)
 
             ##
             ## Look through the new link state for references to nodes that we don't
@@ -324,6 +550,93 @@ class NodeTracker(object):
                     self.router_learned(peer)
 
 
+    def compact_link_state_received(self, msg, now):
+        """
+        Invoked when a link state update in the compact encoding is received.  Our copy of the
+        router's ID dictionary is extended with the entries the update carries and its peers are
+        decoded with it.  An update carrying only the changes since msg.base is applied only to
+        our copy of the link state at that sequence from the same instance of the router.  If the
+        update can't be decoded or applied, the full link state and dictionary are requested.
+        """
+        if msg.base == None and msg.id not in self.nodes:
+            self._new_node(msg.id, msg.instance)
+        node = self.nodes.get(msg.id)
+        if not node:
+            return
+        if not node.update_peer_ids(msg.instance, msg.ids_base, msg.ids):
+            node.ls_delta_failed = True
+            node.request_link_state()
+            return
+        if node.link_state.ls_seq >= msg.ls_seq:
+            return
+        base = None
+        if msg.base != None:
+            if node.instance != msg.instance or node.link_state.ls_seq != msg.base:
+                node.ls_delta_failed = True
+                node.request_link_state()
+                return
+            base = node.link_state
+        link_state = msg.decode(node.peer_ids, base)
+        if link_state == None:
+            node.ls_delta_failed = True
+            node.request_link_state()
+            return
+        self.link_state_received(msg.id, link_state, msg.instance, now)
+
+
+    def _send_requests(self, now):
+        """
+        Send the pending requests to reachable nodes, neighbors first and then in order of
+        increasing cost, for as long as the token bucket allows.
+        """
+        ready = []
+        for node_id in list(self.pending_requests):
+            node = self.nodes.get(node_id)
+            if not node or not (node.need_ls_request or node.need_mobile_request):
+                self.pending_requests.discard(node_id)
+            elif node.is_reachable():
+                ready.append(node)
+        ready.sort(key=lambda node: (not node.is_neighbor(), node.cost == None, node.cost, node.id))
+
+        self.request_bucket.refill(now)
+        queued = 0
+        for node in ready:
+            if node.need_ls_request:
+                if self.request_bucket.take() and node.link_state_requested():
+                    self._send_lsr(node)
+                    self.requests_sent += 1
+                else:
+                    queued += 1
+            if node.need_mobile_request:
+                if self.request_bucket.take() and node.mobile_address_requested():
+                    self.container.mobile_address_engine.send_mar(node.id, node.mobile_address_sequence)
+                    self.requests_sent += 1
+                else:
+                    queued += 1
+            if not (node.need_ls_request or node.need_mobile_request):
+                self.pending_requests.discard(node.id)
+        self.requests_queued = queued
+
+        if (self.requests_queued, self.requests_sent) != self.request_counters_sent:
+            self.request_counters_sent = (self.requests_queued, self.requests_sent)
+            self.container.router_adapter.set_request_counters(self.requests_queued, self.requests_sent)
+
+
+    def _send_lsr(self, node):
+        """
+        Request a node's link state.  Unless an earlier compact update could not be applied, the
+        sequence of the link state and the size of the ID dictionary we hold are sent along so
+        that only the changes need be returned.
+        """
+        have_seq = None
+        have_ids = 0
+        if not node.ls_delta_failed:
+            if node.link_state.ls_seq > 0:
+                have_seq = node.link_state.ls_seq
+            have_ids = len(node.peer_ids)
+        self.container.link_state_engine.send_lsr(node.id, have_seq, have_ids)
+
+
     def router_node(self, node_id):
         return self.nodes[node_id]
 
@@ -335,22 +648,21 @@ class NodeTracker(object):
 
 
     def _allocate_maskbit(self):
-        if self.next_maskbit == None:
+        """
+        Allocate the lowest free maskbit.  Released maskbits are kept in a heap so that
+        allocation does not depend on the maximum router count.
+        """
+        if self.free_maskbits:
+            return heapq.heappop(self.free_maskbits)
+        if self.next_maskbit >= self.max_routers:
             raise Exception("Exceeded Maximum Router Count")
         result = self.next_maskbit
-        self.next_maskbit = None
-        self.maskbits[result] = True
-        for n in range(result + 1, self.max_routers):
-            if self.maskbits[n] == None:
-                self.next_maskbit = n
-                break
+        self.next_maskbit += 1
         return result
 
 
     def _free_maskbit(self, i):
-        self.maskbits[i] = None
-        if self.next_maskbit == None or i < self.next_maskbit:
-            self.next_maskbit = i
+        heapq.heappush(self.free_maskbits, i)
 
 
 
@@ -368,17 +680,27 @@ class RouterNode(object):
         self.maskbit                 = self.parent._allocate_maskbit()
         self.neighbor_refresh_time   = 0.0
         self.peer_link_id            = None
-        self.link_state              = LinkState(None, self.id, 0, {})
+        self.link_state              = LinkState(None, self.id, 0, {}, parent.container.area)
         self.next_hop_router         = None
         self.cost                    = None
         self.valid_origins           = None
-        self.mobile_addresses        = []
+        self.ecmp_next_hops          = None
+        self.ecmp_origins            = None
+        self.mobile_addresses        = set()
         self.mobile_address_sequence = 0
+        self.mobile_fragments        = None
+        self.summary_addresses       = set()
+        self.summary_seq             = None
+        self.area_summary            = {}
         self.need_ls_request         = True
+        self.ls_delta_failed         = False
+        self.peer_ids                = []     # Copy of the router's ID dictionary for compact LSUs
+        self.peer_ids_instance       = None   # Instance of the router the dictionary belongs to
         self.need_mobile_request     = False
         self.keep_alive_count        = 0
-        self.adapter.add_router("amqp:/_topo/0/%s/qdrouter" % self.id, self.maskbit)
-        self.log(LOG_TRACE, "Node %s created: maskbit=%d" % (self.id, self.maskbit))
+        self.parent.pending_requests.add(self.id)
+        self.adapter.add_router("amqp:/_topo/%s/%s/qdrouter" % (parent.container.area, self.id), self.maskbit)
+        self.log(LOG_TRACE, "Node %s created: maskbit=%d", self.id, self.maskbit)
         self.adapter.get_agent().add_implementation(self, "router.node")
 
     def refresh_entity(self, attributes):
@@ -389,6 +711,7 @@ class RouterNode(object):
             "linkState": [ls for ls in self.link_state.peers], # List of neighbour nodes
             "nextHop":  self.next_hop_router and self.next_hop_router.id,
             "validOrigins": self.valid_origins,
+            "ecmpNextHops": self.ecmp_next_hops or [],
             "address": Address.topological(self.id, area=self.parent.container.area),
             "routerLink": self.peer_link_id,
             "cost": self.cost
@@ -408,9 +731,10 @@ class RouterNode(object):
             return False
         self.peer_link_id = link_id
         self.next_hop_router = None
+        self.ecmp_next_hops  = None
         self.adapter.set_link(self.maskbit, link_id)
         self.adapter.remove_next_hop(self.maskbit)
-        self.log(LOG_TRACE, "Node %s link set: link_id=%r" % (self.id, link_id))
+        self.log(LOG_TRACE, "Node %s link set: link_id=%r", self.id, link_id)
         return True
 
 
@@ -418,61 +742,86 @@ class RouterNode(object):
         if self.peer_link_id != None:
             self.peer_link_id = None
             self.adapter.remove_link(self.maskbit)
-            self.log(LOG_TRACE, "Node %s link removed" % self.id)
+            self.log(LOG_TRACE, "Node %s link removed", self.id)
 
 
     def delete(self):
         self.adapter.get_agent().remove_implementation(self)
         self.unmap_all_addresses()
+        self.set_summary([])
+        self.parent.summary_changed = True
         self.adapter.del_router(self.maskbit)
         self.parent._free_maskbit(self.maskbit)
-        self.log(LOG_TRACE, "Node %s deleted" % self.id)
-
-
-    def set_next_hop(self, next_hop):
-        if self.id == next_hop.id:
-            return
-        if self.next_hop_router and self.next_hop_router.id == next_hop.id:
-            return
-        self.next_hop_router = next_hop
-        self.adapter.set_next_hop(self.maskbit, next_hop.maskbit)
-        self.log(LOG_TRACE, "Node %s next hop set: %s" % (self.id, next_hop.id))
+        self.log(LOG_TRACE, "Node %s deleted", self.id)
 
 
-    def set_valid_origins(self, valid_origins):
-        if self.valid_origins == valid_origins:
-            return
-        self.valid_origins = valid_origins
-        vo_mb = [self.parent.nodes[N].maskbit for N in valid_origins]
-        self.adapter.set_valid_origins(self.maskbit, vo_mb)
-        self.log(LOG_TRACE, "Node %s valid origins: %r" % (self.id, valid_origins))
-
-
-    def set_cost(self, cost):
-        if self.cost == cost:
-            return
-        self.cost = cost
-        self.adapter.set_cost(self.maskbit, cost)
-        self.log(LOG_TRACE, "Node %s cost: %d" % (self.id, cost))
+    def update_route(self, next_hop, valid_origins, cost, ecmp_next_hops, ecmp_origins):
+        """
+        Record a newly computed route to this node.  Return None if nothing changed,
+        otherwise a (maskbit, next-hop-maskbit, cost, valid-origin-maskbits,
+        next-hop-maskbits, ecmp-origin-maskbits) tuple for the adapter's set_routes call
+        in which unchanged values are -1, 0 and None.  The list of equal-cost next hops is
+        empty unless there is more than one.
+        """
+        nh_mb = -1
+        vo_mb = None
+        cost_value = 0
+        ecmp_nh_mb = None
+        ecmp_vo_mb = None
+
+        if self.id != next_hop.id and \
+           not (self.next_hop_router and self.next_hop_router.id == next_hop.id):
+            self.next_hop_router = next_hop
+            nh_mb = next_hop.maskbit
+            self.log(LOG_TRACE, "Node %s next hop set: %s", self.id, next_hop.id)
+
+        if self.valid_origins != valid_origins:
+            self.valid_origins = valid_origins
+            vo_mb = [self.parent.nodes[N].maskbit for N in valid_origins]
+            self.log(LOG_TRACE, "Node %s valid origins: %r", self.id, valid_origins)
+
+        if self.cost != cost:
+            self.cost = cost
+            cost_value = cost
+            self.log(LOG_TRACE, "Node %s cost: %d", self.id, cost)
+
+        if self.ecmp_next_hops != ecmp_next_hops:
+            self.ecmp_next_hops = ecmp_next_hops
+            ecmp_nh_mb = [self.parent.nodes[N].maskbit for N in ecmp_next_hops]
+            self.log(LOG_TRACE, "Node %s equal-cost next hops: %r", self.id, ecmp_next_hops)
+
+        if self.ecmp_origins != ecmp_origins:
+            self.ecmp_origins = ecmp_origins
+            ecmp_vo_mb = [self.parent.nodes[N].maskbit for N in ecmp_origins]
+
+        if nh_mb == -1 and vo_mb == None and cost_value == 0 and ecmp_nh_mb == None and ecmp_vo_mb == None:
+            return None
+        return (self.maskbit, nh_mb, cost_value, vo_mb, ecmp_nh_mb, ecmp_vo_mb)
 
 
     def remove_next_hop(self):
         if self.next_hop_router:
             self.next_hop_router = None
+            self.ecmp_next_hops  = None
             self.adapter.remove_next_hop(self.maskbit)
-            self.log(LOG_TRACE, "Node %s next hop removed" % self.id)
+            self.log(LOG_TRACE, "Node %s next hop removed", self.id)
 
 
     def is_neighbor(self):
         return self.peer_link_id != None
 
 
+    def is_reachable(self):
+        return self.peer_link_id != None or self.next_hop_router != None
+
+
     def request_link_state(self):
         """
         Set the link-state-requested flag so we can send this node a link-state
         request at the most opportune time.
         """
         self.need_ls_request = True
+        self.parent.pending_requests.add(self.id)
 
 
     def link_state_requested(self):
@@ -481,7 +830,7 @@ class RouterNode(object):
         reachable.  There's no point in sending it a request if we don't know how to
         reach it.
         """
-        if self.need_ls_request and (self.peer_link_id != None or self.next_hop_router != None):
+        if self.need_ls_request and self.is_reachable():
             self.need_ls_request = False
             return True
         return False
@@ -489,48 +838,105 @@ class RouterNode(object):
 
     def mobile_address_request(self):
         self.need_mobile_request = True
+        self.parent.pending_requests.add(self.id)
 
 
     def mobile_address_requested(self):
-        if self.need_mobile_request and (self.peer_link_id != None or self.next_hop_router != None):
+        if self.need_mobile_request and self.is_reachable():
             self.need_mobile_request = False
             return True
         return False
 
 
     def map_address(self, addr):
-        self.mobile_addresses.append(addr)
-        self.adapter.map_destination(addr, self.maskbit)
-        self.log(LOG_DEBUG, "Remote destination %s mapped to router %s" % (self._logify(addr), self.id))
+        self.mobile_addresses.add(addr)
+        self.parent.summary_changed = True
+        if addr not in self.summary_addresses:
+            self.adapter.map_destination(addr, self.maskbit)
+        self.log(LOG_DEBUG, "Remote destination %s mapped to router %s", self._logify(addr), self.id)
 
 
     def unmap_address(self, addr):
         self.mobile_addresses.remove(addr)
-        self.adapter.unmap_destination(addr, self.maskbit)
-        self.log(LOG_DEBUG, "Remote destination %s unmapped from router %s" % (self._logify(addr), self.id))
+        self.parent.summary_changed = True
+        if addr not in self.summary_addresses:
+            self.adapter.unmap_destination(addr, self.maskbit)
+        self.log(LOG_DEBUG, "Remote destination %s unmapped from router %s", self._logify(addr), self.id)
+
+
+    def set_summary(self, addrs):
+        """
+        Replace the set of destinations in other areas that are reached through this node,
+        which is an area border router.  A destination that is also one of the node's own
+        mobile addresses is mapped only once.
+        """
+        addrs   = set(addrs)
+        added   = addrs - self.summary_addresses
+        deleted = self.summary_addresses - addrs
+        self.summary_addresses = addrs
+        for a in added:
+            if a not in self.mobile_addresses:
+                self.adapter.map_destination(a, self.maskbit)
+        for a in deleted:
+            if a not in self.mobile_addresses:
+                self.adapter.unmap_destination(a, self.maskbit)
+        if added or deleted:
+            self.log(LOG_DEBUG, "Router %s summarizes %d destinations in other areas", self.id, len(addrs))
 
 
     def unmap_all_addresses(self):
         self.mobile_address_sequence = 0
-        for addr in self.mobile_addresses:
+        for addr in list(self.mobile_addresses):
             self.unmap_address(addr)
 
 
     def overwrite_addresses(self, addrs):
-        added   = []
-        deleted = []
-        for a in addrs:
-            if a not in self.mobile_addresses:
-                added.append(a)
-        for a in self.mobile_addresses:
-            if a not in addrs:
-                deleted.append(a)
+        addrs   = set(addrs)
+        added   = addrs - self.mobile_addresses
+        deleted = self.mobile_addresses - addrs
         for a in added:
             self.map_address(a)
         for a in deleted:
             self.unmap_address(a)
 
 
+    def address_fragment_received(self, seq, frag, frags, addrs):
+        """
+        Accumulate one fragment of a chunked absolute mobile-address update.  Return the
+        complete address set when the last fragment arrives, otherwise None.  A fragment
+        that arrives out of order discards the partial set and schedules a MAR.
+        """
+        if frag == 0:
+            self.mobile_fragments = [seq, 0, set()]
+        partial = self.mobile_fragments
+        if partial == None or partial[0] != seq or partial[1] != frag:
+            self.mobile_fragments = None
+            self.mobile_address_request()
+            return None
+        partial[1] += 1
+        partial[2].update(addrs)
+        if partial[1] < frags:
+            return None
+        self.mobile_fragments = None
+        return partial[2]
+
+
+    def update_peer_ids(self, instance, ids_base, ids):
+        """
+        Extend our copy of the router's ID dictionary with the entries of a compact LSU, which
+        start at index ids_base.  Return False if they don't follow on from the entries we hold
+        for the same instance of the router.
+        """
+        if self.peer_ids_instance != instance:
+            self.peer_ids          = []
+            self.peer_ids_instance = instance
+        if ids_base > len(self.peer_ids):
+            return False
+        del self.peer_ids[ids_base:]
+        self.peer_ids.extend(ids)
+        return True
+
+
     def update_instance(self, instance):
         if instance == None:
             return False
@@ -541,8 +947,13 @@ class RouterNode(object):
             return False
 
         self.instance = instance
-        self.link_state.del_all_peers()
+        self.parent._clear_link_state(self)
+        self.peer_ids = []
         self.unmap_all_addresses()
-        self.log(LOG_INFO, "Detected Restart of Router Node %s" % self.id)
+        self.summary_seq  = None
+        self.area_summary = {}
+        self.set_summary([])
+        self.parent.summary_changed = True
+        self.log(LOG_INFO, "Detected Restart of Router Node %s", self.id)
         return True
 
@@ -17,31 +17,63 @@
 # under the License.
 #
 
+import heapq
+
+##
+## If more than this fraction of the routers changed their link state since the last
+## calculation, the incremental calculation is skipped in favor of a full recompute.
+##
+INCREMENTAL_CHANGE_LIMIT = 0.25
 
 class PathEngine(object):
     """
     This module is responsible for computing the next-hop for every router in the domain
     based on the collection of link states that have been gathered.
+
+    The shortest-path trees from the previous calculation are kept so that, when only a
+    few link states change, only the trees that are affected by the change are recomputed.
+
+    Where there are several equal-cost paths to a router, every neighbor that is the first
+    hop of one of them is an equal-cost (ECMP) next hop, and the router core may spread
+    closest and balanced traffic across them.  Such traffic is also valid from any origin
+    that has an equal-cost path through this router, so those origins are reported apart
+    from the valid origins of the shortest-path trees, which are used for multicast.
     """
     def __init__(self, container):
         self.container = container
         self.id = self.container.id
+        if self.container.config.spfAlgorithm == 'list':
+            self.node_set_class = NodeSet
+        else:
+            self.node_set_class = HeapNodeSet
+        self.link_states    = None  # Snapshot of the adjacency used in the last calculation
+        self.trees          = {}    # root => (prev, cost) from the last calculation
+        self.behind         = {}    # root => list of nodes reached through this router
+        self.ecmp_behind    = {}    # root => set of nodes reached through this router on any shortest path
+        self.full_runs      = 0     # Number of full route calculations
+        self.spf_runs       = 0     # Number of shortest-path trees computed
 
 
-    def _calculate_tree_from_root(self, root, collection):
+    def _link_states(self, collection):
         ##
         ## Make a copy of the current collection of link-states that contains
         ## a fake link-state for nodes that are known-peers but are not in the
         ## collection currently.  This is needed to establish routes to those nodes
         ## so we can trade link-state information with them.
         ##
+        ## The resulting adjacency map is shared by every shortest-path tree computed
+        ## during a route calculation.
+        ##
         link_states = {}
         for _id, ls in collection.items():
             link_states[_id] = ls.peers
             for p in ls.peers:
                 if p not in link_states:
                     link_states[p] = {_id:1L}
+        return link_states
+
 
+    def _calculate_tree_from_root(self, root, link_states):
         ##
         ## Setup Dijkstra's Algorithm
         ##
@@ -51,7 +83,7 @@ class PathEngine(object):
             cost[_id] = None  # infinite
             prev[_id] = None  # undefined
         cost[root] = 0   # no cost to the root node
-        unresolved = NodeSet(cost)
+        unresolved = self.node_set_class(cost)
 
         ##
         ## Process unresolved nodes until lowest cost paths to all reachable nodes have been found.
@@ -85,69 +117,239 @@ class PathEngine(object):
         return prev, cost
 
 
-    def _calculate_valid_origins(self, nodeset, collection):
+    def _nodes_behind(self, prev):
+        """
+        Return the list of nodes whose path from the root of the tree described by prev
+        passes through this router.  These are the descendants of this router in the tree.
+        """
+        if self.id not in prev:
+            return []
+        children = {}
+        for u, v in prev.items():
+            children.setdefault(v, []).append(u)
+        result  = []
+        pending = children.get(self.id, [])[:]
+        while pending:
+            u = pending.pop()
+            result.append(u)
+            pending.extend(children.get(u, []))
+        return result
+
+
+    def _nodes_behind_ecmp(self, root, cost, link_states):
+        """
+        Return the set of nodes that have a shortest path from root passing through this
+        router.  These are the nodes reachable from this router over the edges (u, v) for
+        which cost[u] + cost(u, v) == cost[v].
+        """
+        if self.id not in cost:
+            return set()
+        result  = set()
+        pending = [self.id]
+        while pending:
+            u = pending.pop()
+            for v, v_cost in link_states[u].items():
+                if v != root and v not in result and cost.get(v) == cost[u] + v_cost:
+                    result.add(v)
+                    pending.append(v)
+        return result
+
+
+    def _changed_edges(self, link_states):
+        """
+        Return the list of (from, to, old_cost, new_cost) edges that differ between the
+        snapshot from the last calculation and the current adjacency map.
+        """
+        changes = []
+        old_states = self.link_states
+        for u in set(old_states.keys()) | set(link_states.keys()):
+            old_peers = old_states.get(u, {})
+            new_peers = link_states.get(u, {})
+            if old_peers == new_peers:
+                continue
+            for v in set(old_peers.keys()) | set(new_peers.keys()):
+                old_cost = old_peers.get(v)
+                new_cost = new_peers.get(v)
+                if old_cost != new_cost:
+                    changes.append((u, v, old_cost, new_cost))
+        return changes
+
+
+    def _tree_affected(self, root, tree, changes):
+        """
+        Determine whether a previously computed tree may differ under the changed edges.
+        A tree is unaffected if none of its edges, nor any other edge on an equal-cost path,
+        changed and no new or cheaper edge reaches a node at a cost that is lower than or
+        equal to (tie-break) its current cost.
+        """
+        prev, cost = tree
+        for u, v, old_cost, new_cost in changes:
+            if v == root:
+                continue
+            if u == root:
+                u_cost = 0
+            elif u in cost:
+                u_cost = cost[u]
+            else:
+                continue          # Edges out of unreachable nodes are irrelevant
+            if prev.get(v) == u:
+                return True
+            if old_cost != None and u_cost + old_cost == cost.get(v):
+                return True
+            if new_cost != None and (old_cost == None or new_cost < old_cost):
+                if v not in cost or u_cost + new_cost <= cost[v]:
+                    return True
+        return False
+
+
+    def _tree(self, root, link_states, changes):
+        """
+        Return the tree rooted at root, reusing the tree from the last calculation if it
+        is not affected by the changes.  If changes is None, the tree is always recomputed.
+        """
+        if changes != None and root in self.trees:
+            if not self._tree_affected(root, self.trees[root], changes):
+                return self.trees[root], False
+        self.spf_runs += 1
+        return self._calculate_tree_from_root(root, link_states), True
+
+
+    def _calculate_valid_origins(self, nodeset, link_states, changes=None):
         ##
         ## Calculate the tree from each origin, determine the set of origins-per-dest
         ## for which the path from origin to dest passes through us.  This is the set
         ## of valid origins for forwarding to the destination.
         ##
+        ## All trees are computed over the same shared adjacency map and the destinations
+        ## served through us are found with a single walk of our subtree in each tree.
+        ## Trees that are not affected by the changes since the last calculation are reused.
+        ##
+        ## A full calculation is still one shortest-path run per origin.  Which origins are
+        ## valid depends on how each origin's own tree breaks ties between equal-cost paths,
+        ## which an all-pairs distance calculation does not capture, and Floyd-Warshall is
+        ## O(N^3) against O(N * E log N) for the per-origin runs on a sparse router mesh.
+        ##
+        ## The origins whose equal-cost paths, but not their tree, pass through us are
+        ## collected separately as the ECMP origins of each destination.
+        ##
         valid_origin = {}         # Map of destination => List of Valid Origins
+        ecmp_origin  = {}         # Map of destination => List of additional ECMP Origins
         for node in nodeset:
             if node != self.id:
                 valid_origin[node] = []
+                ecmp_origin[node]  = []
+
+        for root in sorted(valid_origin.keys()):
+            tree, computed = self._tree(root, link_states, changes)
+            if computed or root not in self.behind:
+                self.trees[root]       = tree
+                self.behind[root]      = self._nodes_behind(tree[0])
+                self.ecmp_behind[root] = self._nodes_behind_ecmp(root, tree[1], link_states)
+            for dest in self.behind[root]:
+                if dest in valid_origin:
+                    valid_origin[dest].append(root)
+            for dest in self.ecmp_behind[root].difference(self.behind[root]):
+                if dest in ecmp_origin:
+                    ecmp_origin[dest].append(root)
 
-        for root in valid_origin.keys():
-            prev, cost = self._calculate_tree_from_root(root, collection)
-            nodes = prev.keys()
-            while len(nodes) > 0:
-                u = nodes[0]
-                path = [u]
-                nodes.remove(u)
-                v = prev[u]
-                while v != root:
-                    if v in nodes:
-                        if v != self.id:
-                            path.append(v)
-                        nodes.remove(v)
-                    if v == self.id:
-                        for dest in path:
-                            valid_origin[dest].append(root)
-                    u = v
-                    v = prev[u]
-        return valid_origin
+        ##
+        ## Discard the trees of origins that are no longer reachable
+        ##
+        for root in self.trees.keys():
+            if root != self.id and root not in valid_origin:
+                self.trees.pop(root)
+                self.behind.pop(root, None)
+                self.ecmp_behind.pop(root, None)
+        return valid_origin, ecmp_origin
+
+
+    def _calculate_next_hops(self, prev):
+        ##
+        ## Distill the path tree into a map of next hops for each node.  The next hop of a
+        ## node is the next hop of its predecessor unless the predecessor is the root.
+        ##
+        next_hops = {}
+        for u in prev:
+            path = []
+            v = u
+            while v not in next_hops and prev[v] != self.id:
+                path.append(v)
+                v = prev[v]
+            if v in next_hops:
+                hop = next_hops[v]
+            else:
+                hop = v
+                next_hops[v] = hop
+            for w in path:        # mark each node in the path as reachable via the next hop
+                next_hops[w] = hop
+        return next_hops
+
+
+    def _calculate_ecmp_next_hops(self, cost, link_states):
+        ##
+        ## Find every neighbor that is the first hop of a shortest path to each node.  Nodes
+        ## are visited in increasing order of cost so that the first hops of every predecessor
+        ## on a shortest path are known before the node itself is reached.  Only the nodes
+        ## with more than one such first hop are returned.
+        ##
+        hops = {}
+        for v, v_cost in link_states[self.id].items():
+            if cost.get(v) == v_cost:
+                hops[v] = set([v])
+        for u in sorted(cost, key=cost.get):
+            if u not in hops:
+                continue
+            for v, v_cost in link_states[u].items():
+                if v != self.id and cost.get(v) == cost[u] + v_cost:
+                    hops.setdefault(v, set()).update(hops[u])
+        ecmp_next_hops = {}
+        for v, first_hops in hops.items():
+            if len(first_hops) > 1:
+                ecmp_next_hops[v] = sorted(first_hops)
+        return ecmp_next_hops
 
 
     def calculate_routes(self, collection):
+        link_states = self._link_states(collection)
+
+        ##
+        ## Determine what changed since the last calculation.  If nothing is known about the
+        ## previous calculation or too many routers changed their link state, recompute all
+        ## of the trees.
+        ##
+        changes = None
+        if self.link_states != None:
+            changes = self._changed_edges(link_states)
+            changed_nodes = set([u for u, v, old_cost, new_cost in changes])
+            if len(changed_nodes) > INCREMENTAL_CHANGE_LIMIT * len(link_states):
+                changes = None
+        if changes == None:
+            self.full_runs += 1
+            self.trees       = {}
+            self.behind      = {}
+            self.ecmp_behind = {}
+        self.link_states = dict((_id, dict(peers)) for _id, peers in link_states.items())
+
         ##
         ## Generate the shortest-path tree with the local node as root
         ##
-        prev, cost = self._calculate_tree_from_root(self.id, collection)
-        nodes = prev.keys()
+        tree, computed = self._tree(self.id, link_states, changes)
+        self.trees[self.id] = tree
+        prev, cost = tree
+        cost = dict(cost)
 
         ##
         ## Distill the path tree into a map of next hops for each node
         ##
-        next_hops = {}
-        while len(nodes) > 0:
-            u = nodes[0]          # pick any destination
-            path = [u]
-            nodes.remove(u)
-            v = prev[u]
-            while v != self.id:   # build a list of nodes in the path back to the root
-                if v in nodes:
-                    path.append(v)
-                    nodes.remove(v)
-                u = v
-                v = prev[u]
-            for w in path:        # mark each node in the path as reachable via the next hop
-                next_hops[w] = u
+        next_hops      = self._calculate_next_hops(prev)
+        ecmp_next_hops = self._calculate_ecmp_next_hops(cost, link_states)
 
         ##
         ## Calculate the valid origins for remote routers
         ##
-        valid_origins = self._calculate_valid_origins(prev.keys(), collection)
+        valid_origins, ecmp_origins = self._calculate_valid_origins(prev.keys(), link_states, changes)
 
-        return (next_hops, cost, valid_origins)
+        return (next_hops, cost, valid_origins, ecmp_next_hops, ecmp_origins)
 
 
 
@@ -215,3 +417,55 @@ class NodeSet(object):
             index += 1
 
         self.nodes.insert(index, (_id, new_cost))
+
+
+
+class HeapNodeSet(object):
+    """
+    This data structure provides the same interface and the same ordering as NodeSet (increasing
+    cost, then increasing ID) but is backed by a binary heap.  Cost updates push a new heap entry
+    rather than re-sorting (lazy decrease-key); superseded entries are discarded when they reach
+    the top of the heap.  Membership tests are O(1).
+    """
+    def __init__(self, cost_map):
+        self.costs = {}   # id => current cost of each member
+        self.heap  = []   # (cost, id) entries, some of which may be stale
+        for _id, cost in cost_map.items():
+            self.costs[_id] = cost
+            if cost != None:
+                self.heap.append((cost, _id))
+        heapq.heapify(self.heap)
+
+
+    def __repr__(self):
+        return sorted(self.heap).__repr__()
+
+
+    def empty(self):
+        return len(self.costs) == 0
+
+
+    def contains(self, _id):
+        return _id in self.costs
+
+
+    def lowest_cost(self):
+        """
+        Remove and return the lowest cost node ID.  If none of the remaining nodes has a
+        known cost, an arbitrary (unreachable) node is returned.
+        """
+        while self.heap:
+            cost, _id = heapq.heappop(self.heap)
+            if _id in self.costs and self.costs[_id] == cost:
+                self.costs.pop(_id)
+                return _id
+        _id, cost = self.costs.popitem()
+        return _id
+
+
+    def set_cost(self, _id, new_cost):
+        """
+        Set the cost for an ID in the NodeSet.
+        """
+        self.costs[_id] = new_cost
+        heapq.heappush(self.heap, (new_cost, _id))
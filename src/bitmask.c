@@ -22,15 +22,30 @@
 #include <assert.h>
 #include <stdint.h>
 #include <stdlib.h>
+#include <string.h>
 #include <sys/types.h>
 
-#define QD_BITMASK_LONGS 2
-#define QD_BITMASK_BITS  (QD_BITMASK_LONGS * 64)
+//
+// A bitmask is stored sparsely as a set of 64-bit words.  Only words that have at least
+// one bit set are stored; they are kept in index order in a packed array and the 'present'
+// summary word has a bit set for each stored word.  The position of a word in the array is
+// the number of stored words with a lower index.  The memory used by a bitmask therefore
+// depends on how many distinct groups of 64 bits are in use rather than on the width.
+//
+// The packed array starts out in the bitmask itself and is moved to the heap if it
+// outgrows the local storage.
+//
+#define QD_BITMASK_WORDS 64
+#define QD_BITMASK_BITS  (QD_BITMASK_WORDS * 64)
+#define QD_BITMASK_LOCAL 2
 
 struct qd_bitmask_t {
-    uint64_t array[QD_BITMASK_LONGS];
-    int      first_set;
-    int      cardinality;
+    uint64_t  present;
+    uint64_t *words;
+    int       capacity;
+    int       first_set;
+    int       cardinality;
+    uint64_t  local[QD_BITMASK_LOCAL];
 };
 
 ALLOC_DECLARE(qd_bitmask_t);
@@ -42,6 +57,68 @@ ALLOC_DEFINE(qd_bitmask_t);
 #define FIRST_UNKNOWN -2
 
 
+//
+// Position in the packed array of the word with the given index
+//
+static inline int word_rank(const qd_bitmask_t *b, int idx)
+{
+    return __builtin_popcountll(b->present & ((((uint64_t) 1) << idx) - 1));
+}
+
+
+//
+// Return a pointer to the stored word with the given index, or 0 if it is not stored
+//
+static inline uint64_t *word_find(const qd_bitmask_t *b, int idx)
+{
+    if (!(b->present & (((uint64_t) 1) << idx)))
+        return 0;
+    return &b->words[word_rank(b, idx)];
+}
+
+
+//
+// Store a new, empty word with the given index and return a pointer to it
+//
+static uint64_t *word_insert(qd_bitmask_t *b, int idx)
+{
+    int count = __builtin_popcountll(b->present);
+    int rank  = word_rank(b, idx);
+
+    if (count == b->capacity) {
+        int       capacity = b->capacity * 2;
+        uint64_t *words;
+        if (capacity > QD_BITMASK_WORDS)
+            capacity = QD_BITMASK_WORDS;
+        if (b->words == b->local) {
+            words = (uint64_t*) malloc(capacity * sizeof(uint64_t));
+            memcpy(words, b->local, count * sizeof(uint64_t));
+        } else
+            words = (uint64_t*) realloc(b->words, capacity * sizeof(uint64_t));
+        b->words    = words;
+        b->capacity = capacity;
+    }
+
+    memmove(&b->words[rank + 1], &b->words[rank], (count - rank) * sizeof(uint64_t));
+    b->words[rank] = 0;
+    b->present |= ((uint64_t) 1) << idx;
+    return &b->words[rank];
+}
+
+
+//
+// Remove the stored word with the given index, which must be zero
+//
+static void word_remove(qd_bitmask_t *b, int idx)
+{
+    int count = __builtin_popcountll(b->present);
+    int rank  = word_rank(b, idx);
+
+    memmove(&b->words[rank], &b->words[rank + 1], (count - rank - 1) * sizeof(uint64_t));
+    b->present &= ~(((uint64_t) 1) << idx);
+}
+
+
 int qd_bitmask_width()
 {
     return QD_BITMASK_BITS;
@@ -51,6 +128,8 @@ int qd_bitmask_width()
 qd_bitmask_t *qd_bitmask(int initial)
 {
     qd_bitmask_t *b = new_qd_bitmask_t();
+    b->words    = b->local;
+    b->capacity = QD_BITMASK_LOCAL;
     if (initial)
         qd_bitmask_set_all(b);
     else
@@ -62,14 +141,23 @@ qd_bitmask_t *qd_bitmask(int initial)
 void qd_bitmask_free(qd_bitmask_t *b)
 {
     if (!b) return;
+    if (b->words != b->local)
+        free(b->words);
     free_qd_bitmask_t(b);
 }
 
 
 void qd_bitmask_set_all(qd_bitmask_t *b)
 {
-    for (int i = 0; i < QD_BITMASK_LONGS; i++)
-        b->array[i] = 0xFFFFFFFFFFFFFFFF;
+    if (b->capacity < QD_BITMASK_WORDS) {
+        if (b->words != b->local)
+            free(b->words);
+        b->words    = (uint64_t*) malloc(QD_BITMASK_WORDS * sizeof(uint64_t));
+        b->capacity = QD_BITMASK_WORDS;
+    }
+    for (int i = 0; i < QD_BITMASK_WORDS; i++)
+        b->words[i] = 0xFFFFFFFFFFFFFFFF;
+    b->present     = 0xFFFFFFFFFFFFFFFF;
     b->first_set   = 0;
     b->cardinality = QD_BITMASK_BITS;
 }
@@ -77,8 +165,7 @@ void qd_bitmask_set_all(qd_bitmask_t *b)
 
 void qd_bitmask_clear_all(qd_bitmask_t *b)
 {
-    for (int i = 0; i < QD_BITMASK_LONGS; i++)
-        b->array[i] = 0;
+    b->present     = 0;
     b->first_set   = FIRST_NONE;
     b->cardinality = 0;
 }
@@ -86,57 +173,57 @@ void qd_bitmask_clear_all(qd_bitmask_t *b)
 
 int qd_bitmask_set_bit(qd_bitmask_t *b, int bitnum)
 {
-    int old_value = 1;
     assert(bitnum < QD_BITMASK_BITS);
-    if ((b->array[MASK_INDEX(bitnum)] & MASK_ONEHOT(bitnum)) == 0) {
-        old_value = 0;
-        b->cardinality++;
-    }
-
-    b->array[MASK_INDEX(bitnum)] |= MASK_ONEHOT(bitnum);
-    if (b->first_set > bitnum || b->first_set < 0)
+    uint64_t *word = word_find(b, MASK_INDEX(bitnum));
+    if (!word)
+        word = word_insert(b, MASK_INDEX(bitnum));
+    else if (*word & MASK_ONEHOT(bitnum))
+        return 1;
+
+    *word |= MASK_ONEHOT(bitnum);
+    b->cardinality++;
+    if (b->first_set > bitnum || b->first_set == FIRST_NONE)
         b->first_set = bitnum;
 
-    return old_value;
+    return 0;
 }
 
 
 int qd_bitmask_clear_bit(qd_bitmask_t *b, int bitnum)
 {
-    int old_value = 0;
     assert(bitnum < QD_BITMASK_BITS);
-    if (b->array[MASK_INDEX(bitnum)] & MASK_ONEHOT(bitnum)) {
-        old_value = 1;
-        b->cardinality--;
-    }
+    uint64_t *word = word_find(b, MASK_INDEX(bitnum));
+    if (!word || !(*word & MASK_ONEHOT(bitnum)))
+        return 0;
 
-    b->array[MASK_INDEX(bitnum)] &= ~(MASK_ONEHOT(bitnum));
+    *word &= ~(MASK_ONEHOT(bitnum));
+    if (*word == 0)
+        word_remove(b, MASK_INDEX(bitnum));
+    b->cardinality--;
     if (b->first_set == bitnum)
         b->first_set = FIRST_UNKNOWN;
 
-    return old_value;
+    return 1;
 }
 
 
 int qd_bitmask_value(qd_bitmask_t *b, int bitnum)
 {
-    return (b->array[MASK_INDEX(bitnum)] & MASK_ONEHOT(bitnum)) ? 1 : 0;
+    uint64_t *word = word_find(b, MASK_INDEX(bitnum));
+    return (word && (*word & MASK_ONEHOT(bitnum))) ? 1 : 0;
 }
 
 
 int qd_bitmask_first_set(qd_bitmask_t *b, int *bitnum)
 {
     if (b->first_set == FIRST_UNKNOWN) {
-        b->first_set = FIRST_NONE;
-        for (int i = 0; i < QD_BITMASK_LONGS; i++)
-            if (b->array[i]) {
-                for (int j = 0; j < 64; j++)
-                    if ((((uint64_t) 1) << j) & b->array[i]) {
-                        b->first_set = i * 64 + j;
-                        break;
-                    }
-                break;
-            }
+        //
+        // The first stored word holds the lowest set bit
+        //
+        if (b->present)
+            b->first_set = __builtin_ctzll(b->present) * 64 + __builtin_ctzll(b->words[0]);
+        else
+            b->first_set = FIRST_NONE;
     }
 
     if (b->first_set == FIRST_NONE)
@@ -163,30 +250,29 @@ int _qdbm_start(qd_bitmask_t *b)
 
 void _qdbm_next(qd_bitmask_t *b, int *v)
 {
-    if (*v == QD_BITMASK_BITS - 1) {
-        *v = -1;
-        return;
-    }
-
-    int      idx  = MASK_INDEX(*v);
-    uint64_t bits = MASK_ONEHOT(*v);
-    int      next = *v;
-
-    while (1) {
-        next++;
-        if (bits & 0x8000000000000000LL) {
-            if (++idx == QD_BITMASK_LONGS) {
-                *v = -1;
-                return;
-            }
-            bits = 1;
-        } else
-            bits = bits << 1;
-
-        if (b->array[idx] & bits) {
-            *v = next;
+    int idx = MASK_INDEX(*v);
+    int bit = *v % 64;
+
+    //
+    // Look for a higher bit in the same word
+    //
+    if (bit < 63) {
+        uint64_t *word = word_find(b, idx);
+        uint64_t  rest = word ? *word & ~((((uint64_t) 1) << (bit + 1)) - 1) : 0;
+        if (rest) {
+            *v = idx * 64 + __builtin_ctzll(rest);
             return;
         }
     }
-}
 
+    //
+    // Otherwise take the lowest bit of the next stored word
+    //
+    uint64_t later = idx < 63 ? b->present & ~((((uint64_t) 1) << (idx + 1)) - 1) : 0;
+    if (!later) {
+        *v = -1;
+        return;
+    }
+    int next = __builtin_ctzll(later);
+    *v = next * 64 + __builtin_ctzll(b->words[word_rank(b, next)]);
+}
@@ -369,8 +369,21 @@ static PyObject* qd_python_log(PyObject *self, PyObject *args)
 }
 
 
+static PyObject* qd_python_log_enabled(PyObject *self, PyObject *args)
+{
+    int level;
+
+    if (!PyArg_ParseTuple(args, "i", &level))
+        return 0;
+
+    LogAdapter *self_ptr = (LogAdapter*) self;
+    return PyBool_FromLong(qd_log_enabled(self_ptr->log_source, level));
+}
+
+
 static PyMethodDef LogAdapter_methods[] = {
     {"log", qd_python_log, METH_VARARGS, "Emit a Log Line"},
+    {"enabled", qd_python_log_enabled, METH_VARARGS, "Return True if the log level is enabled"},
     {0, 0, 0, 0}
 };
 
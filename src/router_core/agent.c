@@ -25,7 +25,10 @@
 #include "agent_link.h"
 #include "agent_router.h"
 #include "router_core_private.h"
+#include <ctype.h>
 #include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 
 static void qdr_manage_read_CT(qdr_core_t *core, qdr_action_t *action, bool discard);
 static void qdr_manage_create_CT(qdr_core_t *core, qdr_action_t *action, bool discard);
@@ -34,6 +37,7 @@ static void qdr_manage_update_CT(qdr_core_t *core, qdr_action_t *action, bool di
 
 ALLOC_DECLARE(qdr_query_t);
 ALLOC_DEFINE(qdr_query_t);
+ALLOC_DEFINE(qdr_filter_term_t);
 
 //==================================================================================
 // Internal Functions
@@ -97,6 +101,7 @@ static void qdrh_query_get_first_CT(qdr_core_t *core, qdr_action_t *action, bool
 static void qdrh_query_get_next_CT(qdr_core_t *core, qdr_action_t *action, bool discard);
 static void qdr_agent_emit_columns(qdr_query_t *query, const char *qdr_columns[], int column_count);
 static void qdr_agent_set_columns(qdr_query_t *query, qd_parsed_field_t *attribute_names, const char *qdr_columns[], int column_count);
+static void qdr_agent_set_filter(qdr_query_t *query, qd_parsed_field_t *filter, const char *qdr_columns[]);
 
 //==================================================================================
 // Interface Functions
@@ -179,6 +184,7 @@ qdr_query_t *qdr_manage_query(qdr_core_t              *core,
                               void                    *context,
                               qd_router_entity_type_t  type,
                               qd_parsed_field_t       *attribute_names,
+                              qd_parsed_field_t       *filter,
                               qd_composed_field_t     *body)
 {
 
@@ -197,6 +203,15 @@ qdr_query_t *qdr_manage_query(qdr_core_t              *core,
     case QD_ROUTER_BINDING:           break;
     }
 
+    //
+    // Filters are evaluated for the entity types with many instances only.
+    //
+    switch (query->entity_type) {
+    case QD_ROUTER_LINK:    qdr_agent_set_filter(query, filter, qdr_link_columns);    break;
+    case QD_ROUTER_ADDRESS: qdr_agent_set_filter(query, filter, qdr_address_columns); break;
+    default:                qdr_agent_set_filter(query, filter, 0);                   break;
+    }
+
     return query;
 }
 
@@ -242,6 +257,14 @@ void qdr_query_free(qdr_query_t *query)
     if (query->next_key)
         qdr_field_free(query->next_key);
 
+    qdr_filter_term_t *term = DEQ_HEAD(query->filter);
+    while (term) {
+        DEQ_REMOVE_HEAD(query->filter);
+        free(term->text);
+        free_qdr_filter_term_t(term);
+        term = DEQ_HEAD(query->filter);
+    }
+
     free_qdr_query_t(query);
 }
 
@@ -310,6 +333,195 @@ static void qdr_agent_set_columns(qdr_query_t *query,
 }
 
 
+/**
+ * Parse one filter condition of the form <attribute><operator><value> and add it to the
+ * filter of the query.  The operators are = != < <= > >= and ^= (prefix).
+ */
+static bool qdr_agent_add_filter_term(qdr_query_t *query, qd_parsed_field_t *field, const char *qdr_columns[])
+{
+    uint8_t tag = qd_parse_tag(field);
+    if (tag != QD_AMQP_STR8_UTF8 && tag != QD_AMQP_STR32_UTF8 && tag != QD_AMQP_SYM8 && tag != QD_AMQP_SYM32) {
+        query->status = QD_AMQP_BAD_REQUEST;
+        return false;
+    }
+
+    char       *expr   = (char*) qd_iterator_copy(qd_parse_raw(field));
+    const char *cursor = expr;
+    while (*cursor && (isalnum((unsigned char) *cursor) || *cursor == '_' || *cursor == '.'))
+        cursor++;
+    size_t name_len = cursor - expr;
+
+    qdr_filter_op_t op;
+    if      (strncmp(cursor, "!=", 2) == 0) { op = QDR_FILTER_NE;     cursor += 2; }
+    else if (strncmp(cursor, "<=", 2) == 0) { op = QDR_FILTER_LE;     cursor += 2; }
+    else if (strncmp(cursor, ">=", 2) == 0) { op = QDR_FILTER_GE;     cursor += 2; }
+    else if (strncmp(cursor, "^=", 2) == 0) { op = QDR_FILTER_PREFIX; cursor += 2; }
+    else if (*cursor == '=')                { op = QDR_FILTER_EQ;     cursor++; }
+    else if (*cursor == '<')                { op = QDR_FILTER_LT;     cursor++; }
+    else if (*cursor == '>')                { op = QDR_FILTER_GT;     cursor++; }
+    else {
+        free(expr);
+        query->status = QD_AMQP_BAD_REQUEST;
+        return false;
+    }
+
+    int column = -1;
+    for (int j = 0; name_len > 0 && qdr_columns[j]; j++) {
+        if (strlen(qdr_columns[j]) == name_len && strncmp(qdr_columns[j], expr, name_len) == 0) {
+            column = j;
+            break;
+        }
+    }
+    if (column < 0) {
+        free(expr);
+        query->status = QD_AMQP_NOT_FOUND;
+        return false;
+    }
+
+    qdr_filter_term_t *term = new_qdr_filter_term_t();
+    ZERO(term);
+    DEQ_ITEM_INIT(term);
+    term->column = column;
+    term->op     = op;
+    term->text   = strdup(cursor);
+    free(expr);
+
+    char *end;
+    term->number    = strtod(term->text, &end);
+    term->is_number = *term->text && *end == '\0';
+    DEQ_INSERT_TAIL(query->filter, term);
+
+    //
+    // Order comparisons are numeric only.
+    //
+    if (!term->is_number && op != QDR_FILTER_EQ && op != QDR_FILTER_NE && op != QDR_FILTER_PREFIX) {
+        query->status = QD_AMQP_BAD_REQUEST;
+        return false;
+    }
+    return true;
+}
+
+
+/**
+ * Set the filter of a query from the "filter" field of the request body: a single condition
+ * or a list of conditions that must all match.  qdr_columns is null for the entity types
+ * that do not support filters.
+ */
+static void qdr_agent_set_filter(qdr_query_t *query, qd_parsed_field_t *filter, const char *qdr_columns[])
+{
+    if (!filter || qd_parse_tag(filter) == QD_AMQP_NULL)
+        return;
+
+    if (!qdr_columns) {
+        query->status        = QD_AMQP_NOT_IMPLEMENTED;
+        query->filter_failed = true;
+        return;
+    }
+
+    if (qd_parse_is_list(filter)) {
+        uint32_t count = qd_parse_sub_count(filter);
+        for (uint32_t idx = 0; idx < count; idx++) {
+            if (!qdr_agent_add_filter_term(query, qd_parse_sub_value(filter, idx), qdr_columns)) {
+                query->filter_failed = true;
+                return;
+            }
+        }
+    } else if (!qdr_agent_add_filter_term(query, filter, qdr_columns))
+        query->filter_failed = true;
+}
+
+
+static bool qdr_agent_filter_term_match(qdr_filter_term_t *term, qd_parsed_field_t *value)
+{
+    bool           is_number = true;
+    double         number    = 0;
+    const char    *text      = 0;
+    qd_iterator_t *iter      = 0;
+
+    switch (qd_parse_tag(value)) {
+    case QD_AMQP_UINT0:
+    case QD_AMQP_UBYTE:
+    case QD_AMQP_USHORT:
+    case QD_AMQP_UINT:
+    case QD_AMQP_SMALLUINT:
+        number = (double) qd_parse_as_uint(value);
+        break;
+
+    case QD_AMQP_ULONG0:
+    case QD_AMQP_ULONG:
+    case QD_AMQP_SMALLULONG:
+        number = (double) qd_parse_as_ulong(value);
+        break;
+
+    case QD_AMQP_BYTE:
+    case QD_AMQP_SHORT:
+    case QD_AMQP_INT:
+    case QD_AMQP_SMALLINT:
+        number = (double) qd_parse_as_int(value);
+        break;
+
+    case QD_AMQP_LONG:
+    case QD_AMQP_SMALLLONG:
+        number = (double) qd_parse_as_long(value);
+        break;
+
+    case QD_AMQP_TRUE:
+    case QD_AMQP_FALSE:
+    case QD_AMQP_BOOLEAN:
+        is_number = false;
+        text      = qd_parse_as_bool(value) ? "true" : "false";
+        break;
+
+    case QD_AMQP_STR8_UTF8:
+    case QD_AMQP_STR32_UTF8:
+    case QD_AMQP_SYM8:
+    case QD_AMQP_SYM32:
+        is_number = false;
+        iter      = qd_parse_raw(value);
+        break;
+
+    default:
+        //
+        // Null, lists and maps match nothing but "!="
+        //
+        return term->op == QDR_FILTER_NE;
+    }
+
+    if (is_number) {
+        if (!term->is_number)
+            return term->op == QDR_FILTER_NE;
+        switch (term->op) {
+        case QDR_FILTER_EQ:     return number == term->number;
+        case QDR_FILTER_NE:     return number != term->number;
+        case QDR_FILTER_LT:     return number <  term->number;
+        case QDR_FILTER_LE:     return number <= term->number;
+        case QDR_FILTER_GT:     return number >  term->number;
+        case QDR_FILTER_GE:     return number >= term->number;
+        case QDR_FILTER_PREFIX: return false;
+        }
+        return false;
+    }
+
+    bool equal;
+    bool prefix;
+    if (text) {
+        equal  = strcmp(text, term->text) == 0;
+        prefix = strncmp(text, term->text, strlen(term->text)) == 0;
+    } else {
+        equal  = qd_iterator_equal(iter, (const unsigned char*) term->text);
+        prefix = qd_iterator_prefix(iter, term->text);
+        qd_iterator_reset(iter);
+    }
+
+    switch (term->op) {
+    case QDR_FILTER_EQ:     return equal;
+    case QDR_FILTER_NE:     return !equal;
+    case QDR_FILTER_PREFIX: return prefix;
+    default:                return false;
+    }
+}
+
+
 
 void qdr_manage_handler(qdr_core_t *core, qdr_manage_response_t response_handler)
 {
@@ -321,6 +533,38 @@ void qdr_manage_handler(qdr_core_t *core, qdr_manage_response_t response_handler
 // In-Thread Functions
 //==================================================================================
 
+bool qdr_agent_filter_match_CT(qdr_core_t *core, qdr_query_t *query, qdr_agent_write_column_t write_column, void *object)
+{
+    qdr_filter_term_t *term = DEQ_HEAD(query->filter);
+
+    while (term) {
+        //
+        // Compose the column as it would appear in the response and parse it back to
+        // get its type and value.
+        //
+        qd_buffer_list_t     buffers;
+        qd_composed_field_t *field = qd_compose_subfield(0);
+        write_column(core, object, field, term->column);
+        qd_compose_take_buffers(field, &buffers);
+        qd_compose_free(field);
+
+        qd_iterator_t     *iter  = qd_iterator_buffer(DEQ_HEAD(buffers), 0, qd_buffer_list_length(&buffers), ITER_VIEW_ALL);
+        qd_parsed_field_t *value = qd_parse(iter);
+        bool match = value && qd_parse_ok(value) && qdr_agent_filter_term_match(term, value);
+
+        qd_parse_free(value);
+        qd_iterator_free(iter);
+        qd_buffer_list_free_buffers(&buffers);
+
+        if (!match)
+            return false;
+        term = DEQ_NEXT(term);
+    }
+
+    return true;
+}
+
+
 void qdr_agent_setup_CT(qdr_core_t *core)
 {
     DEQ_INIT(core->outgoing_query_list);
@@ -445,6 +689,15 @@ static void qdrh_query_get_first_CT(qdr_core_t *core, qdr_action_t *action, bool
     qdr_query_t *query  = action->args.agent.query;
     int          offset = action->args.agent.offset;
 
+    if (!discard && query->filter_failed) {
+        //
+        // End the query with the error found in the filter, without results.
+        //
+        query->more = false;
+        qdr_agent_enqueue_response_CT(core, query);
+        return;
+    }
+
     if (!discard) {
         switch (query->entity_type) {
         case QD_ROUTER_CONFIG_ADDRESS:    qdra_config_address_get_first_CT(core, query, offset); break;
@@ -143,7 +143,7 @@ static void qdr_insert_address_columns_CT(qdr_core_t          *core,
     case QDR_ADDRESS_TRANSIT_OUTSTANDING:
         if (addr->outstanding_deliveries) {
             qd_compose_start_list(body);
-            for (int i = 0; i < qd_bitmask_width(); i++)
+            for (int i = 0; i < QDR_MAX_INTER_ROUTER_CONNECTIONS; i++)
                 qd_compose_insert_long(body, addr->outstanding_deliveries[i]);
             qd_compose_end_list(body);
         } else
@@ -196,10 +196,30 @@ static void qdr_manage_write_address_list_CT(qdr_core_t *core, qdr_query_t *quer
 }
 
 
-static void qdr_manage_advance_address_CT(qdr_query_t *query, qdr_address_t *addr)
+static void qdr_agent_write_address_column_CT(qdr_core_t *core, void *object, qd_composed_field_t *body, int col)
+{
+    qdr_insert_address_columns_CT(core, (qdr_address_t*) object, body, col);
+}
+
+
+//
+// Return the first address, starting at addr, that passes the filter of the query.  The
+// addresses skipped are counted in query->next_offset.
+//
+static qdr_address_t *qdr_manage_filter_address_CT(qdr_core_t *core, qdr_query_t *query, qdr_address_t *addr)
+{
+    while (addr && !qdr_agent_filter_match_CT(core, query, qdr_agent_write_address_column_CT, addr)) {
+        query->next_offset++;
+        addr = DEQ_NEXT(addr);
+    }
+    return addr;
+}
+
+
+static void qdr_manage_advance_address_CT(qdr_core_t *core, qdr_query_t *query, qdr_address_t *addr)
 {
     query->next_offset++;
-    addr = DEQ_NEXT(addr);
+    addr = qdr_manage_filter_address_CT(core, query, DEQ_NEXT(addr));
     if (addr) {
         query->more     = true;
         query->next_key = qdr_field((const char*) qd_hash_key_by_handle(addr->hash_handle));
@@ -247,23 +267,25 @@ void qdra_address_get_first_CT(qdr_core_t *core, qdr_query_t *query, int offset)
     //
     query->status = QD_AMQP_OK;
 
+    //
+    // Run to the address at the offset, counting only the addresses that pass the filter.
+    //
+    query->next_offset = 0;
+    qdr_address_t *addr = qdr_manage_filter_address_CT(core, query, DEQ_HEAD(core->addrs));
+    for (int i = 0; i < offset && addr; i++) {
+        query->next_offset++;
+        addr = qdr_manage_filter_address_CT(core, query, DEQ_NEXT(addr));
+    }
+
     //
     // If the offset goes beyond the set of addresses, end the query now.
     //
-    if (offset >= DEQ_SIZE(core->addrs)) {
+    if (!addr) {
         query->more = false;
         qdr_agent_enqueue_response_CT(core, query);
         return;
     }
 
-    //
-    // Run to the address at the offset.
-    //
-    qdr_address_t *addr = DEQ_HEAD(core->addrs);
-    for (int i = 0; i < offset && addr; i++)
-        addr = DEQ_NEXT(addr);
-    assert(addr != 0);
-
     //
     // Write the columns of the address entity into the response body.
     //
@@ -272,8 +294,7 @@ void qdra_address_get_first_CT(qdr_core_t *core, qdr_query_t *query, int offset)
     //
     // Advance to the next address
     //
-    query->next_offset = offset;
-    qdr_manage_advance_address_CT(query, addr);
+    qdr_manage_advance_address_CT(core, query, addr);
 
     //
     // Enqueue the response.
@@ -306,6 +327,11 @@ void qdra_address_get_next_CT(qdr_core_t *core, qdr_query_t *query)
         }
     }
 
+    //
+    // The addresses may have changed since the previous get, check the filter again.
+    //
+    addr = qdr_manage_filter_address_CT(core, query, addr);
+
     if (addr) {
         //
         // Write the columns of the address entity into the response body.
@@ -315,7 +341,7 @@ void qdra_address_get_next_CT(qdr_core_t *core, qdr_query_t *query)
         //
         // Advance to the next address
         //
-        qdr_manage_advance_address_CT(query, addr);
+        qdr_manage_advance_address_CT(core, query, addr);
     } else
         query->more = false;
 
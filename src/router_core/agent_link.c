@@ -200,6 +200,25 @@ static void qdr_agent_write_column_CT(qd_composed_field_t *body, int col, qdr_li
     }
 }
 
+static void qdr_agent_write_link_column_CT(qdr_core_t *core, void *object, qd_composed_field_t *body, int col)
+{
+    qdr_agent_write_column_CT(body, col, (qdr_link_t*) object);
+}
+
+
+//
+// Return the first link, starting at link, that passes the filter of the query.  The
+// links skipped are counted in query->next_offset.
+//
+static qdr_link_t *qdr_manage_filter_link_CT(qdr_core_t *core, qdr_query_t *query, qdr_link_t *link)
+{
+    while (link && !qdr_agent_filter_match_CT(core, query, qdr_agent_write_link_column_CT, link)) {
+        query->next_offset++;
+        link = DEQ_NEXT(link);
+    }
+    return link;
+}
+
 static void qdr_agent_write_link_CT(qdr_query_t *query,  qdr_link_t *link)
 {
     qd_composed_field_t *body = query->body;
@@ -213,10 +232,10 @@ static void qdr_agent_write_link_CT(qdr_query_t *query,  qdr_link_t *link)
     qd_compose_end_list(body);
 }
 
-static void qdr_manage_advance_link_CT(qdr_query_t *query, qdr_link_t *link)
+static void qdr_manage_advance_link_CT(qdr_core_t *core, qdr_query_t *query, qdr_link_t *link)
 {
     query->next_offset++;
-    link = DEQ_NEXT(link);
+    link = qdr_manage_filter_link_CT(core, query, DEQ_NEXT(link));
     if (link) {
         query->more     = true;
         //query->next_key = qdr_field((const char*) qd_hash_key_by_handle(link->owning_addr->hash_handle));
@@ -232,33 +251,34 @@ void qdra_link_get_first_CT(qdr_core_t *core, qdr_query_t *query, int offset)
     //
     query->status = QD_AMQP_OK;
 
+    //
+    // Run to the link at the offset, counting only the links that pass the filter.
+    //
+    query->next_offset = 0;
+    qdr_link_t *link = qdr_manage_filter_link_CT(core, query, DEQ_HEAD(core->open_links));
+    for (int i = 0; i < offset && link; i++) {
+        query->next_offset++;
+        link = qdr_manage_filter_link_CT(core, query, DEQ_NEXT(link));
+    }
+
     //
     // If the offset goes beyond the set of links, end the query now.
     //
-    if (offset >= DEQ_SIZE(core->open_links)) {
+    if (!link) {
         query->more = false;
         qdr_agent_enqueue_response_CT(core, query);
         return;
     }
 
-    //
-    // Run to the address at the offset.
-    //
-    qdr_link_t *link = DEQ_HEAD(core->open_links);
-    for (int i = 0; i < offset && link; i++)
-        link = DEQ_NEXT(link);
-    assert(link);
-
     //
     // Write the columns of the link into the response body.
     //
     qdr_agent_write_link_CT(query, link);
 
     //
-    // Advance to the next address
+    // Advance to the next link
     //
-    query->next_offset = offset;
-    qdr_manage_advance_link_CT(query, link);
+    qdr_manage_advance_link_CT(core, query, link);
 
     //
     // Enqueue the response.
@@ -277,6 +297,11 @@ void qdra_link_get_next_CT(qdr_core_t *core, qdr_query_t *query)
                 link = DEQ_NEXT(link);
         }
 
+    //
+    // The links may have changed since the previous get, check the filter again.
+    //
+    link = qdr_manage_filter_link_CT(core, query, link);
+
     if (link) {
         //
         // Write the columns of the link entity into the response body.
@@ -286,7 +311,7 @@ void qdra_link_get_next_CT(qdr_core_t *core, qdr_query_t *query)
         //
         // Advance to the next link
         //
-        qdr_manage_advance_link_CT(query, link);
+        qdr_manage_advance_link_CT(core, query, link);
     } else
         query->more = false;
 
@@ -46,6 +46,9 @@
 #define QDR_ROUTER_ROUTER_ID              21
 #define QDR_ROUTER_MOBILE_ADDR_MAX_AGE    22
 #define QDR_ROUTER_CONNECTION_COUNT       23
+#define QDR_ROUTER_SPF_RECOMPUTES_AVOIDED 24
+#define QDR_ROUTER_CONTROL_REQUESTS_QUEUED 25
+#define QDR_ROUTER_CONTROL_REQUESTS_SENT  26
 
 const char *qdr_router_columns[] =
     {"name",
@@ -72,6 +75,9 @@ const char *qdr_router_columns[] =
      "routerId",
      "mobileAddrMaxAge",
      "connectionCount",
+     "spfRecomputesAvoided",
+     "controlRequestsQueued",
+     "controlRequestsSent",
      0};
 
 
@@ -143,6 +149,18 @@ static void qdr_agent_write_column_CT(qd_composed_field_t *body, int col, qdr_co
         qd_compose_insert_ulong(body, DEQ_SIZE(core->auto_links));
         break;
 
+    case QDR_ROUTER_SPF_RECOMPUTES_AVOIDED:
+        qd_compose_insert_ulong(body, core->spf_recomputes_avoided);
+        break;
+
+    case QDR_ROUTER_CONTROL_REQUESTS_QUEUED:
+        qd_compose_insert_ulong(body, core->control_requests_queued);
+        break;
+
+    case QDR_ROUTER_CONTROL_REQUESTS_SENT:
+        qd_compose_insert_ulong(body, core->control_requests_sent);
+        break;
+
     case QDR_ROUTER_ROUTER_ID:
     case QDR_ROUTER_ID:
     case QDR_ROUTER_NAME:
@@ -98,6 +98,58 @@ static void qdr_forward_find_closest_remotes_CT(qdr_core_t *core, qdr_address_t
 }
 
 
+//
+// Return the index of the equal-cost next hop of a remote router at which the next search
+// of its next hops starts, and advance it so that successive deliveries rotate through them.
+//
+static int qdr_forward_next_hop_index_CT(qdr_node_t *rnode, int count)
+{
+    int index = rnode->next_hop_index % count;
+    rnode->next_hop_index = (index + 1) % count;
+    return index;
+}
+
+
+//
+// Return the node of the index'th equal-cost next hop of a remote router, or null if
+// that router is no longer known.
+//
+static qdr_node_t *qdr_forward_ecmp_node_CT(qdr_core_t *core, qdr_node_t *rnode, int index)
+{
+    int node_bit;
+    int c;
+
+    for (QD_BITMASK_EACH(rnode->next_hops, node_bit, c)) {
+        if (index-- == 0)
+            return core->routers_by_mask_bit[node_bit];
+    }
+    return 0;
+}
+
+
+//
+// Return the link to the neighbor through which a remote router is reached.  If there are
+// several equal-cost next hops, successive calls rotate through them.  The primary next
+// hop is used if the selected equal-cost next hop has no link.
+//
+static qdr_link_t *qdr_forward_peer_link_CT(qdr_core_t *core, qdr_node_t *rnode, bool control)
+{
+    qdr_node_t *next_node = rnode->next_hop ? rnode->next_hop : rnode;
+    qdr_link_t *link      = 0;
+    int         count     = rnode->next_hops ? qd_bitmask_cardinality(rnode->next_hops) : 0;
+
+    if (count > 0) {
+        qdr_node_t *ecmp_node = qdr_forward_ecmp_node_CT(core, rnode, qdr_forward_next_hop_index_CT(rnode, count));
+        if (ecmp_node)
+            link = control ? PEER_CONTROL_LINK(core, ecmp_node) : PEER_DATA_LINK(core, ecmp_node);
+    }
+
+    if (!link)
+        link = control ? PEER_CONTROL_LINK(core, next_node) : PEER_DATA_LINK(core, next_node);
+    return link;
+}
+
+
 qdr_delivery_t *qdr_forward_new_delivery_CT(qdr_core_t *core, qdr_delivery_t *in_dlv, qdr_link_t *link, qd_message_t *msg)
 {
     qdr_delivery_t *dlv = new_qdr_delivery_t();
@@ -415,10 +467,9 @@ int qdr_forward_closest_CT(qdr_core_t      *core,
 
     //
     // Forward to remote routers with subscribers using the appropriate
-    // link for the traffic class: control or data
+    // link for the traffic class: control or data.  If there are several
+    // equal-cost paths to the remote router, the deliveries are spread across them.
     //
-    qdr_node_t *next_node;
-
     if (addr->next_remote >= 0) {
         qdr_node_t *rnode = core->routers_by_mask_bit[addr->next_remote];
         if (rnode) {
@@ -426,12 +477,7 @@ int qdr_forward_closest_CT(qdr_core_t      *core,
             if (addr->next_remote == -1)
                 qd_bitmask_first_set(addr->closest_remotes, &addr->next_remote);
 
-            if (rnode->next_hop)
-                next_node = rnode->next_hop;
-            else
-                next_node = rnode;
-
-            out_link = control ? PEER_CONTROL_LINK(core, next_node) : PEER_DATA_LINK(core, next_node);
+            out_link = qdr_forward_peer_link_CT(core, rnode, control);
             if (out_link) {
                 out_delivery = qdr_forward_new_delivery_CT(core, in_delivery, out_link, msg);
                 qdr_forward_deliver_CT(core, out_link, out_delivery);
@@ -461,8 +507,8 @@ int qdr_forward_balanced_CT(qdr_core_t      *core,
     // If this is the first time through here, allocate the array for outstanding delivery counts.
     //
     if (addr->outstanding_deliveries == 0) {
-        addr->outstanding_deliveries = NEW_ARRAY(int, qd_bitmask_width());
-        for (int i = 0; i < qd_bitmask_width(); i++)
+        addr->outstanding_deliveries = NEW_ARRAY(int, QDR_MAX_INTER_ROUTER_CONNECTIONS);
+        for (int i = 0; i < QDR_MAX_INTER_ROUTER_CONNECTIONS; i++)
             addr->outstanding_deliveries[i] = 0;
     }
 
@@ -531,15 +577,40 @@ int qdr_forward_balanced_CT(qdr_core_t      *core,
         int c;
         int node_bit;
         for (QD_BITMASK_EACH(addr->rnodes, node_bit, c)) {
-            qdr_node_t *rnode     = core->routers_by_mask_bit[node_bit];
+            qdr_node_t *rnode = core->routers_by_mask_bit[node_bit];
+
+            //
+            // Over an equal-cost path that is not on the origin's shortest-path tree, the
+            // origin is valid only if it is one of the router's ECMP origins.
+            //
+            if (!qd_bitmask_value(rnode->valid_origins, origin) &&
+                !(rnode->ecmp_origins && qd_bitmask_value(rnode->ecmp_origins, origin)))
+                continue;
+
+            //
+            // Every equal-cost next hop is a candidate.  The search starts at a rotating
+            // next hop so that ties are not always broken in favor of the same link.
+            // Without equal-cost paths, the single next hop (or the router itself if it
+            // is a neighbor) is used.
+            //
             qdr_node_t *next_node = rnode->next_hop ? rnode->next_hop : rnode;
-            qdr_link_t *link      = PEER_DATA_LINK(core, next_node);
-            if (!link) continue;
-            int         link_bit  = link->conn->mask_bit;
-            int         value     = addr->outstanding_deliveries[link_bit];
-            bool        eligible  = link->capacity > value;
+            int         hop_count = rnode->next_hops ? qd_bitmask_cardinality(rnode->next_hops) : 0;
+            int         hop_start = hop_count > 0 ? qdr_forward_next_hop_index_CT(rnode, hop_count) : 0;
+            int         hop_limit = hop_count > 0 ? hop_count : 1;
+
+            for (int hop = 0; hop < hop_limit; hop++) {
+                if (hop_count > 0) {
+                    next_node = qdr_forward_ecmp_node_CT(core, rnode, (hop_start + hop) % hop_count);
+                    if (!next_node)
+                        continue;
+                }
+
+                qdr_link_t *link = PEER_DATA_LINK(core, next_node);
+                if (!link) continue;
+                int         link_bit  = link->conn->mask_bit;
+                int         value     = addr->outstanding_deliveries[link_bit];
+                bool        eligible  = link->capacity > value;
 
-            if (qd_bitmask_value(rnode->valid_origins, origin)) {
                 //
                 // Link is a candidate, adjust the value by the bias (node cost).
                 //
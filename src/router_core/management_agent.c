@@ -39,6 +39,7 @@ const char *IDENTITY = "identity";
 
 const char *OPERATION = "operation";
 const char *ATTRIBUTE_NAMES = "attributeNames";
+const char *FILTER = "filter";
 
 const unsigned char *config_address_entity_type = (unsigned char*) "org.apache.qpid.dispatch.router.config.address";
 const unsigned char *link_route_entity_type     = (unsigned char*) "org.apache.qpid.dispatch.router.config.linkRoute";
@@ -236,17 +237,19 @@ static void qd_core_agent_query_handler(qdr_core_t                 *core,
 
     // Grab the attribute names from the incoming message body. The attribute names will be used later on in the response.
     qd_parsed_field_t *attribute_names_parsed_field = 0;
+    qd_parsed_field_t *filter_parsed_field = 0;
 
     qd_iterator_t *body_iter = qd_message_field_iterator(msg, QD_FIELD_BODY);
 
     qd_parsed_field_t *body = qd_parse(body_iter);
     if (body != 0 && qd_parse_is_map(body)) {
         attribute_names_parsed_field = qd_parse_value_by_key(body, ATTRIBUTE_NAMES);
+        filter_parsed_field = qd_parse_value_by_key(body, FILTER);
     }
 
     // Set the callback function.
     qdr_manage_handler(core, qd_manage_response_handler);
-    ctx->query = qdr_manage_query(core, ctx, entity_type, attribute_names_parsed_field, field);
+    ctx->query = qdr_manage_query(core, ctx, entity_type, attribute_names_parsed_field, filter_parsed_field, field);
 
     //Add the attribute names
     qdr_query_add_attribute_names(ctx->query); //this adds a list of attribute names like ["attribute1", "attribute2", "attribute3", "attribute4",]
@@ -28,6 +28,9 @@ static void qdr_set_next_hop_CT      (qdr_core_t *core, qdr_action_t *action, bo
 static void qdr_remove_next_hop_CT   (qdr_core_t *core, qdr_action_t *action, bool discard);
 static void qdr_set_cost_CT          (qdr_core_t *core, qdr_action_t *action, bool discard);
 static void qdr_set_valid_origins_CT (qdr_core_t *core, qdr_action_t *action, bool discard);
+static void qdr_set_routes_CT        (qdr_core_t *core, qdr_action_t *action, bool discard);
+static void qdr_set_recomputes_avoided_CT (qdr_core_t *core, qdr_action_t *action, bool discard);
+static void qdr_set_request_counters_CT (qdr_core_t *core, qdr_action_t *action, bool discard);
 static void qdr_map_destination_CT   (qdr_core_t *core, qdr_action_t *action, bool discard);
 static void qdr_unmap_destination_CT (qdr_core_t *core, qdr_action_t *action, bool discard);
 static void qdr_subscribe_CT         (qdr_core_t *core, qdr_action_t *action, bool discard);
@@ -47,6 +50,16 @@ void qdr_core_add_router(qdr_core_t *core, const char *address, int router_maskb
 }
 
 
+void qdr_core_add_border_router(qdr_core_t *core, const char *address, int router_maskbit)
+{
+    qdr_action_t *action = qdr_action(qdr_add_router_CT, "add_border_router");
+    action->args.route_table.router_maskbit = router_maskbit;
+    action->args.route_table.address        = qdr_field(address);
+    action->args.route_table.border         = true;
+    qdr_action_enqueue(core, action);
+}
+
+
 void qdr_core_del_router(qdr_core_t *core, int router_maskbit)
 {
     qdr_action_t *action = qdr_action(qdr_del_router_CT, "del_router");
@@ -107,6 +120,32 @@ void qdr_core_set_valid_origins(qdr_core_t *core, int router_maskbit, qd_bitmask
 }
 
 
+void qdr_core_set_routes(qdr_core_t *core, qdr_route_update_t *updates, int count)
+{
+    qdr_action_t *action = qdr_action(qdr_set_routes_CT, "set_routes");
+    action->args.route_table.updates      = updates;
+    action->args.route_table.update_count = count;
+    qdr_action_enqueue(core, action);
+}
+
+
+void qdr_core_set_recomputes_avoided(qdr_core_t *core, uint64_t count)
+{
+    qdr_action_t *action = qdr_action(qdr_set_recomputes_avoided_CT, "set_recomputes_avoided");
+    action->args.route_table.counter = count;
+    qdr_action_enqueue(core, action);
+}
+
+
+void qdr_core_set_request_counters(qdr_core_t *core, uint64_t queued, uint64_t sent)
+{
+    qdr_action_t *action = qdr_action(qdr_set_request_counters_CT, "set_request_counters");
+    action->args.route_table.counter      = queued;
+    action->args.route_table.sent_counter = sent;
+    qdr_action_enqueue(core, action);
+}
+
+
 void qdr_core_map_destination(qdr_core_t *core, int router_maskbit, const char *address_hash)
 {
     qdr_action_t *action = qdr_action(qdr_map_destination_CT, "map_destination");
@@ -228,13 +267,16 @@ void qdr_route_table_setup_CT(qdr_core_t *core)
         core->router_addr_T   = qdr_add_local_address_CT(core, 'T', "qdrouter",    QD_TREATMENT_MULTICAST_FLOOD);
         core->routerma_addr_T = qdr_add_local_address_CT(core, 'T', "qdrouter.ma", QD_TREATMENT_MULTICAST_ONCE);
 
-        core->neighbor_free_mask = qd_bitmask(1);
+        core->neighbor_free_mask = qd_bitmask(0);
+        for (int idx = 0; idx < QDR_MAX_INTER_ROUTER_CONNECTIONS; idx++)
+            qd_bitmask_set_bit(core->neighbor_free_mask, idx);
 
         core->routers_by_mask_bit       = NEW_PTR_ARRAY(qdr_node_t, qd_bitmask_width());
-        core->control_links_by_mask_bit = NEW_PTR_ARRAY(qdr_link_t, qd_bitmask_width());
-        core->data_links_by_mask_bit    = NEW_PTR_ARRAY(qdr_link_t, qd_bitmask_width());
-        for (int idx = 0; idx < qd_bitmask_width(); idx++) {
-            core->routers_by_mask_bit[idx]   = 0;
+        core->control_links_by_mask_bit = NEW_PTR_ARRAY(qdr_link_t, QDR_MAX_INTER_ROUTER_CONNECTIONS);
+        core->data_links_by_mask_bit    = NEW_PTR_ARRAY(qdr_link_t, QDR_MAX_INTER_ROUTER_CONNECTIONS);
+        for (int idx = 0; idx < qd_bitmask_width(); idx++)
+            core->routers_by_mask_bit[idx] = 0;
+        for (int idx = 0; idx < QDR_MAX_INTER_ROUTER_CONNECTIONS; idx++) {
             core->control_links_by_mask_bit[idx] = 0;
             core->data_links_by_mask_bit[idx] = 0;
         }
@@ -246,6 +288,7 @@ static void qdr_add_router_CT(qdr_core_t *core, qdr_action_t *action, bool disca
 {
     int          router_maskbit = action->args.route_table.router_maskbit;
     qdr_field_t *address        = action->args.route_table.address;
+    bool         border         = action->args.route_table.border;
 
     if (discard) {
         qdr_field_free(address);
@@ -298,7 +341,11 @@ static void qdr_add_router_CT(qdr_core_t *core, qdr_action_t *action, bool disca
         rnode->link_mask_bit     = -1;
         rnode->ref_count         = 0;
         rnode->valid_origins     = qd_bitmask(0);
+        rnode->next_hops         = 0;
+        rnode->ecmp_origins      = 0;
+        rnode->next_hop_index    = 0;
         rnode->cost              = 0;
+        rnode->border            = border;
 
         //
         // Insert at the head of the list because we don't yet know the cost to this
@@ -312,18 +359,18 @@ static void qdr_add_router_CT(qdr_core_t *core, qdr_action_t *action, bool disca
         // Link the router record to the address record.
         //
         qd_bitmask_set_bit(addr->rnodes, router_maskbit);
+        rnode->ref_count++;
 
         //
         // Link the router record to the router address records.
-        // Use the T-class addresses only.
+        // Use the T-class addresses only.  A border router is in a different area and
+        // does not take part in the flooding of this area's control messages.
         //
-        qd_bitmask_set_bit(core->router_addr_T->rnodes, router_maskbit);
-        qd_bitmask_set_bit(core->routerma_addr_T->rnodes, router_maskbit);
-
-        //
-        // Bump the ref-count by three for each of the above links.
-        //
-        rnode->ref_count += 3;
+        if (!border) {
+            qd_bitmask_set_bit(core->router_addr_T->rnodes, router_maskbit);
+            qd_bitmask_set_bit(core->routerma_addr_T->rnodes, router_maskbit);
+            rnode->ref_count += 2;
+        }
 
         //
         // Add the router record to the mask-bit index.
@@ -357,9 +404,12 @@ static void qdr_del_router_CT(qdr_core_t *core, qdr_action_t *action, bool disca
     // Unlink the router node from the address record
     //
     qd_bitmask_clear_bit(oaddr->rnodes, router_maskbit);
-    qd_bitmask_clear_bit(core->router_addr_T->rnodes, router_maskbit);
-    qd_bitmask_clear_bit(core->routerma_addr_T->rnodes, router_maskbit);
-    rnode->ref_count -= 3;
+    rnode->ref_count--;
+    if (!rnode->border) {
+        qd_bitmask_clear_bit(core->router_addr_T->rnodes, router_maskbit);
+        qd_bitmask_clear_bit(core->routerma_addr_T->rnodes, router_maskbit);
+        rnode->ref_count -= 2;
+    }
 
     //
     // While the router node has a non-zero reference count, look for addresses
@@ -376,6 +426,17 @@ static void qdr_del_router_CT(qdr_core_t *core, qdr_action_t *action, bool disca
     }
     assert(rnode->ref_count == 0);
 
+    //
+    // Remove the router from the equal-cost next hops of the other routers so that its
+    // mask bit is not followed if it is reused before their routes are recomputed.
+    //
+    qdr_node_t *other = DEQ_HEAD(core->routers);
+    while (other) {
+        if (other->next_hops)
+            qd_bitmask_clear_bit(other->next_hops, router_maskbit);
+        other = DEQ_NEXT(other);
+    }
+
     //
     // Free the router node and the owning address records.
     //
@@ -394,7 +455,7 @@ static void qdr_set_link_CT(qdr_core_t *core, qdr_action_t *action, bool discard
         return;
     }
 
-    if (link_maskbit >= qd_bitmask_width() || link_maskbit < 0) {
+    if (link_maskbit >= QDR_MAX_INTER_ROUTER_CONNECTIONS || link_maskbit < 0) {
         qd_log(core->log, QD_LOG_CRITICAL, "set_link: Link maskbit out of range: %d", link_maskbit);
         return;
     }
@@ -436,11 +497,8 @@ static void qdr_remove_link_CT(qdr_core_t *core, qdr_action_t *action, bool disc
 }
 
 
-static void qdr_set_next_hop_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
+static void qdr_route_table_set_next_hop_CT(qdr_core_t *core, int router_maskbit, int nh_router_maskbit)
 {
-    int router_maskbit    = action->args.route_table.router_maskbit;
-    int nh_router_maskbit = action->args.route_table.nh_router_maskbit;
-
     if (router_maskbit >= qd_bitmask_width() || router_maskbit < 0) {
         qd_log(core->log, QD_LOG_CRITICAL, "set_next_hop: Router maskbit out of range: %d", router_maskbit);
         return;
@@ -468,6 +526,15 @@ static void qdr_set_next_hop_CT(qdr_core_t *core, qdr_action_t *action, bool dis
 }
 
 
+static void qdr_set_next_hop_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
+{
+    int router_maskbit    = action->args.route_table.router_maskbit;
+    int nh_router_maskbit = action->args.route_table.nh_router_maskbit;
+
+    qdr_route_table_set_next_hop_CT(core, router_maskbit, nh_router_maskbit);
+}
+
+
 static void qdr_remove_next_hop_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
 {
     int router_maskbit = action->args.route_table.router_maskbit;
@@ -479,14 +546,15 @@ static void qdr_remove_next_hop_CT(qdr_core_t *core, qdr_action_t *action, bool
 
     qdr_node_t *rnode = core->routers_by_mask_bit[router_maskbit];
     rnode->next_hop = 0;
+    if (rnode->next_hops) {
+        qd_bitmask_free(rnode->next_hops);
+        rnode->next_hops = 0;
+    }
 }
 
 
-static void qdr_set_cost_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
+static void qdr_route_table_set_cost_CT(qdr_core_t *core, int router_maskbit, int cost)
 {
-    int router_maskbit = action->args.route_table.router_maskbit;
-    int cost           = action->args.route_table.cost;
-
     if (router_maskbit >= qd_bitmask_width() || router_maskbit < 0) {
         qd_log(core->log, QD_LOG_CRITICAL, "set_cost: Router maskbit out of range: %d", router_maskbit);
         return;
@@ -503,16 +571,21 @@ static void qdr_set_cost_CT(qdr_core_t *core, qdr_action_t *action, bool discard
 }
 
 
-static void qdr_set_valid_origins_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
+static void qdr_set_cost_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
 {
-    int           router_maskbit = action->args.route_table.router_maskbit;
-    qd_bitmask_t *valid_origins  = action->args.route_table.router_set;
+    int router_maskbit = action->args.route_table.router_maskbit;
+    int cost           = action->args.route_table.cost;
 
-    if (discard) {
-        qd_bitmask_free(valid_origins);
-        return;
-    }
+    qdr_route_table_set_cost_CT(core, router_maskbit, cost);
+}
 
+
+//
+// Install a new valid-origins bitmask for a router.  Ownership of the bitmask passes to
+// this function.
+//
+static void qdr_route_table_set_valid_origins_CT(qdr_core_t *core, int router_maskbit, qd_bitmask_t *valid_origins)
+{
     do {
         if (router_maskbit >= qd_bitmask_width() || router_maskbit < 0) {
             qd_log(core->log, QD_LOG_CRITICAL, "set_valid_origins: Router maskbit out of range: %d", router_maskbit);
@@ -536,6 +609,117 @@ static void qdr_set_valid_origins_CT(qdr_core_t *core, qdr_action_t *action, boo
 }
 
 
+//
+// Install new equal-cost next hops and ECMP origins for a router.  Either bitmask may be
+// null to leave the current one in place.  Ownership of the bitmasks passes to this function.
+//
+static void qdr_route_table_set_ecmp_CT(qdr_core_t *core, int router_maskbit, qd_bitmask_t *next_hops, qd_bitmask_t *ecmp_origins)
+{
+    do {
+        if (router_maskbit >= qd_bitmask_width() || router_maskbit < 0) {
+            qd_log(core->log, QD_LOG_CRITICAL, "set_ecmp: Router maskbit out of range: %d", router_maskbit);
+            break;
+        }
+
+        if (core->routers_by_mask_bit[router_maskbit] == 0) {
+            qd_log(core->log, QD_LOG_CRITICAL, "set_ecmp: Router not found");
+            break;
+        }
+
+        qdr_node_t *rnode = core->routers_by_mask_bit[router_maskbit];
+
+        //
+        // Empty (or single next hop) sets are not kept so that the forwarder only has to
+        // check for a null pointer on the common single-path route.
+        //
+        if (next_hops) {
+            qd_bitmask_free(rnode->next_hops);
+            rnode->next_hops = 0;
+            if (qd_bitmask_cardinality(next_hops) > 1) {
+                rnode->next_hops = next_hops;
+                next_hops = 0;
+            }
+        }
+
+        if (ecmp_origins) {
+            qd_bitmask_free(rnode->ecmp_origins);
+            rnode->ecmp_origins = 0;
+            if (qd_bitmask_cardinality(ecmp_origins) > 0) {
+                rnode->ecmp_origins = ecmp_origins;
+                ecmp_origins = 0;
+            }
+        }
+    } while (false);
+
+    if (next_hops)
+        qd_bitmask_free(next_hops);
+    if (ecmp_origins)
+        qd_bitmask_free(ecmp_origins);
+}
+
+
+static void qdr_set_valid_origins_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
+{
+    int           router_maskbit = action->args.route_table.router_maskbit;
+    qd_bitmask_t *valid_origins  = action->args.route_table.router_set;
+
+    if (discard) {
+        qd_bitmask_free(valid_origins);
+        return;
+    }
+
+    qdr_route_table_set_valid_origins_CT(core, router_maskbit, valid_origins);
+}
+
+
+static void qdr_set_routes_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
+{
+    qdr_route_update_t *updates = action->args.route_table.updates;
+    int                 count   = action->args.route_table.update_count;
+
+    for (int idx = 0; idx < count; idx++) {
+        qdr_route_update_t *update = &updates[idx];
+
+        if (discard) {
+            if (update->valid_origins)
+                qd_bitmask_free(update->valid_origins);
+            if (update->next_hops)
+                qd_bitmask_free(update->next_hops);
+            if (update->ecmp_origins)
+                qd_bitmask_free(update->ecmp_origins);
+            continue;
+        }
+
+        if (update->nh_router_maskbit >= 0)
+            qdr_route_table_set_next_hop_CT(core, update->router_maskbit, update->nh_router_maskbit);
+        if (update->valid_origins)
+            qdr_route_table_set_valid_origins_CT(core, update->router_maskbit, update->valid_origins);
+        if (update->next_hops || update->ecmp_origins)
+            qdr_route_table_set_ecmp_CT(core, update->router_maskbit, update->next_hops, update->ecmp_origins);
+        if (update->cost > 0)
+            qdr_route_table_set_cost_CT(core, update->router_maskbit, update->cost);
+    }
+
+    free(updates);
+}
+
+
+static void qdr_set_recomputes_avoided_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
+{
+    if (!discard)
+        core->spf_recomputes_avoided = action->args.route_table.counter;
+}
+
+
+static void qdr_set_request_counters_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
+{
+    if (!discard) {
+        core->control_requests_queued = action->args.route_table.counter;
+        core->control_requests_sent   = action->args.route_table.sent_counter;
+    }
+}
+
+
 static void qdr_map_destination_CT(qdr_core_t *core, qdr_action_t *action, bool discard)
 {
     int          router_maskbit = action->args.route_table.router_maskbit;
@@ -682,27 +866,80 @@ static void qdr_unsubscribe_CT(qdr_core_t *core, qdr_action_t *action, bool disc
 // Call-back Functions
 //==================================================================================
 
-static void qdr_do_mobile_added(qdr_core_t *core, qdr_general_work_t *work)
+static void qdr_notify_mobile_run(qdr_core_t *core, bool added, const char **hashes, int count)
 {
-    char *address_hash = qdr_field_copy(work->field);
-    if (address_hash) {
-        core->rt_mobile_added(core->rt_context, address_hash);
-        free(address_hash);
-    }
+    if (count == 0)
+        return;
 
-    qdr_field_free(work->field);
+    if (added)
+        core->rt_mobile_added(core->rt_context, hashes, count);
+    else
+        core->rt_mobile_removed(core->rt_context, hashes, count);
+
+    for (int i = 0; i < count; i++)
+        free((char*) hashes[i]);
 }
 
 
-static void qdr_do_mobile_removed(qdr_core_t *core, qdr_general_work_t *work)
+static void qdr_do_mobile_events(qdr_core_t *core, qdr_general_work_t *work)
 {
-    char *address_hash = qdr_field_copy(work->field);
-    if (address_hash) {
-        core->rt_mobile_removed(core->rt_context, address_hash);
-        free(address_hash);
+    qdr_address_event_list_t  events;
+    qdr_address_event_t      *event;
+
+    //
+    // Take every event queued so far.  Events queued after this point will post
+    // a new work item.
+    //
+    sys_mutex_lock(core->work_lock);
+    DEQ_MOVE(core->address_events, events);
+    sys_mutex_unlock(core->work_lock);
+
+    const char **hashes = (const char**) malloc(DEQ_SIZE(events) * sizeof(char*));
+    int          count  = 0;
+    bool         added  = true;
+
+    //
+    // Deliver each run of consecutive additions or removals in a single call.
+    //
+    event = DEQ_HEAD(events);
+    while (event) {
+        DEQ_REMOVE_HEAD(events);
+        if (event->added != added) {
+            qdr_notify_mobile_run(core, added, hashes, count);
+            count = 0;
+            added = event->added;
+        }
+
+        char *address_hash = qdr_field_copy(event->field);
+        if (address_hash)
+            hashes[count++] = address_hash;
+
+        qdr_field_free(event->field);
+        free_qdr_address_event_t(event);
+        event = DEQ_HEAD(events);
     }
 
-    qdr_field_free(work->field);
+    qdr_notify_mobile_run(core, added, hashes, count);
+    free(hashes);
+}
+
+
+static void qdr_post_mobile_event_CT(qdr_core_t *core, const char *address_hash, bool added)
+{
+    qdr_address_event_t *event = new_qdr_address_event_t();
+    bool                 post;
+
+    ZERO(event);
+    event->field = qdr_field(address_hash);
+    event->added = added;
+
+    sys_mutex_lock(core->work_lock);
+    post = DEQ_IS_EMPTY(core->address_events);
+    DEQ_INSERT_TAIL(core->address_events, event);
+    sys_mutex_unlock(core->work_lock);
+
+    if (post)
+        qdr_post_general_work_CT(core, qdr_general_work(qdr_do_mobile_events));
 }
 
 
@@ -714,17 +951,13 @@ static void qdr_do_link_lost(qdr_core_t *core, qdr_general_work_t *work)
 
 void qdr_post_mobile_added_CT(qdr_core_t *core, const char *address_hash)
 {
-    qdr_general_work_t *work = qdr_general_work(qdr_do_mobile_added);
-    work->field = qdr_field(address_hash);
-    qdr_post_general_work_CT(core, work);
+    qdr_post_mobile_event_CT(core, address_hash, true);
 }
 
 
 void qdr_post_mobile_removed_CT(qdr_core_t *core, const char *address_hash)
 {
-    qdr_general_work_t *work = qdr_general_work(qdr_do_mobile_removed);
-    work->field = qdr_field(address_hash);
-    qdr_post_general_work_CT(core, work);
+    qdr_post_mobile_event_CT(core, address_hash, false);
 }
 
 
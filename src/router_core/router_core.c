@@ -29,6 +29,7 @@ ALLOC_DEFINE(qdr_link_t);
 ALLOC_DEFINE(qdr_router_ref_t);
 ALLOC_DEFINE(qdr_link_ref_t);
 ALLOC_DEFINE(qdr_general_work_t);
+ALLOC_DEFINE(qdr_address_event_t);
 ALLOC_DEFINE(qdr_connection_ref_t);
 
 static void qdr_general_handler(void *context);
@@ -59,6 +60,7 @@ qdr_core_t *qdr_core(qd_dispatch_t *qd, qd_router_mode_t mode, const char *area,
 
     core->work_lock = sys_mutex();
     DEQ_INIT(core->work_list);
+    DEQ_INIT(core->address_events);
     core->work_timer = qd_timer(core->qd, qdr_general_handler, core);
 
     //
@@ -104,6 +106,14 @@ void qdr_core_free(qdr_core_t *core)
     sys_mutex_free(core->work_lock);
     sys_mutex_free(core->id_lock);
     qd_timer_free(core->work_timer);
+
+    qdr_address_event_t *event = 0;
+    while ( (event = DEQ_HEAD(core->address_events)) ) {
+        DEQ_REMOVE_HEAD(core->address_events);
+        qdr_field_free(event->field);
+        free_qdr_address_event_t(event);
+    }
+
     //we can't call qdr_core_unsubscribe on the subscriptions because the action processing thread has
     //already been shut down. But, all the action would have done at this point is free the subscriptions
     //so we just do that directly.
@@ -146,6 +156,8 @@ void qdr_core_free(qdr_core_t *core)
 void qdr_router_node_free(qdr_core_t *core, qdr_node_t *rnode)
 {
     qd_bitmask_free(rnode->valid_origins);
+    qd_bitmask_free(rnode->next_hops);
+    qd_bitmask_free(rnode->ecmp_origins);
     DEQ_REMOVE(core->routers, rnode);
     core->routers_by_mask_bit[rnode->mask_bit] = 0;
     core->cost_epoch++;
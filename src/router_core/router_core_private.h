@@ -26,6 +26,14 @@
 #include <qpid/dispatch/log.h>
 #include <memory.h>
 
+//
+// Maximum number of inter-router connections on one router.  Inter-router connections are
+// assigned mask bits from this smaller space rather than from the router mask-bit space, so
+// that per-address state indexed by connection (such as the outstanding delivery counts of
+// balanced addresses) does not grow with the maximum router count.
+//
+#define QDR_MAX_INTER_ROUTER_CONNECTIONS 128
+
 typedef struct qdr_address_t         qdr_address_t;
 typedef struct qdr_address_config_t  qdr_address_config_t;
 typedef struct qdr_node_t            qdr_node_t;
@@ -81,12 +89,17 @@ struct qdr_action_t {
         // Arguments for router control-plane actions
         //
         struct {
-            int           link_maskbit;
-            int           router_maskbit;
-            int           nh_router_maskbit;
-            int           cost;
-            qd_bitmask_t *router_set;
-            qdr_field_t  *address;
+            int                 link_maskbit;
+            int                 router_maskbit;
+            int                 nh_router_maskbit;
+            int                 cost;
+            qd_bitmask_t       *router_set;
+            qdr_field_t        *address;
+            qdr_route_update_t *updates;
+            int                 update_count;
+            uint64_t            counter;
+            uint64_t            sent_counter;
+            bool                border;
         } route_table;
 
         //
@@ -154,6 +167,32 @@ DEQ_DECLARE(qdr_action_t, qdr_action_list_t);
 #define QDR_AGENT_MAX_COLUMNS 64
 #define QDR_AGENT_COLUMN_NULL (QDR_AGENT_MAX_COLUMNS + 1)
 
+typedef enum {
+    QDR_FILTER_EQ,
+    QDR_FILTER_NE,
+    QDR_FILTER_LT,
+    QDR_FILTER_LE,
+    QDR_FILTER_GT,
+    QDR_FILTER_GE,
+    QDR_FILTER_PREFIX
+} qdr_filter_op_t;
+
+/**
+ * One condition of a query filter, e.g. "undeliveredCount>0"
+ */
+typedef struct qdr_filter_term_t qdr_filter_term_t;
+struct qdr_filter_term_t {
+    DEQ_LINKS(qdr_filter_term_t);
+    int              column;
+    qdr_filter_op_t  op;
+    char            *text;       ///< The value as written in the filter
+    bool             is_number;
+    double           number;     ///< The value as a number, if is_number
+};
+
+ALLOC_DECLARE(qdr_filter_term_t);
+DEQ_DECLARE(qdr_filter_term_t, qdr_filter_term_list_t);
+
 struct qdr_query_t {
     DEQ_LINKS(qdr_query_t);
     qdr_core_t              *core;
@@ -165,6 +204,8 @@ struct qdr_query_t {
     int                      next_offset;
     bool                     more;
     qd_amqp_error_t          status;
+    qdr_filter_term_list_t   filter;         ///< All terms must match for an entity to be returned
+    bool                     filter_failed;  ///< The filter could not be used, status holds the error
 };
 
 DEQ_DECLARE(qdr_query_t, qdr_query_list_t); 
@@ -178,7 +219,11 @@ struct qdr_node_t {
     int               link_mask_bit;      ///< Mask bit of inter-router connection if this is a neighbor node
     uint32_t          ref_count;
     qd_bitmask_t     *valid_origins;
+    qd_bitmask_t     *next_hops;          ///< Equal-cost next hop nodes, null unless there are two or more
+    qd_bitmask_t     *ecmp_origins;       ///< Additional origins reaching this node over equal-cost paths
+    int               next_hop_index;     ///< Rotates closest traffic across the equal-cost next hops
     int               cost;
+    bool              border;             ///< True if this node is a neighbor in a different area
 };
 
 ALLOC_DECLARE(qdr_node_t);
@@ -411,6 +456,24 @@ DEQ_DECLARE(qdr_general_work_t, qdr_general_work_list_t);
 
 qdr_general_work_t *qdr_general_work(qdr_general_work_handler_t handler);
 
+//
+// Mobile Address Events
+//
+// Mobile address additions and removals are queued on the core and delivered to the
+// route-table handlers in batches, in the order they occurred.  Only one general-work
+// item is outstanding for the queue at any time.
+//
+typedef struct qdr_address_event_t qdr_address_event_t;
+
+struct qdr_address_event_t {
+    DEQ_LINKS(qdr_address_event_t);
+    qdr_field_t *field;
+    bool         added;
+};
+
+ALLOC_DECLARE(qdr_address_event_t);
+DEQ_DECLARE(qdr_address_event_t, qdr_address_event_list_t);
+
 //
 // Connection Work
 //
@@ -530,9 +593,10 @@ struct qdr_core_t {
     sys_cond_t        *action_cond;
     sys_mutex_t       *action_lock;
 
-    sys_mutex_t             *work_lock;
-    qdr_general_work_list_t  work_list;
-    qd_timer_t              *work_timer;
+    sys_mutex_t              *work_lock;
+    qdr_general_work_list_t   work_list;
+    qd_timer_t               *work_timer;
+    qdr_address_event_list_t  address_events;
 
     qdr_connection_list_t open_connections;
     qdr_connection_list_t connections_to_activate;
@@ -594,6 +658,9 @@ struct qdr_core_t {
     qdr_link_t          **control_links_by_mask_bit;
     qdr_link_t          **data_links_by_mask_bit;
     uint64_t              cost_epoch;
+    uint64_t              spf_recomputes_avoided;
+    uint64_t              control_requests_queued;
+    uint64_t              control_requests_sent;
 
     uint64_t              next_tag;
 
@@ -619,6 +686,17 @@ void qdr_delivery_failed_CT(qdr_core_t *core, qdr_delivery_t *delivery);
 bool qdr_delivery_settled_CT(qdr_core_t *core, qdr_delivery_t *delivery);
 void qdr_agent_enqueue_response_CT(qdr_core_t *core, qdr_query_t *query);
 
+/**
+ * Write the value of column col of an entity object into body.
+ */
+typedef void (*qdr_agent_write_column_t) (qdr_core_t *core, void *object, qd_composed_field_t *body, int col);
+
+/**
+ * Return true if the entity object passes the filter of the query.  The column values
+ * the filter refers to are obtained from write_column.
+ */
+bool qdr_agent_filter_match_CT(qdr_core_t *core, qdr_query_t *query, qdr_agent_write_column_t write_column, void *object);
+
 void qdr_post_mobile_added_CT(qdr_core_t *core, const char *address_hash);
 void qdr_post_mobile_removed_CT(qdr_core_t *core, const char *address_hash);
 void qdr_post_link_lost_CT(qdr_core_t *core, int link_maskbit);
@@ -638,10 +638,9 @@ static void qd_router_timer_handler(void *context)
     qd_router_t *router = (qd_router_t*) context;
 
     //
-    // Periodic processing.
+    // Periodic processing.  The tick reschedules the timer.
     //
     qd_pyrouter_tick(router);
-    qd_timer_schedule(router->timer, 1000);
 }
 
 
@@ -969,7 +968,7 @@ void qd_router_setup_late(qd_dispatch_t *qd)
                             CORE_delivery_update);
 
     qd_router_python_setup(qd->router);
-    qd_timer_schedule(qd->router->timer, 1000);
+    qd_timer_schedule(qd->router->timer, QD_ROUTER_TICK_MSEC);
 }
 
 void qd_router_free(qd_router_t *router)
@@ -37,6 +37,15 @@
 
 qd_error_t qd_router_python_setup(qd_router_t *router);
 void qd_router_python_free(qd_router_t *router);
+/**
+ * Default interval between router ticks.  When the Python router is running it
+ * returns the delay to the next tick it needs from each tick.
+ */
+#define QD_ROUTER_TICK_MSEC 1000
+
+/**
+ * Run one tick of the Python router and reschedule the router timer.
+ */
 qd_error_t qd_pyrouter_tick(qd_router_t *router);
 qd_error_t qd_router_configure_fixed_address(qd_router_t *router, qd_entity_t *entity);
 qd_error_t qd_router_configure_waypoint(qd_router_t *router, qd_entity_t *entity);
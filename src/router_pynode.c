@@ -58,6 +58,24 @@ static PyObject *qd_add_router(PyObject *self, PyObject *args)
 }
 
 
+static PyObject *qd_add_border_router(PyObject *self, PyObject *args)
+{
+    RouterAdapter *adapter = (RouterAdapter*) self;
+    qd_router_t   *router  = adapter->router;
+    const char    *address;
+    int            router_maskbit;
+
+    if (!PyArg_ParseTuple(args, "si", &address, &router_maskbit))
+        return 0;
+
+    qdr_core_add_border_router(router->router_core, address, router_maskbit);
+    qd_tracemask_add_router(router->tracemask, address, router_maskbit);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+
 static PyObject* qd_del_router(PyObject *self, PyObject *args)
 {
     RouterAdapter *adapter = (RouterAdapter*) self;
@@ -160,13 +178,76 @@ static PyObject* qd_set_cost(PyObject *self, PyObject *args)
 }
 
 
+//
+// Convert a Python list of origin router mask bits into a core bitmask.  The local
+// router (mask bit zero) is always included.  Returns an error string on failure.
+//
+static char *qd_origin_list_to_bitmask(PyObject *origin_list, qd_bitmask_t **bitmask)
+{
+    Py_ssize_t idx;
+    int        maskbit;
+
+    if (!PyList_Check(origin_list))
+        return "Expected List of valid origins";
+
+    Py_ssize_t origin_count = PyList_Size(origin_list);
+
+    for (idx = 0; idx < origin_count; idx++) {
+        maskbit = PyInt_AS_LONG(PyList_GetItem(origin_list, idx));
+        if (maskbit >= qd_bitmask_width() || maskbit < 0)
+            return "Origin bit mask out of range";
+    }
+
+    qd_bitmask_t *core_bitmask = qd_bitmask(0);
+    qd_bitmask_set_bit(core_bitmask, 0);  // This router is a valid origin for all destinations
+    for (idx = 0; idx < origin_count; idx++) {
+        maskbit = PyInt_AS_LONG(PyList_GetItem(origin_list, idx));
+        qd_bitmask_set_bit(core_bitmask, maskbit);
+    }
+
+    *bitmask = core_bitmask;
+    return 0;
+}
+
+
+//
+// Convert a list of router mask bits into a bitmask.  Unlike a list of valid origins,
+// this router's own bit is not added.
+//
+static char *qd_maskbit_list_to_bitmask(PyObject *maskbit_list, qd_bitmask_t **bitmask)
+{
+    Py_ssize_t idx;
+    int        maskbit;
+
+    if (!PyList_Check(maskbit_list))
+        return "Expected List of router mask bits";
+
+    Py_ssize_t maskbit_count = PyList_Size(maskbit_list);
+
+    for (idx = 0; idx < maskbit_count; idx++) {
+        maskbit = PyInt_AS_LONG(PyList_GetItem(maskbit_list, idx));
+        if (maskbit >= qd_bitmask_width() || maskbit < 0)
+            return "Router bit mask out of range";
+    }
+
+    qd_bitmask_t *core_bitmask = qd_bitmask(0);
+    for (idx = 0; idx < maskbit_count; idx++) {
+        maskbit = PyInt_AS_LONG(PyList_GetItem(maskbit_list, idx));
+        qd_bitmask_set_bit(core_bitmask, maskbit);
+    }
+
+    *bitmask = core_bitmask;
+    return 0;
+}
+
+
 static PyObject* qd_set_valid_origins(PyObject *self, PyObject *args)
 {
     RouterAdapter *adapter = (RouterAdapter*) self;
     qd_router_t   *router  = adapter->router;
     int            router_maskbit;
     PyObject      *origin_list;
-    Py_ssize_t     idx;
+    qd_bitmask_t  *core_bitmask = 0;
     char          *error = 0;
 
     if (!PyArg_ParseTuple(args, "iO", &router_maskbit, &origin_list))
@@ -178,42 +259,147 @@ static PyObject* qd_set_valid_origins(PyObject *self, PyObject *args)
             break;
         }
 
-        if (!PyList_Check(origin_list)) {
-            error = "Expected List as argument 2";
+        error = qd_origin_list_to_bitmask(origin_list, &core_bitmask);
+        if (error)
+            break;
+
+        qdr_core_set_valid_origins(router->router_core, router_maskbit, core_bitmask);
+    } while (0);
+
+    if (error) {
+        PyErr_SetString(PyExc_Exception, error);
+        return 0;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+
+//
+// Apply a list of route changes as a single core action.  Each item of the list is a tuple
+// (router_maskbit, next_hop_maskbit, cost, valid_origins, next_hops, ecmp_origins) where
+// next_hop_maskbit is -1, cost is 0 and the lists are None for values that did not change.
+// next_hops and ecmp_origins are lists of router mask bits for the equal-cost paths.
+//
+static PyObject* qd_set_routes(PyObject *self, PyObject *args)
+{
+    RouterAdapter      *adapter = (RouterAdapter*) self;
+    qd_router_t        *router  = adapter->router;
+    PyObject           *route_list;
+    qdr_route_update_t *updates = 0;
+    Py_ssize_t          count   = 0;
+    Py_ssize_t          idx;
+    char               *error = 0;
+
+    if (!PyArg_ParseTuple(args, "O", &route_list))
+        return 0;
+
+    do {
+        if (!PyList_Check(route_list)) {
+            error = "Expected List as argument 1";
             break;
         }
 
-        Py_ssize_t    origin_count = PyList_Size(origin_list);
-        qd_bitmask_t *core_bitmask = qd_bitmask(0);
-        int           maskbit;
+        Py_ssize_t route_count = PyList_Size(route_list);
+        if (route_count == 0)
+            break;
 
-        for (idx = 0; idx < origin_count; idx++) {
-            maskbit = PyInt_AS_LONG(PyList_GetItem(origin_list, idx));
-            if (maskbit >= qd_bitmask_width() || maskbit < 0) {
-                error = "Origin bit mask out of range";
+        updates = NEW_ARRAY(qdr_route_update_t, route_count);
+
+        for (idx = 0; idx < route_count; idx++) {
+            qdr_route_update_t *update = &updates[idx];
+            PyObject           *origin_list;
+            PyObject           *next_hop_list;
+            PyObject           *ecmp_origin_list;
+
+            update->valid_origins = 0;
+            update->next_hops     = 0;
+            update->ecmp_origins  = 0;
+            if (!PyArg_ParseTuple(PyList_GetItem(route_list, idx), "iiiOOO",
+                                  &update->router_maskbit, &update->nh_router_maskbit,
+                                  &update->cost, &origin_list, &next_hop_list, &ecmp_origin_list)) {
+                error = "Expected (router, next-hop, cost, valid-origins, next-hops, ecmp-origins) tuple";
                 break;
             }
-        }
 
-        if (error == 0) {
-            qd_bitmask_set_bit(core_bitmask, 0);  // This router is a valid origin for all destinations
-            for (idx = 0; idx < origin_count; idx++) {
-                maskbit = PyInt_AS_LONG(PyList_GetItem(origin_list, idx));
-                qd_bitmask_set_bit(core_bitmask, maskbit);
+            if (update->router_maskbit >= qd_bitmask_width() || update->router_maskbit < 0) {
+                error = "Router bit mask out of range";
+                break;
             }
-        } else {
-            qd_bitmask_free(core_bitmask);
-            break;
-        }
 
-        qdr_core_set_valid_origins(router->router_core, router_maskbit, core_bitmask);
+            if (update->nh_router_maskbit >= qd_bitmask_width()) {
+                error = "Next hop bit mask out of range";
+                break;
+            }
+
+            count++;
+            if (origin_list != Py_None) {
+                error = qd_origin_list_to_bitmask(origin_list, &update->valid_origins);
+                if (error)
+                    break;
+            }
+            if (next_hop_list != Py_None) {
+                error = qd_maskbit_list_to_bitmask(next_hop_list, &update->next_hops);
+                if (error)
+                    break;
+            }
+            if (ecmp_origin_list != Py_None) {
+                error = qd_maskbit_list_to_bitmask(ecmp_origin_list, &update->ecmp_origins);
+                if (error)
+                    break;
+            }
+        }
     } while (0);
 
     if (error) {
+        PyErr_Clear();
+        for (idx = 0; idx < count; idx++) {
+            qd_bitmask_free(updates[idx].valid_origins);
+            qd_bitmask_free(updates[idx].next_hops);
+            qd_bitmask_free(updates[idx].ecmp_origins);
+        }
+        free(updates);
         PyErr_SetString(PyExc_Exception, error);
         return 0;
     }
 
+    if (updates)
+        qdr_core_set_routes(router->router_core, updates, (int) count);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+
+static PyObject* qd_set_recomputes_avoided(PyObject *self, PyObject *args)
+{
+    RouterAdapter      *adapter = (RouterAdapter*) self;
+    qd_router_t        *router  = adapter->router;
+    unsigned long long  count;
+
+    if (!PyArg_ParseTuple(args, "K", &count))
+        return 0;
+
+    qdr_core_set_recomputes_avoided(router->router_core, (uint64_t) count);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+
+static PyObject* qd_set_request_counters(PyObject *self, PyObject *args)
+{
+    RouterAdapter      *adapter = (RouterAdapter*) self;
+    qd_router_t        *router  = adapter->router;
+    unsigned long long  queued;
+    unsigned long long  sent;
+
+    if (!PyArg_ParseTuple(args, "KK", &queued, &sent))
+        return 0;
+
+    qdr_core_set_request_counters(router->router_core, (uint64_t) queued, (uint64_t) sent);
+
     Py_INCREF(Py_None);
     return Py_None;
 }
@@ -262,6 +448,29 @@ static PyObject* qd_unmap_destination(PyObject *self, PyObject *args)
     return Py_None;
 }
 
+static PyObject* qd_schedule_tick(PyObject *self, PyObject *args)
+{
+    RouterAdapter *adapter = (RouterAdapter*) self;
+    qd_router_t   *router  = adapter->router;
+    int            delay;
+
+    if (!PyArg_ParseTuple(args, "i", &delay))
+        return 0;
+
+    if (delay < 0)
+        delay = 0;
+
+    //
+    // The caller holds the Python lock, which orders this with the rescheduling
+    // done at the end of qd_pyrouter_tick.
+    //
+    qd_timer_schedule(router->timer, delay);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+
 static PyObject* qd_get_agent(PyObject *self, PyObject *args) {
     RouterAdapter *adapter = (RouterAdapter*) self;
     PyObject *agent = adapter->router->qd->agent;
@@ -274,6 +483,7 @@ static PyObject* qd_get_agent(PyObject *self, PyObject *args) {
 
 static PyMethodDef RouterAdapter_methods[] = {
     {"add_router",          qd_add_router,        METH_VARARGS, "A new remote/reachable router has been discovered"},
+    {"add_border_router",   qd_add_border_router, METH_VARARGS, "A neighbor router in a different area has been discovered"},
     {"del_router",          qd_del_router,        METH_VARARGS, "We've lost reachability to a remote router"},
     {"set_link",            qd_set_link,          METH_VARARGS, "Set the link for a neighbor router"},
     {"remove_link",         qd_remove_link,       METH_VARARGS, "Remove the link for a neighbor router"},
@@ -281,8 +491,12 @@ static PyMethodDef RouterAdapter_methods[] = {
     {"remove_next_hop",     qd_remove_next_hop,   METH_VARARGS, "Remove the next hop for a remote router"},
     {"set_cost",            qd_set_cost,          METH_VARARGS, "Set the cost to reach a remote router"},
     {"set_valid_origins",   qd_set_valid_origins, METH_VARARGS, "Set the valid origins for a remote router"},
+    {"set_routes",          qd_set_routes,        METH_VARARGS, "Apply a list of next-hop, cost and valid-origin changes"},
+    {"set_recomputes_avoided", qd_set_recomputes_avoided, METH_VARARGS, "Report the number of route computations avoided by hold-down"},
+    {"set_request_counters", qd_set_request_counters, METH_VARARGS, "Report the number of queued and sent control requests"},
     {"map_destination",     qd_map_destination,   METH_VARARGS, "Add a newly discovered destination mapping"},
     {"unmap_destination",   qd_unmap_destination, METH_VARARGS, "Delete a destination mapping"},
+    {"schedule_tick",       qd_schedule_tick,     METH_VARARGS, "Run the next router tick after the given number of milliseconds"},
     {"get_agent",           qd_get_agent,         METH_VARARGS, "Get the management agent"},
     {0, 0, 0, 0}
 };
@@ -339,7 +553,16 @@ static PyTypeObject RouterAdapterType = {
 };
 
 
-static void qd_router_mobile_added(void *context, const char *address_hash)
+static PyObject *qd_address_hash_list(const char **address_hashes, int count)
+{
+    PyObject *pList = PyList_New(count);
+    for (int i = 0; i < count; i++)
+        PyList_SetItem(pList, i, PyString_FromString(address_hashes[i]));
+    return pList;
+}
+
+
+static void qd_router_mobile_added(void *context, const char **address_hashes, int count)
 {
     qd_router_t *router = (qd_router_t*) context;
     PyObject    *pArgs;
@@ -348,7 +571,7 @@ static void qd_router_mobile_added(void *context, const char *address_hash)
     if (pyAdded && router->router_mode == QD_ROUTER_MODE_INTERIOR) {
         qd_python_lock_state_t lock_state = qd_python_lock();
         pArgs = PyTuple_New(1);
-        PyTuple_SetItem(pArgs, 0, PyString_FromString(address_hash));
+        PyTuple_SetItem(pArgs, 0, qd_address_hash_list(address_hashes, count));
         pValue = PyObject_CallObject(pyAdded, pArgs);
         qd_error_py();
         Py_DECREF(pArgs);
@@ -358,7 +581,7 @@ static void qd_router_mobile_added(void *context, const char *address_hash)
 }
 
 
-static void qd_router_mobile_removed(void *context, const char *address_hash)
+static void qd_router_mobile_removed(void *context, const char **address_hashes, int count)
 {
     qd_router_t *router = (qd_router_t*) context;
     PyObject    *pArgs;
@@ -367,7 +590,7 @@ static void qd_router_mobile_removed(void *context, const char *address_hash)
     if (pyRemoved && router->router_mode == QD_ROUTER_MODE_INTERIOR) {
         qd_python_lock_state_t lock_state = qd_python_lock();
         pArgs = PyTuple_New(1);
-        PyTuple_SetItem(pArgs, 0, PyString_FromString(address_hash));
+        PyTuple_SetItem(pArgs, 0, qd_address_hash_list(address_hashes, count));
         pValue = PyObject_CallObject(pyRemoved, pArgs);
         qd_error_py();
         Py_DECREF(pArgs);
@@ -490,16 +713,29 @@ qd_error_t qd_pyrouter_tick(qd_router_t *router)
 
     PyObject *pArgs;
     PyObject *pValue;
+    long      delay = QD_ROUTER_TICK_MSEC;
 
     if (pyTick && router->router_mode == QD_ROUTER_MODE_INTERIOR) {
         qd_python_lock_state_t lock_state = qd_python_lock();
         pArgs  = PyTuple_New(0);
         pValue = PyObject_CallObject(pyTick, pArgs);
         Py_DECREF(pArgs);
+        if (pValue && (PyInt_Check(pValue) || PyLong_Check(pValue))) {
+            delay = PyInt_AsLong(pValue);
+            if (delay < 0)
+                delay = 0;
+        }
         Py_XDECREF(pValue);
         err = qd_error_py();
+
+        //
+        // Reschedule while still holding the Python lock so that a tick requested
+        // through schedule_tick from another thread can't be overwritten.
+        //
+        qd_timer_schedule(router->timer, delay);
         qd_python_unlock(lock_state);
-    }
+    } else
+        qd_timer_schedule(router->timer, delay);
     return err;
 }
 
@@ -22,3 +22,4 @@
 from schema import *
 from qdrouter import *
 from entity import *
+from agent import *
@@ -0,0 +1,325 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License
+#
+
+#pylint: disable=wildcard-import,unused-wildcard-import,missing-docstring,too-many-public-methods
+
+import unittest
+import mock                     # Mock definitions for tests.
+from qpid_dispatch_internal.management.agent import Agent, QueryFilter, NotFoundStatus, BadRequestStatus
+from qpid_dispatch_internal.management.schema import ValidationError
+from qpid_dispatch_internal.router.message import Message
+
+
+class QuietLog(object):
+    def log(self, level, text, file=None, line=None):
+        pass
+
+    def enabled(self, level):
+        return False
+
+
+class FakeQd(object):
+    """
+    Stands in for the C library: entity cache events are queued in events, C
+    implementation objects are refreshed by calling them with the attribute map.
+    """
+    def __init__(self):
+        self.events = []
+        self.locked = False
+
+    def qd_dispatch_router_lock(self, dispatch):
+        self.locked = True
+
+    def qd_dispatch_router_unlock(self, dispatch):
+        self.locked = False
+
+    def qd_entity_refresh_begin(self, events):
+        events.extend(self.events)
+        self.events = []
+
+    def qd_entity_refresh_end(self):
+        pass
+
+    def function(self, name, restype, argtypes):
+        return lambda attributes, pointer: self.objects[pointer](attributes)
+
+
+class Refreshed(object):
+    """Python implementation object that counts its refreshes"""
+    def __init__(self, counts, node_id):
+        self.counts, self.id = counts, node_id
+
+    def refresh_entity(self, attributes):
+        self.counts[self.id] = self.counts.get(self.id, 0) + 1
+        attributes['id'] = self.id
+
+
+class AgentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.qd = FakeQd()
+        self.qd.objects = {}
+        self.agent = Agent(None, self.qd)
+        self.agent.log_adapter = QuietLog()
+        self.responses = []
+        self.agent.io = self
+        self.counts = {}
+        self.nodes = [Refreshed(self.counts, 'R%d' % i) for i in range(5)]
+        for node in self.nodes:
+            self.agent.add_implementation(node, 'router.node')
+
+    def send(self, message):
+        self.responses.append(message)
+
+    def request(self, body=None, **properties):
+        self.agent.receive(Message(reply_to='reply', correlation_id=1, properties=properties,
+                                   body=body or {}), 0, 0)
+        response = self.responses.pop()
+        self.description = response.properties.get('statusDescription')
+        return response.properties['statusCode'], response.body
+
+    def query(self, body=None, **properties):
+        return self.request(body, operation='QUERY', type='org.amqp.management', name='self',
+                            **properties)
+
+    def test_find_removed(self):
+        entity = self.agent.entities.find('name', 'router.node/R2')
+        identity = entity.attributes['identity']
+        self.assertIs(self.agent.entities.find('identity', identity), entity)
+        self.assertIn(entity, self.agent.find_entity_by_type('router.node'))
+
+        self.agent.remove_implementation(self.nodes[2])
+        self.assertIsNone(self.agent.entities.find('name', 'router.node/R2'))
+        self.assertIsNone(self.agent.entities.find('identity', identity))
+        self.assertNotIn(entity, self.agent.find_entity_by_type('router.node'))
+        self.assertNotIn(entity, self.agent.find_entity_by_type('entity'))
+        self.assertEqual([e.attributes['id'] for e in self.agent.find_entity_by_type('router.node')],
+                         ['R0', 'R1', 'R3', 'R4'])
+        for ids in [{'name': 'router.node/R2'}, {'identity': identity}]:
+            self.assertRaises(NotFoundStatus, self.agent.find_entity, Message(properties=ids))
+        status, body = self.request(operation='READ', identity=identity)
+        self.assertEqual(status, 404)
+
+        ##
+        ## The name is free to be used again
+        ##
+        self.agent.add_implementation(Refreshed(self.counts, 'R2'), 'router.node')
+        self.assertEqual(self.agent.entities.find('name', 'router.node/R2').attributes['id'], 'R2')
+
+    def add(self, **attributes):
+        entity = self.agent.create_entity(attributes)
+        self.agent.add_entity(entity)
+        return entity
+
+    def test_unique(self):
+        dummy = self.add(type='dummy', name='d1', arg1='a')
+        self.assertRaisesRegexp(ValidationError, "Duplicate value 'd1'", self.add, type='dummy', name='d1')
+        # Names are unique across all entity types.
+        self.assertRaisesRegexp(ValidationError, "Duplicate value 'd1'",
+                                self.add, type='listener', name='d1', port='5672')
+        duplicate = self.agent.create_entity({'type': 'dummy', 'name': 'd2'})
+        duplicate.attributes['identity'] = dummy.attributes['identity']
+        self.assertRaisesRegexp(ValidationError, "unique attribute 'identity'",
+                                self.agent.add_entity, duplicate)
+        # A failed add leaves nothing behind.
+        self.assertIsNone(self.agent.entities.find('name', 'd2'))
+        self.assertEqual(self.agent.entities.find('name', 'd1'), dummy)
+
+        self.agent.remove(dummy)
+        self.add(type='dummy', name='d1', arg1='b')
+        self.assertEqual(self.agent.entities.find('name', 'd1').attributes['arg1'], 'b')
+
+    def test_singleton(self):
+        self.assertRaisesRegexp(ValidationError, "singleton", self.add, type='management', name='other')
+        self.add(type='router', id='R', mode='interior')
+        self.assertRaisesRegexp(ValidationError, "singleton", self.add, type='router', id='R2', mode='interior')
+
+    def test_inter_router_mode(self):
+        listener = self.add(type='listener', name='l1', port='5672', role='inter-router')
+        self.assertRaisesRegexp(ValidationError, "inter-router.*ListenerEntity",
+                                self.add, type='router', id='R', mode='standalone')
+        self.agent.remove(listener)
+        self.add(type='router', id='R', mode='standalone')
+        self.assertRaisesRegexp(ValidationError, "inter-router.*ListenerEntity",
+                                self.add, type='listener', name='l2', port='5672', role='inter-router')
+        self.assertRaisesRegexp(ValidationError, "inter-router.*ConnectorEntity",
+                                self.add, type='connector', name='c1', port='5672', role='inter-router')
+        self.add(type='listener', name='l3', port='5672', role='normal')
+
+    def ids(self, body):
+        return [r[0] for r in body['results']]
+
+    def test_paging(self):
+        query = {'attributeNames': ['id']}
+        status, body = self.query(query, entityType='router.node', count=2)
+        self.assertEqual(self.ids(body), ['R0', 'R1'])
+        status, body = self.query(query, entityType='router.node', count=2,
+                                  continuation=body['continuation'])
+        self.assertEqual(self.ids(body), ['R2', 'R3'])
+        continuation = body['continuation']
+
+        ##
+        ## Removing the entity the continuation refers to, or the entities before it,
+        ## does not change where the next page starts.
+        ##
+        for i in range(4): self.agent.remove_implementation(self.nodes[i])
+        self.agent.add_implementation(Refreshed(self.counts, 'R5'), 'router.node')
+        status, body = self.query(query, entityType='router.node', continuation=continuation)
+        self.assertEqual(self.ids(body), ['R4', 'R5'])
+        self.assertNotIn('continuation', body)
+
+        status, body = self.query(query, entityType='router.node', offset=1, count=1)
+        self.assertEqual(self.ids(body), ['R5'])
+        self.assertNotIn('continuation', body)
+
+    def test_iter_type_after(self):
+        cache = self.agent.entities
+        seqs = [seq for seq, e in cache.iter_type('router.node')]
+        self.assertEqual([e.attributes['id'] for seq, e in cache.iter_type('router.node', after=seqs[1])],
+                         ['R2', 'R3', 'R4'])
+        self.agent.remove_implementation(self.nodes[1])
+        self.agent.remove_implementation(self.nodes[2])
+        self.assertEqual([e.attributes['id'] for seq, e in cache.iter_type('router.node', after=seqs[1])],
+                         ['R3', 'R4'])
+        self.assertEqual([e.attributes['id'] for seq, e in cache.iter_type('entity', after=seqs[4])], [])
+
+    def test_paging_bad_request(self):
+        for prop in ['offset', 'count', 'continuation']:
+            for value in ['x', '1.5', [1]]:
+                status, body = self.query({'attributeNames': []}, **{prop: value})
+                self.assertEqual(status, 400)
+                self.assertIn("'%s' property must be an integer" % prop, self.description)
+
+    def test_read_refreshes_target(self):
+        self.counts.clear()
+        status, body = self.request(operation='READ', type='router.node', name='router.node/R2')
+        self.assertEqual((status, body['id']), (200, 'R2'))
+        self.assertEqual(self.counts, {'R2': 1})
+
+        self.counts.clear()
+        status, body = self.request(operation='READ', name='no-such-entity')
+        self.assertEqual(status, 404)
+        self.assertEqual(self.counts, {})
+
+    def test_query_refreshes_page(self):
+        """A QUERY refreshes the entities it returns and the one after the page only"""
+        self.counts.clear()
+        status, body = self.query({'attributeNames': ['id']}, entityType='router.node', offset=1, count=2)
+        self.assertEqual(body['results'], [['R1'], ['R2']])
+        self.assertEqual(self.counts, {'R0': 1, 'R1': 1, 'R2': 1, 'R3': 1})
+        self.assertFalse(self.qd.locked)
+
+        self.counts.clear()
+        status, body = self.query({'attributeNames': ['name']}, entityType='listener')
+        self.assertEqual((status, body['results']), (200, []))
+        self.assertEqual(self.counts, {})
+
+    def test_added_in_c_refreshed_once(self):
+        counts = []
+        def allocator(attributes):
+            counts.append(1)
+            attributes.update(typeName='qd_thing_t', batchesRebalancedToGlobal=len(counts))
+        self.qd.objects[1234] = allocator
+        self.qd.events.append((1, 'allocator', 1234))
+        status, body = self.query({'attributeNames': ['typeName', 'batchesRebalancedToGlobal']},
+                                  entityType='allocator')
+        self.assertEqual([dict(zip(body['attributeNames'], r)) for r in body['results']],
+                         [{'typeName': 'qd_thing_t', 'batchesRebalancedToGlobal': 1}])
+        self.assertEqual(len(counts), 1)
+
+        ##
+        ## The next request refreshes it again, and once it is removed in C it is gone
+        ##
+        status, body = self.request(operation='READ', type='allocator', name='allocator/qd_thing_t')
+        self.assertEqual(body['batchesRebalancedToGlobal'], 2)
+        self.qd.events.append((0, 'allocator', 1234))
+        status, body = self.request(operation='READ', type='allocator', name='allocator/qd_thing_t')
+        self.assertEqual(status, 404)
+
+    def test_query_filter(self):
+        for i in range(4): self.add(type='dummy', name='d%d' % i, num1=i, arg1='x%d' % (i % 2))
+        query = {'attributeNames': ['name'], 'filter': ['num1>=1', 'arg1=x1']}
+        status, body = self.query(query, entityType='dummy')
+        self.assertEqual(self.ids(body), ['d1', 'd3'])
+        status, body = self.query(dict(query, filter='nosuch=1'), entityType='dummy')
+        self.assertEqual(status, 404)
+        status, body = self.query(dict(query, filter='num1'), entityType='dummy')
+        self.assertEqual(status, 400)
+
+
+class QueryFilterTest(unittest.TestCase):
+
+    def match(self, expression, **attributes):
+        return QueryFilter(expression).match(attributes)
+
+    def test_number(self):
+        for value, expressions in [(1, ['n=1', 'n=1.0', 'n!=2', 'n<2', 'n<=1', 'n>0', 'n>=1', 'n>=0.5']),
+                                   (2.5, ['n=2.5', 'n!=2', 'n<3', 'n>2', 'n>=2.5', 'n<=2.5'])]:
+            for expression in expressions:
+                self.assertTrue(self.match(expression, n=value), expression)
+        for expression in ['n=2', 'n!=1', 'n<1', 'n<=0', 'n>1', 'n>=2', 'n=x', 'n^=1']:
+            self.assertFalse(self.match(expression, n=1), expression)
+        # Comparing a number with text is never equal.
+        self.assertTrue(self.match('n!=x', n=1))
+
+    def test_text(self):
+        for expression in ['s=abc', 's!=ab', 's^=ab', 's^=abc', 's^=']:
+            self.assertTrue(self.match(expression, s='abc'), expression)
+        # Only the first operator splits the condition.
+        self.assertTrue(self.match('s=a=c', s='a=c'))
+        for expression in ['s=ab', 's!=abc', 's^=abcd', 's^=b']:
+            self.assertFalse(self.match(expression, s='abc'), expression)
+        # Order comparisons are numeric only.
+        for expression in ['s<1', 's<=1', 's>1', 's>=1']:
+            self.assertFalse(self.match(expression, s='5'), expression)
+        # Numeric text attributes still compare as text for =.
+        self.assertFalse(self.match('s=1.0', s='1'))
+
+    def test_boolean(self):
+        self.assertTrue(self.match('b=true', b=True))
+        self.assertTrue(self.match('b=false', b=False))
+        self.assertTrue(self.match('b!=true', b=False))
+        self.assertFalse(self.match('b=1', b=True))
+        self.assertFalse(self.match('b>0', b=True))
+
+    def test_missing(self):
+        for value in [None, [1], {'a': 1}]:
+            for expression in ['m=1', 'm=x', 'm<1', 'm>=1', 'm^=x']:
+                self.assertFalse(self.match(expression, m=value), expression)
+            self.assertTrue(self.match('m!=1', m=value))
+        self.assertFalse(self.match('m=1'))
+        self.assertTrue(self.match('m!=1'))
+
+    def test_terms(self):
+        f = QueryFilter(['n>1', 'n<5', 's^=a'])
+        self.assertEqual(f.attributes(), set(['n', 's']))
+        self.assertTrue(f.match({'n': 3, 's': 'ab'}))
+        self.assertFalse(f.match({'n': 5, 's': 'ab'}))
+        self.assertFalse(f.match({'n': 3, 's': 'ba'}))
+        self.assertFalse(f.match({'n': 3}))
+        self.assertTrue(QueryFilter([]).match({}))
+
+    def test_invalid(self):
+        for expression in ['n', 'n~1', '=1', 'a b=1', 1, None, {'n': 1}, ['n=1', 2],
+                           'n<x', 'n>=', 'n>1x']:
+            self.assertRaises(BadRequestStatus, QueryFilter, expression)
+
+
+if __name__ == '__main__':
+    unittest.main()
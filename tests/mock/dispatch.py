@@ -40,14 +40,19 @@ class LogAdapter:
   def __init__(self, mod_name):
     self.mod_name = mod_name
 
-  def log(self, level, text):
+  def log(self, level, text, file=None, line=None):
     print "LOG: mod=%s level=%d text=%s" % (self.mod_name, level, text)
 
+  def enabled(self, level):
+    return True
+
 class IoAdapter:
-  def __init__(self, handler, address, global_address=False):
+  def __init__(self, handler, address, aclass='L', phase='0', treatment=TREATMENT_ANYCAST_CLOSEST):
     self.handler = handler
     self.address = address
-    self.global_address = global_address
+    self.aclass = aclass
+    self.phase = phase
+    self.treatment = treatment
 
-  def send(self, address, properties, application_properties, body, correlation_id=None):
-    print "IO: send(addr=%s properties=%r application_properties=%r body=%r" % (address, properties, application_properties, body)
+  def send(self, message, no_echo=True, control=False):
+    print "IO: send(addr=%s properties=%r body=%r)" % (message.address, message.properties, message.body)
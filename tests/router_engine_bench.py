@@ -0,0 +1,574 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Control-plane benchmark for the router engine.
+
+A network of RouterEngine instances is run in a discrete-event simulation with a
+simulated clock.  Each engine gets a mock router adapter that records the routes it
+hands to the router core, and control messages are delivered between engines over a
+generated topology with a fixed per-hop delay.  Flooded and routed messages reach
+every router that is connected in the physical topology; the core's own forwarding
+tables are not modelled.
+
+For each topology the network is started and then subjected to a router joining,
+a link flapping and a router leaving.  For every event the harness reports the
+simulated time until all routers hold the correct route cost to every reachable
+router, the number of route computations, the control messages sent and the
+CPU time spent in the engines.
+
+Usage: SOURCE_DIR=<source tree> python router_engine_bench.py [options]
+"""
+
+import os
+import sys
+import copy
+import heapq
+import math
+import random
+import time
+from optparse import OptionParser
+
+import mock                     # Mock definitions for the dispatch adapters.
+
+sys.path.append(os.path.join(os.environ["SOURCE_DIR"], "python"))
+
+from qpid_dispatch_internal.dispatch import LOG_ERROR
+from qpid_dispatch_internal.router import engine as engine_module
+from qpid_dispatch_internal.router.engine import RouterEngine
+from qpid_dispatch_internal.management.qdrouter import QdSchema
+from qpid_dispatch.management.entity import EntityBase
+
+OPCODES = ['HELLO', 'RA', 'LSU', 'LSR', 'MAU', 'MAR']
+
+##
+## Topology generators.  Each returns a list of (router-index, router-index) links.
+##
+def ring(count, rng):
+    if count < 3:
+        return mesh(count, rng)
+    return [(i, (i + 1) % count) for i in range(count)]
+
+
+def mesh(count, rng):
+    return [(i, j) for i in range(count) for j in range(i + 1, count)]
+
+
+def geometric(count, rng):
+    """
+    Random geometric graph in the unit square.  Components left unconnected by the
+    radius are joined to the rest of the graph through their closest pair of routers.
+    """
+    points = [(rng.random(), rng.random()) for i in range(count)]
+    radius = 1.5 * math.sqrt(math.log(max(count, 2)) / (math.pi * count))
+    dist   = lambda a, b: math.hypot(points[a][0] - points[b][0], points[a][1] - points[b][1])
+    links  = [(i, j) for i in range(count) for j in range(i + 1, count) if dist(i, j) <= radius]
+
+    owner = range(count)
+    def find(i):
+        while owner[i] != i:
+            i = owner[i]
+        return i
+    for i, j in links:
+        owner[find(i)] = find(j)
+    while True:
+        roots = set(find(i) for i in range(count))
+        if len(roots) == 1:
+            break
+        first = [i for i in range(count) if find(i) == find(0)]
+        rest  = [i for i in range(count) if find(i) != find(0)]
+        i, j  = min(((a, b) for a in first for b in rest), key=lambda pair: dist(*pair))
+        links.append((i, j))
+        owner[find(j)] = find(i)
+    return links
+
+
+def hub(count, rng):
+    """
+    A fully meshed core of one hub per sixteen routers, with the remaining routers
+    attached to the hubs in turn.
+    """
+    hubs  = max(1, count // 16)
+    links = mesh(hubs, rng)
+    for i in range(hubs, count):
+        links.append((i % hubs, i))
+    return links
+
+
+TOPOLOGIES = {'ring': ring, 'mesh': mesh, 'geometric': geometric, 'hub': hub}
+
+
+class SimAdapter(object):
+    """
+    Router adapter and management agent for one simulated router.  The routes handed
+    to the router core are kept in a table of maskbit => [router-id, link-id,
+    next-hop-maskbit, cost].
+    """
+    def __init__(self, sim, router_id, config):
+        self.sim       = sim
+        self.router_id = router_id
+        self.config    = config
+        self.table     = {}
+        self.avoided   = 0
+
+    def _changed(self):
+        self.sim.dirty.add(self.router_id)
+
+    def get_agent(self):
+        return self
+
+    def add_implementation(self, impl, entity_type):
+        pass
+
+    def remove_implementation(self, impl):
+        pass
+
+    def find_entity_by_type(self, entity_type):
+        return [self.config]
+
+    def add_router(self, address, maskbit):
+        self.table[maskbit] = [address.split('/')[-2], None, None, 0]
+        self._changed()
+
+    def del_router(self, maskbit):
+        self.table.pop(maskbit, None)
+        self._changed()
+
+    def set_link(self, maskbit, link_id):
+        self.table[maskbit][1] = link_id
+        self._changed()
+
+    def remove_link(self, maskbit):
+        self.table[maskbit][1] = None
+        self._changed()
+
+    def set_next_hop(self, maskbit, nh_maskbit):
+        self.table[maskbit][2] = nh_maskbit
+        self._changed()
+
+    def remove_next_hop(self, maskbit):
+        self.table[maskbit][2] = None
+        self._changed()
+
+    def set_cost(self, maskbit, cost):
+        self.table[maskbit][3] = cost
+        self._changed()
+
+    def set_valid_origins(self, maskbit, valid_origins):
+        pass
+
+    def set_routes(self, updates):
+        for maskbit, nh_maskbit, cost, valid_origins, next_hops, ecmp_origins in updates:
+            if nh_maskbit >= 0:
+                self.table[maskbit][2] = nh_maskbit
+            if cost > 0:
+                self.table[maskbit][3] = cost
+        self._changed()
+
+    def set_recomputes_avoided(self, count):
+        self.avoided = count
+
+    def set_request_counters(self, queued, sent):
+        pass
+
+    def map_destination(self, addr, maskbit):
+        pass
+
+    def unmap_destination(self, addr, maskbit):
+        pass
+
+    def schedule_tick(self, msec):
+        self.sim.schedule_tick(self.router_id, msec)
+
+    def routes(self):
+        """
+        Return router-id => cost for every router the core can currently forward to
+        """
+        return dict((entry[0], entry[3]) for entry in self.table.values()
+                    if entry[1] != None or entry[2] != None)
+
+
+class SimRouter(RouterEngine):
+    """
+    A RouterEngine whose control messages are carried by the simulation
+    """
+    def __init__(self, sim, router_id, config):
+        self.sim      = sim
+        self.adapter  = SimAdapter(sim, router_id, config)
+        self.timer    = 0
+        RouterEngine.__init__(self, self.adapter, router_id, '0', sim.max_routers)
+
+        calculate_routes = self.path_engine.calculate_routes
+        def counted(collection):
+            sim.spf_runs += 1
+            return calculate_routes(collection)
+        self.path_engine.calculate_routes = counted
+
+    def _log(self, adapter, level, text, args):
+        if level >= LOG_ERROR:
+            print "%s: %s" % (self.id, text % args if args else text)
+
+    def send(self, dest, msg):
+        self.sim.send(self.id, dest, msg)
+
+
+class Simulation(object):
+    """
+    Discrete-event simulation of a network of router engines.  The simulation stands in
+    for the clock of the engine module while it runs, hence the time() method.
+    """
+    def __init__(self, options, config):
+        self.options     = options
+        self.config      = config
+        self.max_routers = options.max_routers
+        self.hop_delay   = options.hop_delay / 1000.0
+        self.now         = 1000000.0
+        self.events      = []         # heap of (time, sequence, handler, args)
+        self.sequence    = 0
+        self.routers     = {}         # router-id => SimRouter
+        self.links       = {}         # router-id => {peer-id => cost} for links that are up
+        self.link_ids    = {}         # router-id => {peer-id => link-id}
+        self.hops        = {}         # router-id => {router-id => hop count}, cached
+        self.expected    = {}         # router-id => {router-id => cost}
+        self.correct     = set()      # routers whose routes match the expected costs
+        self.dirty       = set()      # routers whose routes have changed since last checked
+        self.in_flight   = 0          # control messages other than HELLO not yet delivered
+        self.converged   = None       # time at which all routes last became correct
+        self.cpu         = 0.0
+        self.spf_runs    = 0
+        self.sent        = dict((op, 0) for op in OPCODES)
+
+    def time(self):
+        return self.now
+
+    def _push(self, when, handler, *args):
+        self.sequence += 1
+        heapq.heappush(self.events, (when, self.sequence, handler, args))
+
+    def _engine_call(self, handler, *args):
+        start = time.clock()
+        try:
+            return handler(*args)
+        finally:
+            self.cpu += time.clock() - start
+
+    ##
+    ## Topology changes.  The changes that make up one event are applied together
+    ## and followed by a call to _topology_changed.
+    ##
+    def add_router(self, router_id):
+        config = EntityBase(dict(self.config.attributes))
+        router = SimRouter(self, router_id, config)
+        self.routers[router_id]  = router
+        self.links[router_id]    = {}
+        self.link_ids[router_id] = {}
+        self._push(self.now + self.options.rng.random() * router.hello_protocol.hello_interval,
+                   self._tick, router_id, router.timer)
+
+    def del_router(self, router_id):
+        for peer in self.links[router_id].keys():
+            self.link_down(router_id, peer)
+        self.routers.pop(router_id)
+        self.links.pop(router_id)
+        self.link_ids.pop(router_id)
+
+    def _link_id(self, router_id):
+        used = set(self.link_ids[router_id].values())
+        link_id = 0
+        while link_id in used:
+            link_id += 1
+        return link_id
+
+    def link_up(self, a, b, cost=1):
+        self.link_ids[a][b] = self._link_id(a)
+        self.link_ids[b][a] = self._link_id(b)
+        self.links[a][b] = cost
+        self.links[b][a] = cost
+
+    def link_down(self, a, b):
+        for x, y in [(a, b), (b, a)]:
+            self.links[x].pop(y)
+            link_id = self.link_ids[x].pop(y)
+            self._engine_call(self.routers[x].linkLost, link_id)
+
+    def _topology_changed(self):
+        """
+        Recompute the route costs every router should end up with
+        """
+        self.hops = {}
+        self.expected = {}
+        for router_id in self.routers:
+            costs = {router_id : 0}
+            heap  = [(0, router_id)]
+            while heap:
+                cost, node = heapq.heappop(heap)
+                if cost > costs[node]:
+                    continue
+                for peer, link_cost in self.links[node].items():
+                    if peer not in costs or cost + link_cost < costs[peer]:
+                        costs[peer] = cost + link_cost
+                        heapq.heappush(heap, (cost + link_cost, peer))
+            costs.pop(router_id)
+            self.expected[router_id] = costs
+        self.correct = set()
+        self.dirty   = set(self.routers.keys())
+        self.converged = None
+
+    def _hops(self, router_id):
+        hops = self.hops.get(router_id)
+        if hops == None:
+            hops = {router_id : 0}
+            frontier = [router_id]
+            while frontier:
+                following = []
+                for node in frontier:
+                    for peer in self.links[node]:
+                        if peer not in hops:
+                            hops[peer] = hops[node] + 1
+                            following.append(peer)
+                frontier = following
+            self.hops[router_id] = hops
+        return hops
+
+    ##
+    ## Message transport and timers
+    ##
+    def send(self, src, dest, msg):
+        opcode = msg.get_opcode()
+        body   = msg.to_dict()
+        self.sent[opcode] += 1
+        parts  = dest.split('/')
+        if parts[1] == '_local':
+            for peer, cost in self.links[src].items():
+                self._push(self.now + self.hop_delay, self._deliver,
+                           peer, opcode, copy.deepcopy(body), self.link_ids[peer][src], cost, src)
+            return
+
+        hops = self._hops(src)
+        if parts[3] == 'all':
+            targets = [router_id for router_id in hops if router_id != src]
+        else:
+            targets = [parts[3]] if parts[3] in hops else []
+        for target in targets:
+            self.in_flight += 1
+            self._push(self.now + hops[target] * self.hop_delay, self._deliver,
+                       target, opcode, copy.deepcopy(body), 0, 1, None)
+
+    def _deliver(self, router_id, opcode, body, link_id, cost, neighbor):
+        if opcode != 'HELLO':
+            self.in_flight -= 1
+        router = self.routers.get(router_id)
+        if not router or (neighbor and neighbor not in self.links[router_id]):
+            return
+        self._engine_call(router.handleControlMessage, opcode, body, link_id, cost)
+
+    def schedule_tick(self, router_id, msec):
+        router = self.routers[router_id]
+        router.timer += 1
+        self._push(self.now + msec / 1000.0, self._tick, router_id, router.timer)
+
+    def _tick(self, router_id, timer):
+        router = self.routers.get(router_id)
+        if not router or router.timer != timer:
+            return
+        msec = self._engine_call(router.handleTimerTick)
+        self.schedule_tick(router_id, msec)
+
+    ##
+    ## Running the simulation
+    ##
+    def _check(self):
+        for router_id in self.dirty:
+            if router_id not in self.routers:
+                continue
+            if self.routers[router_id].adapter.routes() == self.expected[router_id]:
+                self.correct.add(router_id)
+            else:
+                self.correct.discard(router_id)
+        self.dirty = set()
+        if len(self.correct) == len(self.routers):
+            if self.converged == None:
+                self.converged = self.now
+        else:
+            self.converged = None
+
+    def _quiescent(self):
+        if self.converged == None or self.in_flight:
+            return False
+        for router in self.routers.values():
+            tracker  = router.node_tracker
+            deadline = tracker.next_deadline(self.now)
+            if deadline != None and (deadline <= self.now or deadline == tracker.spf_due):
+                return False
+        return True
+
+    def run(self, until=None):
+        """
+        Process events until the given time or, if no time is given, until the routes
+        have converged and no route computations or control messages are outstanding.
+        Return the time of convergence, or None if the timeout passed first.
+        """
+        timeout = self.now + self.options.timeout
+        while self.events:
+            if until != None and self.events[0][0] > until:
+                self.now = until
+                return None
+            if until == None and (self._quiescent() or self.now > timeout):
+                return self.converged
+            when, sequence, handler, args = heapq.heappop(self.events)
+            self.now = when
+            handler(*args)
+            if self.dirty and (not self.events or self.events[0][0] > self.now):
+                self._check()
+        return self.converged
+
+    def measure(self, name, change):
+        """
+        Apply a change to the network and report the cost of converging afterwards
+        """
+        spf_runs = self.spf_runs
+        sent     = dict(self.sent)
+        cpu      = self.cpu
+        start    = self.now
+        change()
+        self._topology_changed()
+        self._check()
+        converged = self.run()
+        result = {'event'     : name,
+                  'converged' : (converged - start) * 1000.0 if converged != None else None,
+                  'spf_runs'  : self.spf_runs - spf_runs,
+                  'cpu'       : (self.cpu - cpu) * 1000.0}
+        for opcode in OPCODES:
+            result[opcode] = self.sent[opcode] - sent[opcode]
+        return result
+
+
+def router_config(schema, overrides):
+    """
+    Build a router entity from the schema defaults and the command line overrides
+    """
+    entity_type = schema.entity_type('router')
+    attributes  = dict((name, attr.default) for name, attr in entity_type.attributes.items()
+                       if attr.default is not None)
+    for override in overrides:
+        name, value = override.split('=', 1)
+        attributes[name] = entity_type.attributes[name].validate(value)
+    return EntityBase(attributes)
+
+
+def run_topology(options, config, topology, count):
+    """
+    Run the event sequence over one generated topology and return the results
+    """
+    options.rng = random.Random(options.seed)
+    links = TOPOLOGIES[topology](count, options.rng)
+    names = ['R%03d' % i for i in range(count)]
+    sim   = Simulation(options, config)
+
+    saved_time = engine_module.time
+    engine_module.time = sim
+    try:
+        joiner = names[-1]
+        def start():
+            for name in names[:-1]:
+                sim.add_router(name)
+            for a, b in links:
+                if joiner not in (names[a], names[b]):
+                    sim.link_up(names[a], names[b])
+
+        def join():
+            sim.add_router(joiner)
+            for a, b in links:
+                if joiner in (names[a], names[b]):
+                    sim.link_up(names[a], names[b])
+
+        flapped = options.rng.choice([(names[a], names[b]) for a, b in links])
+        def link_down():
+            sim.link_down(*flapped)
+
+        def link_up():
+            sim.link_up(*flapped)
+
+        leaver = options.rng.choice([name for name in names[:-1] if name not in flapped])
+        def leave():
+            sim.del_router(leaver)
+
+        results = [sim.measure('start', start)]
+        for name, change in [('join', join), ('link-down', link_down), ('link-up', link_up), ('leave', leave)]:
+            sim.run(until=sim.now + options.settle)
+            results.append(sim.measure(name, change))
+    finally:
+        engine_module.time = saved_time
+
+    for result in results:
+        result.update({'topology': topology, 'routers': count, 'links': len(links)})
+    return results
+
+
+COLUMNS = [('topology', '%-10s'), ('routers', '%7s'), ('links', '%6s'), ('event', '%-10s'),
+           ('converged', '%10s'), ('spf_runs', '%8s')] + [(op, '%6s') for op in OPCODES] + [('cpu', '%9s')]
+
+def report(results, out=sys.stdout):
+    out.write(' '.join(fmt % ('conv(ms)' if name == 'converged' else 'cpu(ms)' if name == 'cpu' else name)
+                       for name, fmt in COLUMNS) + '\n')
+    for result in results:
+        values = []
+        for name, fmt in COLUMNS:
+            value = result[name]
+            if name in ('converged', 'cpu'):
+                value = '%.1f' % value if value != None else 'timeout'
+            values.append(fmt % value)
+        out.write(' '.join(values) + '\n')
+    out.flush()
+
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options]", description=__doc__.split('\n\n')[1])
+    parser.add_option("-t", "--topology", action="append", choices=sorted(TOPOLOGIES.keys()),
+                      help="Topology to run, may be repeated (default: all)")
+    parser.add_option("-n", "--routers", default="8,16,32",
+                      help="Comma separated list of network sizes (default: %default)")
+    parser.add_option("--max-routers", type="int", default=128,
+                      help="maxRouters for each engine, the largest usable network size (default: %default)")
+    parser.add_option("--hop-delay", type="float", default=1.0,
+                      help="Milliseconds taken by a message to cross one link (default: %default)")
+    parser.add_option("--settle", type="float", default=10.0,
+                      help="Seconds the network is left alone between events (default: %default)")
+    parser.add_option("--timeout", type="float", default=120.0,
+                      help="Seconds to wait for convergence after an event (default: %default)")
+    parser.add_option("--seed", type="int", default=1, help="Random seed (default: %default)")
+    parser.add_option("--set", action="append", default=[], metavar="NAME=VALUE",
+                      help="Override a router attribute, e.g. --set spfHoldMs=100")
+    options, args = parser.parse_args(argv[1:])
+
+    sizes = [int(size) for size in options.routers.split(',')]
+    if min(sizes) < 4 or max(sizes) > options.max_routers:
+        parser.error("network sizes must be between 4 and %d routers" % options.max_routers)
+    config = router_config(QdSchema(), options.set)
+
+    results = []
+    for topology in options.topology or sorted(TOPOLOGIES.keys()):
+        for count in sizes:
+            results.extend(run_topology(options, config, topology, count))
+    report(results)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
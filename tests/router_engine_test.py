@@ -19,13 +19,19 @@
 
 import os
 import sys
+import random
 import unittest
 import mock                     # Mock definitions for tests.
 
 sys.path.append(os.path.join(os.environ["SOURCE_DIR"], "python"))
 
-from qpid_dispatch_internal.router.engine import HelloProtocol, PathEngine, NodeTracker
-from qpid_dispatch_internal.router.data import LinkState, MessageHELLO
+from qpid_dispatch_internal.router.engine import HelloProtocol, PathEngine, NodeTracker, RouterEngine
+from qpid_dispatch_internal.router.path import NodeSet, HeapNodeSet
+from qpid_dispatch_internal.router.mobile import MobileAddressEngine
+from qpid_dispatch_internal.router.area import AreaEngine
+from qpid_dispatch_internal.router.link import LinkStateEngine
+from qpid_dispatch_internal.router.data import LinkState, MessageHELLO, MessageMAR, MessageMAU, MessageASU, MessageASR
+from qpid_dispatch_internal.router.data import MessageLSR, MessageLSU
 from qpid_dispatch.management.entity import EntityBase
 from system_test import main_module
 
@@ -33,7 +39,7 @@ class Adapter(object):
     def __init__(self, domain):
         self._domain = domain
 
-    def log(self, level, text):
+    def log(self, level, text, *args):
         print "Adapter.log(%d): domain=%s, text=%s" % (level, self._domain, text)
 
     def send(self, dest, opcode, body):
@@ -97,7 +103,7 @@ class DataTest(unittest.TestCase):
 
 
 class NodeTrackerTest(unittest.TestCase):
-    def log(self, level, text):
+    def log(self, level, text, *args):
         pass
 
     def add_neighbor_router(self, address, router_bit, link_bit):
@@ -131,11 +137,941 @@ class NodeTrackerTest(unittest.TestCase):
         self.calls      = 0
 
 
+class TrackerContainer(object):
+    """
+    Drives a NodeTracker with the test case standing in for the router engine,
+    the router adapter and the management agent.
+    """
+    def log(self, level, text, *args):
+        pass
+
+    def log_ls(self, level, text, *args):
+        pass
+
+    def get_agent(self):
+        return self
+
+    def add_implementation(self, impl, entity_type):
+        pass
+
+    def remove_implementation(self, impl):
+        pass
+
+    def add_router(self, address, maskbit):
+        pass
+
+    def del_router(self, maskbit):
+        pass
+
+    def set_link(self, maskbit, link_id):
+        pass
+
+    def remove_link(self, maskbit):
+        pass
+
+    def remove_next_hop(self, maskbit):
+        pass
+
+    def set_routes(self, updates):
+        self.route_calls.append(updates)
+
+    def set_recomputes_avoided(self, count):
+        self.recomputes_avoided = count
+
+    def set_request_counters(self, queued, sent):
+        self.request_counters = (queued, sent)
+
+    def send_lsr(self, node_id, have_seq=None, have_ids=0):
+        pass
+
+    def send_ra(self, now):
+        pass
+
+    def set_mobile_seq(self, seq):
+        pass
+
+    def send_mar(self, node_id, seq):
+        pass
+
+    def has_changes(self):
+        return False
+
+    def tick(self, now):
+        return 0
+
+    def map_destination(self, addr, maskbit):
+        self.mapped.add((addr, maskbit))
+
+    def unmap_destination(self, addr, maskbit):
+        self.mapped.remove((addr, maskbit))
+
+    def setUp(self):
+        self.id = 'R1'
+        self.instance = 1
+        self.area = '0'
+        self.config = EntityBase({
+            'helloMaxAge'      :  3.0,
+            'remoteLsMaxAge'   : 60.0,
+            'raIntervalFlux'   :  4.0,
+            'spfAlgorithm'     : 'heap',
+            'mobileAddrChunkSize'         : 0,
+            'mobileAddrMaxDeltas'         : 100,
+            'mobileAddrMaxDeltaAddresses' : 10000,
+            'spfInitialDelayMs'           : 0,
+            'spfHoldMs'                   : 0,
+            'spfMaxWaitMs'                : 0,
+            'controlRequestRate'          : 0,
+            'controlRequestBurst'         : 1 })
+        self.router_adapter = self
+        self.link_state_engine = self
+        self.mobile_address_engine = self
+        self.route_calls = []
+        self.mapped = set()
+        self.node_tracker = NodeTracker(self, 8)
+        self.path_engine = PathEngine(self)
+
+
+class RouteUpdateTest(TrackerContainer, unittest.TestCase):
+    def test_routes_batched(self):
+        """
+
+        +====+      +----+      +----+
+        | R1 |------| R2 |------| R3 |
+        +====+      +----+      +----+
+
+        """
+        tracker = self.node_tracker
+        tracker.neighbor_refresh('R2', 1, 7, 1, 1.0)
+        tracker.link_state_received('R2', LinkState(None, 'R2', 1, {'R1':1, 'R3':1}), 1, 1.0)
+        tracker.link_state_received('R3', LinkState(None, 'R3', 1, {'R2':1}), 1, 1.0)
+        tracker.tick(1.0)
+        self.assertEqual(len(self.route_calls), 1)
+        updates = dict((u[0], u) for u in self.route_calls[0])
+        r2 = tracker.router_node('R2').maskbit
+        r3 = tracker.router_node('R3').maskbit
+        self.assertEqual(updates[r2], (r2, -1, 1, [], [], []))
+        self.assertEqual(updates[r3], (r3, r2, 2, [], [], []))
+
+        ##
+        ## A recompute that changes nothing doesn't call the adapter
+        ##
+        tracker.recompute_topology = True
+        tracker.tick(2.0)
+        self.assertEqual(len(self.route_calls), 1)
+
+        ##
+        ## Only the changed cost is sent
+        ##
+        tracker.link_state_received('R2', LinkState(None, 'R2', 2, {'R1':1, 'R3':4}), 1, 3.0)
+        tracker.tick(3.0)
+        self.assertEqual(self.route_calls[1], [(r3, -1, 5, None, None, None)])
+
+
+class RequestPacingTest(TrackerContainer, unittest.TestCase):
+    def send_lsr(self, node_id, have_seq=None, have_ids=0):
+        self.requests.append(node_id)
+
+    def setUp(self):
+        super(RequestPacingTest, self).setUp()
+        self.config.controlRequestRate  = 2
+        self.config.controlRequestBurst = 2
+        self.node_tracker = NodeTracker(self, 8)
+        self.requests = []
+
+    def test_paced_requests(self):
+        """
+
+                            +----+
+                         +--| R3 |
+                         |  +----+
+        +====+      +----+  +----+
+        | R1 |------| R2 |--| R4 |
+        +====+      +----+  +----+
+                         |  +----+
+                         +--| R5 |
+                            +----+
+
+        """
+        tracker = self.node_tracker
+        tracker.neighbor_refresh('R2', 1, 7, 1, 1.0)
+        tracker.link_state_received('R2', LinkState(None, 'R2', 1, {'R1':1, 'R3':1, 'R4':1, 'R5':1}), 1, 1.0)
+        tracker.tick(1.0)
+
+        ##
+        ## The neighbor is asked first, and the rest wait for tokens
+        ##
+        self.assertEqual(self.requests, ['R2', 'R3'])
+        self.assertEqual(self.request_counters, (2, 2))
+        self.assertEqual(tracker.next_deadline(1.0), 1.5)
+
+        tracker.tick(1.5)
+        tracker.tick(2.0)
+        self.assertEqual(self.requests, ['R2', 'R3', 'R4', 'R5'])
+        self.assertEqual(self.request_counters, (0, 4))
+        self.assertEqual(tracker.pending_requests, set())
+
+
+class MaskbitTest(TrackerContainer, unittest.TestCase):
+    def test_allocate_and_reuse(self):
+        tracker = NodeTracker(self, 4)
+        self.assertEqual([tracker._allocate_maskbit() for i in range(3)], [1, 2, 3])
+        self.assertRaises(Exception, tracker._allocate_maskbit)
+
+        ##
+        ## Released maskbits are reused lowest first
+        ##
+        tracker._free_maskbit(3)
+        tracker._free_maskbit(1)
+        self.assertEqual(tracker._allocate_maskbit(), 1)
+        self.assertEqual(tracker._allocate_maskbit(), 3)
+        self.assertRaises(Exception, tracker._allocate_maskbit)
+
+
+class ExpirationTest(TrackerContainer, unittest.TestCase):
+    def test_expirations(self):
+        """
+
+        +====+      +----+      +----+
+        | R1 |------| R2 |------| R3 |
+        +====+      +----+      +----+
+
+        """
+        tracker = self.node_tracker
+        tracker.neighbor_refresh('R2', 1, 7, 1, 1.0)
+        tracker.link_state_received('R2', LinkState(None, 'R2', 1, {'R1':1, 'R3':1}), 1, 1.0)
+        tracker.link_state_received('R3', LinkState(None, 'R3', 1, {'R2':1}), 1, 1.0)
+        tracker.tick(1.0)
+        self.assertEqual(tracker.advertisers['R3'], set(['R2']))
+        self.assertEqual(tracker.advertisers['R2'], set(['R3']))
+        self.assertEqual(tracker.orphans, set())
+
+        ##
+        ## A refreshed neighbor doesn't expire at its original deadline
+        ##
+        tracker.neighbor_refresh('R2', 1, 7, 1, 3.0)
+        tracker.tick(4.5)
+        self.assertTrue(tracker.router_node('R2').is_neighbor())
+        tracker.tick(5.5)
+        self.assertTrue(tracker.router_node('R2').is_neighbor())
+        tracker.tick(6.0)
+        self.assertFalse(tracker.router_node('R2').is_neighbor())
+        self.assertFalse(tracker.link_state.is_peer('R2'))
+
+        ##
+        ## Link state expires unless an RA refreshes it
+        ##
+        tracker.ra_received('R3', 1, 0, 1, 30.0)
+        tracker.tick(61.5)
+        self.assertFalse(tracker.router_node('R2').link_state.has_peers())
+        self.assertTrue(tracker.router_node('R3').link_state.has_peers())
+        self.assertEqual(tracker.advertisers.keys(), ['R2'])
+
+        ##
+        ## R2 is still listed by R3 so it is kept
+        ##
+        for now in range(62, 70):
+            tracker.tick(float(now))
+        self.assertTrue('R2' in tracker.nodes)
+
+        ##
+        ## Once R3's link state expires neither node is referenced and both are
+        ## deleted on the third sweep, one sweep per second
+        ##
+        tracker.tick(90.5)
+        self.assertEqual(tracker.advertisers, {})
+        self.assertEqual(tracker.orphans, set(['R2', 'R3']))
+        self.assertEqual(tracker.next_deadline(90.5), 91.5)
+        tracker.tick(91.0)
+        tracker.tick(91.5)
+        self.assertEqual(sorted(tracker.nodes.keys()), ['R2', 'R3'])
+        tracker.tick(92.5)
+        self.assertEqual(tracker.nodes, {})
+        self.assertEqual(tracker.orphans, set())
+        self.assertEqual(tracker.deadlines, [])
+        self.assertEqual(tracker.next_deadline(93.0), None)
+
+    def has_changes(self):
+        return False
+
+    def test_next_deadline(self):
+        tracker = self.node_tracker
+        tracker.neighbor_refresh('R2', 1, 7, 1, 1.0)
+        self.assertEqual(tracker.next_deadline(1.0), 1.0)
+        tracker.tick(1.0)
+        self.assertEqual(tracker.next_deadline(1.5), 4.0)
+
+        ##
+        ## A reachable node with an outstanding request needs an immediate tick
+        ##
+        tracker.router_node('R2').mobile_address_request()
+        self.assertEqual(tracker.next_deadline(1.5), 1.5)
+        tracker.tick(1.5)
+        self.assertEqual(tracker.pending_requests, set())
+        self.assertEqual(tracker.next_deadline(1.5), 4.0)
+
+
+class AreaTest(TrackerContainer, unittest.TestCase):
+    def add_border_router(self, address, maskbit):
+        self.border_routers[maskbit] = address
+
+    def del_router(self, maskbit):
+        self.border_routers.pop(maskbit, None)
+
+    def send(self, dest, msg):
+        self.sent.append((dest, msg))
+
+    def setUp(self):
+        TrackerContainer.setUp(self)
+        self.config.attributes['raInterval'] = 30.0
+        self.border_routers = {}
+        self.sent = []
+        self.local_addrs = set(['M0local'])
+        self.area_engine = AreaEngine(self, self.node_tracker)
+
+    def test_border_summaries(self):
+        """
+
+        +----+      +====+      +----+
+        | R2 |------| R1 |------| B1 |  area 1
+        +----+      +====+      +----+
+               area 0
+
+        """
+        tracker = self.node_tracker
+        area    = self.area_engine
+        tracker.neighbor_refresh('R2', 1, 7, 1, 1.0)
+        tracker.link_state_received('R2', LinkState(None, 'R2', 1, {'R1':1}), 1, 1.0)
+        tracker.tick(1.0)
+        tracker.router_node('R2').map_address('M0a')
+
+        ##
+        ## A new border neighbor is sent a summary of this area right away
+        ##
+        area.neighbor_refresh('B1', '1', 1, 5, 2, 1.0)
+        b1 = area.neighbors['B1'].maskbit
+        self.assertEqual(self.border_routers[b1], 'amqp:/_topo/0/B1@1/qdrouter')
+        area.tick(1.0)
+        self.assertEqual(len(self.sent), 1)
+        dest, msg = self.sent.pop(0)
+        self.assertEqual(dest, 'amqp:/_local/qdhello')
+        self.assertEqual((msg.area, msg.to_area), ('0', '1'))
+        self.assertEqual(msg.summary, {'0': {'cost': 0, 'addrs': ['M0a', 'M0local']}})
+
+        ##
+        ## Its summary is mapped to it and flooded into this area no sooner than the
+        ## minimum interval
+        ##
+        area.handle_asu(MessageASU(None, 'B1', '1', '0', 1, {'1': {'cost': 0L, 'addrs': ['M0b']}}), 1.5)
+        self.assertIn(('A1', b1), self.mapped)
+        self.assertIn(('M0b', b1), self.mapped)
+        area.tick(1.5)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(area.next_deadline(1.5), 2.0)
+        area.neighbor_refresh('B1', '1', 1, 5, 2, 2.0)
+        area.tick(2.0)
+        self.assertEqual(len(self.sent), 1)
+        dest, msg = self.sent.pop(0)
+        self.assertEqual(dest, 'amqp:/_topo/0/all/qdrouter')
+        self.assertEqual(msg.summary, {'1': {'cost': 2, 'addrs': ['M0b']}})
+
+        ##
+        ## A summary from another border router in this area is mapped to that router, and
+        ## the backbone passes it on to area 1
+        ##
+        r2 = tracker.router_node('R2').maskbit
+        area.handle_asu(MessageASU(None, 'R2', '0', '0', 1, {'2': {'cost': 3L, 'addrs': ['M0a', 'M0c']}}), 2.5)
+        self.assertIn(('A2', r2), self.mapped)
+        self.assertIn(('M0c', r2), self.mapped)
+        self.assertIn(('M0a', r2), self.mapped)
+        area.tick(3.0)
+        dest, msg = self.sent.pop(0)
+        self.assertEqual(msg.to_area, '1')
+        self.assertEqual((msg.summary, msg.base), (None, 1))
+        self.assertEqual(msg.update, {'2': {'cost': 4, 'add': ['M0a', 'M0c'], 'del': []}})
+
+        ##
+        ## The address that R2 has both locally and in its summary stays mapped until
+        ## it is gone from both
+        ##
+        tracker.router_node('R2').unmap_address('M0a')
+        self.assertIn(('M0a', r2), self.mapped)
+        tracker.router_node('R2').set_summary([])
+        self.assertNotIn(('M0a', r2), self.mapped)
+
+        ##
+        ## The border neighbor expires and its destinations are withdrawn
+        ##
+        area.tick(5.0)
+        self.assertEqual(area.neighbors, {})
+        self.assertNotIn(b1, self.border_routers)
+        self.assertNotIn(('A1', b1), self.mapped)
+        self.assertNotIn(('M0b', b1), self.mapped)
+        dest, msg = self.sent.pop()
+        self.assertEqual(dest, 'amqp:/_topo/0/all/qdrouter')
+        self.assertEqual((msg.update, msg.remove), ({}, ['1']))
+
+    def test_export_on_change(self):
+        tracker = self.node_tracker
+        area    = self.area_engine
+        tracker.neighbor_refresh('R2', 1, 7, 1, 1.0)
+        tracker.link_state_received('R2', LinkState(None, 'R2', 1, {'R1':1}), 1, 1.0)
+        tracker.tick(1.0)
+        area.neighbor_refresh('B1', '1', 1, 5, 2, 1.0)
+        area.tick(1.0)
+        dest, msg = self.sent.pop(0)
+        self.assertEqual(msg.summary, {'0': {'cost': 0, 'addrs': ['M0local']}})
+
+        ##
+        ## Nothing is recomputed or sent while nothing changes
+        ##
+        for now in [2.0, 3.0, 4.0]:
+            area.neighbor_refresh('B1', '1', 1, 5, 2, now)
+            self.assertEqual(area.next_deadline(now), now + 3.0)
+            area.tick(now)
+        self.assertEqual(self.sent, [])
+
+        ##
+        ## A mobile address change in this area is exported right away, as a change
+        ##
+        tracker.router_node('R2').map_address('M0a')
+        self.assertEqual(area.next_deadline(4.5), 4.5)
+        area.tick(4.5)
+        dest, msg = self.sent.pop(0)
+        self.assertEqual(msg.summary, None)
+        self.assertEqual((msg.base, msg.update, msg.remove),
+                         (msg.seq - 1, {'0': {'cost': 0, 'add': ['M0a'], 'del': []}}, []))
+        seq = msg.seq
+        self.assertEqual(area.next_deadline(4.5), 7.0)
+
+        ##
+        ## Only the sequence of the unchanged summary is advertised every raInterval
+        ##
+        for now in range(5, 36):
+            area.neighbor_refresh('B1', '1', 1, 5, 2, now)
+            area.tick(now)
+        self.assertEqual(len(self.sent), 1)
+        dest, msg = self.sent.pop(0)
+        self.assertEqual((msg.seq, msg.summary, msg.base), (seq, None, None))
+        self.assertEqual(msg.to_dict(), {'id': 'R1', 'area': '0', 'to_area': '1', 'seq': seq})
+
+        ##
+        ## The whole summary is sent on request only, to neighbors across the border and to
+        ## routers in this area
+        ##
+        area.handle_asr(MessageASR(None, 'B1', '1', 'R1'), 36.0)
+        dest, msg = self.sent.pop(0)
+        self.assertEqual((dest, msg.seq), ('amqp:/_local/qdhello', seq))
+        self.assertEqual(msg.summary, {'0': {'cost': 0, 'addrs': ['M0a', 'M0local']}})
+        area.handle_asr(MessageASR(None, 'B1', '1', 'R9'), 36.0)
+        area.handle_asr(MessageASR(None, 'B2', '1', 'R1'), 36.0)
+        self.assertEqual(self.sent, [])
+
+    def test_receive_changes(self):
+        tracker = self.node_tracker
+        area    = self.area_engine
+        tracker.neighbor_refresh('R2', 1, 7, 1, 1.0)
+        tracker.link_state_received('R2', LinkState(None, 'R2', 1, {'R1':1}), 1, 1.0)
+        tracker.tick(1.0)
+        r2 = tracker.router_node('R2')
+        area.neighbor_refresh('B1', '1', 1, 5, 2, 1.0)
+        b1 = area.neighbors['B1']
+
+        ##
+        ## An advertised summary that isn't held is requested
+        ##
+        area.handle_asu(MessageASU(None, 'B1', '1', '0', 3), 1.0)
+        self.assertEqual(self.sent.pop()[1].to_dict(), {'id': 'R1', 'area': '0', 'target': 'B1'})
+        area.handle_asu(MessageASU(None, 'R2', '0', '0', 3), 1.0)
+        dest, msg = self.sent.pop()
+        self.assertEqual((dest, msg.target), ('amqp:/_topo/0/R2/qdrouter', 'R2'))
+        self.assertEqual(self.sent, [])
+
+        ##
+        ## Changes apply on top of the summary at their base
+        ##
+        area.handle_asu(MessageASU(None, 'B1', '1', '0', 3, {'1': {'cost': 0L, 'addrs': ['M0b', 'M0c']}}), 1.0)
+        area.handle_asu(MessageASU(None, 'B1', '1', '0', 4, _base=3,
+                                   _update={'1': {'cost': 1L, 'add': ['M0d'], 'del': ['M0b']},
+                                            '2': {'cost': 2L, 'add': ['M0e'], 'del': []}}), 1.0)
+        self.assertEqual(b1.summary, {'1': {'cost': 1, 'addrs': ['M0c', 'M0d']},
+                                      '2': {'cost': 2, 'addrs': ['M0e']}})
+        self.assertIn(('M0d', b1.maskbit), self.mapped)
+        self.assertNotIn(('M0b', b1.maskbit), self.mapped)
+        area.handle_asu(MessageASU(None, 'B1', '1', '0', 5, _base=4, _remove=['2']), 1.0)
+        self.assertEqual(b1.summary, {'1': {'cost': 1, 'addrs': ['M0c', 'M0d']}})
+        self.assertNotIn(('A2', b1.maskbit), self.mapped)
+        area.handle_asu(MessageASU(None, 'B1', '1', '0', 5), 1.0)
+        self.assertEqual(self.sent, [])
+
+        area.handle_asu(MessageASU(None, 'R2', '0', '0', 3, {'2': {'cost': 1L, 'addrs': ['M0e']}}), 1.0)
+        area.handle_asu(MessageASU(None, 'R2', '0', '0', 4, _base=3,
+                                   _update={'2': {'cost': 1L, 'add': ['M0f'], 'del': []}}), 1.0)
+        self.assertEqual(r2.summary_addresses, set(['A2', 'M0e', 'M0f']))
+
+        ##
+        ## Changes that don't follow on from the summary held are not applied; the whole
+        ## summary is requested instead
+        ##
+        area.handle_asu(MessageASU(None, 'R2', '0', '0', 7, _base=6,
+                                   _update={'2': {'cost': 1L, 'add': ['M0g'], 'del': []}}), 1.0)
+        self.assertEqual(r2.summary_addresses, set(['A2', 'M0e', 'M0f']))
+        self.assertEqual(self.sent.pop()[1].get_opcode(), 'ASR')
+
+    def test_non_backbone_border(self):
+        self.area = '1'
+        area = AreaEngine(self, self.node_tracker)
+        area.neighbor_refresh('B2', '2', 1, 5, 1, 1.0)
+        self.assertEqual(area.neighbors, {})
+        self.assertEqual(self.border_routers, {})
+        area.neighbor_refresh('B0', '0', 1, 6, 1, 1.0)
+        self.assertEqual(area.neighbors.keys(), ['B0'])
+
+
+class SpfHoldDownTest(TrackerContainer, unittest.TestCase):
+    def setUp(self):
+        super(SpfHoldDownTest, self).setUp()
+        self.config.spfInitialDelayMs = 125
+        self.config.spfHoldMs         = 250
+        self.config.spfMaxWaitMs      = 1000
+        self.node_tracker = NodeTracker(self, 8)
+        self.recomputes_avoided = 0
+        self.r2_seq = 1
+
+    def r2_changed(self, now):
+        ##
+        ## Each update changes the cost of the link from R2 to R3, and so the route to R3
+        ##
+        self.r2_seq += 1
+        link_state = LinkState(None, 'R2', self.r2_seq, {'R1':1, 'R3':self.r2_seq})
+        self.node_tracker.link_state_received('R2', link_state, 1, now)
+        self.node_tracker.tick(now)
+
+    def test_hold_down(self):
+        tracker = self.node_tracker
+        tracker.neighbor_refresh('R2', 1, 7, 1, 1.0)
+        tracker.link_state_received('R2', LinkState(None, 'R2', 1, {'R1':1, 'R3':1}), 1, 1.0)
+        tracker.link_state_received('R3', LinkState(None, 'R3', 1, {'R2':1}), 1, 1.0)
+        tracker.tick(1.0)
+
+        ##
+        ## The first change after a quiet period waits for the initial delay
+        ##
+        self.assertEqual(len(self.route_calls), 0)
+        self.assertEqual(tracker.next_deadline(1.0), 1.125)
+        tracker.tick(1.125)
+        self.assertEqual(len(self.route_calls), 1)
+
+        ##
+        ## Further changes wait out the hold time, which doubles while changes keep arriving
+        ##
+        self.r2_changed(1.25)
+        self.assertEqual(tracker.next_deadline(1.25), 1.375)
+        self.r2_changed(1.3125)
+        self.assertEqual(len(self.route_calls), 1)
+        tracker.tick(1.375)
+        self.assertEqual(len(self.route_calls), 2)
+        self.assertEqual(self.recomputes_avoided, 1)
+
+        self.r2_changed(1.5)
+        self.assertEqual(tracker.next_deadline(1.5), 1.875)
+        tracker.tick(1.875)
+        self.assertEqual(len(self.route_calls), 3)
+
+        ##
+        ## After a quiet period the hold time starts over
+        ##
+        self.r2_changed(2.75)
+        self.assertEqual(tracker.next_deadline(2.75), 2.875)
+
+
+class SubsecondTimerTest(TrackerContainer, unittest.TestCase):
+    def setUp(self):
+        super(SubsecondTimerTest, self).setUp()
+        self.config.helloMaxAgeMs    = 300
+        self.config.raIntervalFluxMs = 100
+        self.node_tracker = NodeTracker(self, 8)
+
+    def test_neighbor_loss_and_flux(self):
+        tracker = self.node_tracker
+        tracker.neighbor_refresh('R2', 1, 7, 1, 10.0)
+        tracker.tick(10.0)
+        self.assertTrue(tracker.in_flux_mode(10.2))
+        self.assertFalse(tracker.in_flux_mode(10.25))
+
+        tracker.tick(10.25)
+        self.assertTrue(tracker.router_node('R2').is_neighbor())
+        tracker.tick(10.35)
+        self.assertFalse(tracker.router_node('R2').is_neighbor())
+        self.assertEqual(tracker.last_topology_change, 10.35)
+
+
+class LinkStateTest(TrackerContainer, unittest.TestCase):
+    def send(self, dest, msg):
+        self.sent.append((dest, msg))
+
+    def summary_requested(self, node_id):
+        pass
+
+    def setUp(self):
+        super(LinkStateTest, self).setUp()
+        self.config.attributes.update({'raInterval' : 1.0, 'raIntervalFlux' : 1.0})
+        self.instance = 1L
+        self.sent = []
+        self.area_engine = self
+        self.engine = LinkStateEngine(self)
+
+    def send_lsr(self, node_id, have_seq=None, have_ids=0):
+        self.lsrs.append((node_id, have_seq, have_ids))
+
+    def test_compact_delta(self):
+        self.lsrs = []
+        ls = self.node_tracker.link_state
+        for peer in ['R2', 'R3', 'R4']:
+            ls.add_peer(peer, 1L)
+        ls.bump_sequence()
+
+        ##
+        ## A request that doesn't ask for the compact encoding gets the full LSU
+        ##
+        self.engine.handle_lsr(MessageLSR(None, 'R2'), 1.0)
+        body = self.sent.pop()[1].to_dict()
+        self.assertEqual(body['ls']['peers'], {'R2':1, 'R3':1, 'R4':1})
+
+        ##
+        ## A compact LSU refers to the peers by index and carries the dictionary entries
+        ##
+        self.engine.handle_lsr(MessageLSR(MessageLSR(None, 'R2', '0', None, True).to_dict()), 1.0)
+        body = self.sent.pop()[1].to_dict()
+        self.assertFalse('ls' in body)
+        self.assertEqual(body['ids_base'], 0)
+        self.assertEqual(sorted(body['ids']), ['R2', 'R3', 'R4'])
+        self.assertEqual(len(body['peers']), 6)
+        self.assertEqual(MessageLSU(body).decode(body['ids']).peers, {'R2':1, 'R3':1, 'R4':1})
+
+        ##
+        ## A compact LSU received from R2 extends our copy of its dictionary
+        ##
+        tracker = self.node_tracker
+        tracker.ra_received('R2', 1, 0, 1L, 1.0)
+        node = tracker.router_node('R2')
+        body['id'] = 'R2'
+        self.engine.handle_lsu(MessageLSU(body), 1.0)
+        self.assertEqual(node.link_state.ls_seq, 1)
+        self.assertEqual(node.link_state.peers, {'R2':1, 'R3':1, 'R4':1})
+        self.assertEqual(node.peer_ids, body['ids'])
+
+        ls.del_peer('R3')
+        ls.add_peer('R5', 2L)
+        ls.bump_sequence()
+
+        ##
+        ## A requester holding a link state we sent is sent only the changes and the
+        ## dictionary entries it doesn't have
+        ##
+        self.engine.handle_lsr(MessageLSR(MessageLSR(None, 'R2', '0', 1, True, 3).to_dict()), 2.0)
+        body = self.sent.pop()[1].to_dict()
+        self.assertEqual((body['base'], body['ls_seq']), (1, 2))
+        self.assertEqual((body['ids_base'], body['ids']), (3, ['R5']))
+        self.assertEqual((body['add'], body['del']), ([3, 2], [self.engine.peer_index['R3']]))
+
+        ##
+        ## Sequences we don't remember get the whole link state in compact form.  A requester
+        ## that claims more of the dictionary than we have gets all of it.
+        ##
+        self.engine.handle_lsr(MessageLSR(None, 'R2', '0', 7, True, 4), 3.0)
+        msg = MessageLSU(self.sent.pop()[1].to_dict())
+        self.assertTrue(msg.compact and msg.base == None)
+        self.assertEqual((msg.ids_base, msg.ids), (4, []))
+        self.assertEqual(msg.decode(self.engine.peer_ids).peers, {'R2':1, 'R4':1, 'R5':2})
+        self.engine.handle_lsr(MessageLSR(None, 'R2', '0', None, True, 50), 3.0)
+        msg = MessageLSU(self.sent.pop()[1].to_dict())
+        self.assertEqual((msg.ids_base, msg.ids), (0, self.engine.peer_ids))
+
+        ##
+        ## A delta received from R2 applies on top of the link state at its base
+        ##
+        body['id'] = 'R2'
+        self.engine.handle_lsu(MessageLSU(body), 2.0)
+        self.assertEqual(node.link_state.ls_seq, 2)
+        self.assertEqual(node.link_state.peers, {'R2':1, 'R4':1, 'R5':2})
+        tracker._send_lsr(node)
+        self.assertEqual(self.lsrs.pop(), ('R2', 2, 4))
+
+        ##
+        ## A delta that doesn't match the link state held requests the full link state
+        ##
+        node.need_ls_request = False
+        body['base'], body['ls_seq'] = 5L, 6L
+        self.engine.handle_lsu(MessageLSU(body), 3.0)
+        self.assertEqual(node.link_state.ls_seq, 2)
+        self.assertTrue(node.need_ls_request and node.ls_delta_failed)
+        tracker._send_lsr(node)
+        self.assertEqual(self.lsrs.pop(), ('R2', None, 0))
+
+        ##
+        ## So do dictionary entries that don't follow on from the ones held, and indexes
+        ## missing from the dictionary
+        ##
+        node.ls_delta_failed = node.need_ls_request = False
+        body['base'], body['ids_base'] = 2L, 9L
+        self.engine.handle_lsu(MessageLSU(body), 3.0)
+        self.assertTrue(node.need_ls_request and node.ls_delta_failed)
+        self.assertEqual(len(node.peer_ids), 4)
+
+        node.ls_delta_failed = node.need_ls_request = False
+        body['ids_base'], body['ids'], body['add'] = 4L, [], [7L, 1L]
+        self.engine.handle_lsu(MessageLSU(body), 3.0)
+        self.assertEqual(node.link_state.ls_seq, 2)
+        self.assertTrue(node.need_ls_request and node.ls_delta_failed)
+
+
+    def test_request_while_change_pending(self):
+        """
+        A request answered between a change to our peers and the sequence bump that
+        follows it at the next tick must not change what the current sequence stands for
+        """
+        tracker = self.node_tracker
+        ls = tracker.link_state
+        ls.add_peer('R2', 1L)
+        ls.bump_sequence()
+
+        def request(_id, held=None):
+            have_seq = held and held.ls_seq
+            self.engine.handle_lsr(MessageLSR(None, _id, '0', have_seq, True, 0), 1.0)
+            msg = MessageLSU(self.sent.pop()[1].to_dict())
+            self.assertEqual(msg.base, have_seq)
+            return msg.decode(self.engine.peer_ids, held)
+
+        lsa = request('RA')
+        self.assertEqual((lsa.ls_seq, lsa.peers), (1, {'R2':1}))
+
+        ##
+        ## R3 is added and RB asks before the tick: it is sent seq 1 as it was advertised
+        ##
+        ls.add_peer('R3', 1L)
+        tracker.link_state_changed = True
+        lsb = request('RB')
+        self.assertEqual((lsb.ls_seq, lsb.peers), (1, {'R2':1}))
+        tracker.link_state_changed = False
+        ls.bump_sequence()
+
+        ##
+        ## RA, holding seq 1, is sent R3 as a change
+        ##
+        lsa = request('RA', lsa)
+        self.assertEqual((lsa.ls_seq, lsa.peers), (2, {'R2':1, 'R3':1}))
+
+        ##
+        ## A change undone before the tick leaves seq 2 as it was
+        ##
+        ls.add_peer('R4', 1L)
+        tracker.link_state_changed = True
+        lsc = request('RC')
+        ls.del_peer('R4')
+        tracker.link_state_changed = False
+        ls.bump_sequence()
+        self.assertEqual((lsc.ls_seq, lsc.peers), (2, {'R2':1, 'R3':1}))
+        lsc = request('RC', lsc)
+        self.assertEqual((lsc.ls_seq, lsc.peers), (3, {'R2':1, 'R3':1}))
+
+class AddressBatchTest(TrackerContainer, unittest.TestCase):
+    def find_entity_by_type(self, entity_type):
+        return [self.router_config]
+
+    def schedule_tick(self, msec):
+        pass
+
+    def setUp(self):
+        super(AddressBatchTest, self).setUp()
+        import router_engine_bench
+        self.router_config = router_engine_bench.router_config(router_engine_bench.QdSchema(), [])
+        self.sent = []
+        self.engine = RouterEngine(self, 'R1', '0', 8)
+        self.engine._log = lambda adapter, level, text, args: None
+        self.engine.send = lambda dest, msg: self.sent.append(msg)
+
+    def mau(self):
+        self.engine.handleTimerTick()
+        maus = [msg for msg in self.sent if msg.get_opcode() == 'MAU']
+        self.sent = []
+        self.assertEqual(len(maus), 1)
+        return maus[0]
+
+    def test_batched_changes(self):
+        """
+        A batch of added or removed addresses from the core is applied as a whole and sent
+        in one MAU.  Addresses that are not mobile are ignored.
+        """
+        engine = self.engine
+        engine.addressAdded(['M0a', 'Cb', 'Dc', 'Ltopo', 'M0x', 'Rrouter'])
+        engine.addressRemoved(['M0x', 'Ltopo'])
+        msg = self.mau()
+        self.assertEqual(engine.mobile_address_engine.local_addrs, set(['M0a', 'Cb', 'Dc']))
+        self.assertEqual((msg.mobile_seq, msg.add_list, msg.del_list), (1, ['M0a', 'Cb', 'Dc'], []))
+
+        engine.addressRemoved(['Cb', 'Dc', 'Tlink'])
+        engine.addressAdded(['M0d', 'Dc'])
+        msg = self.mau()
+        self.assertEqual(engine.mobile_address_engine.local_addrs, set(['M0a', 'Dc', 'M0d']))
+        self.assertEqual((msg.mobile_seq, msg.add_list, msg.del_list), (2, ['M0d'], ['Cb']))
+
+
+class MobileAddressTest(TrackerContainer, unittest.TestCase):
+    def log_ma(self, level, text, *args):
+        pass
+
+    def send(self, dest, msg):
+        self.sent.append((dest, msg))
+
+    def setUp(self):
+        super(MobileAddressTest, self).setUp()
+        self.sent = []
+        self.engine = MobileAddressEngine(self, self.node_tracker)
+
+    def test_local_deltas(self):
+        engine = self.engine
+        engine.add_local_address('a')
+        engine.add_local_address('b')
+        engine.add_local_address('a')
+        engine.add_local_address('c')
+        engine.del_local_address('c')
+        self.assertEqual(engine.tick(1.0), 1)
+        dest, msg = self.sent.pop(0)
+        self.assertEqual(msg.add_list, ['a', 'b'])
+        self.assertEqual(msg.del_list, [])
+        self.assertEqual(engine.local_addrs, set(['a', 'b']))
+
+        engine.del_local_address('a')
+        engine.add_local_address('a')
+        engine.del_local_address('b')
+        engine.add_local_address('d')
+        self.assertEqual(engine.tick(2.0), 2)
+        dest, msg = self.sent.pop(0)
+        self.assertEqual(msg.add_list, ['d'])
+        self.assertEqual(msg.del_list, ['b'])
+        self.assertEqual(engine.local_addrs, set(['a', 'd']))
+
+        ##
+        ## A peer that is too far behind gets the whole list
+        ##
+        engine.handle_mar(MessageMAR(None, 'R2', 0), 3.0)
+        engine.sent_deltas.clear()
+        engine.handle_mar(MessageMAR(None, 'R2', 0), 3.0)
+        self.assertEqual([m.add_list for d, m in self.sent[:2]], [['a', 'b'], ['d']])
+        self.assertEqual(sorted(self.sent[2][1].exist_list), ['a', 'd'])
+
+    def test_merged_catch_up(self):
+        engine = self.engine
+        for adds, dels in [('ab', ''), ('c', 'a'), ('a', 'c'), ('d', 'b')]:
+            for a in adds:
+                engine.add_local_address(a)
+            for a in dels:
+                engine.del_local_address(a)
+            engine.tick(1.0)
+        self.assertEqual(engine.mobile_seq, 4)
+
+        self.sent = []
+        engine.handle_mar(MessageMAR(None, 'R2', 1, True), 2.0)
+        self.assertEqual(len(self.sent), 1)
+        dest, msg = self.sent[0]
+        self.assertEqual((msg.base, msg.mobile_seq), (1, 4))
+        self.assertEqual(msg.add_list, ['d'])
+        self.assertEqual(msg.del_list, ['b'])
+
+        ##
+        ## A merged delta applies on top of its base sequence
+        ##
+        self.node_tracker.router_learned('R2')
+        node = self.node_tracker.router_node('R2')
+        engine.handle_mau(MessageMAU(None, 'R2', 1, ['a', 'b'], []), 3.0)
+        body = msg.to_dict()
+        body['id'] = 'R2'
+        engine.handle_mau(MessageMAU(body), 3.0)
+        self.assertEqual(node.mobile_address_sequence, 4)
+        self.assertEqual(node.mobile_addresses, set(['a', 'd']))
+
+        ##
+        ## A peer that doesn't ask for merging is sent the individual deltas
+        ##
+        self.sent = []
+        engine.handle_mar(MessageMAR(MessageMAR(None, 'R2', 1).to_dict()), 4.0)
+        self.assertEqual([m.mobile_seq for d, m in self.sent], [2, 3, 4])
+
+    def test_delta_budget(self):
+        engine = self.engine
+        engine.delta_budget = 3
+        for a in 'abcd':
+            engine.add_local_address(a)
+            engine.tick(1.0)
+        self.assertEqual([d.mobile_seq for d in engine.sent_deltas], [2, 3, 4])
+        engine.add_local_address('e')
+        engine.add_local_address('f')
+        engine.tick(2.0)
+        self.assertEqual([d.mobile_seq for d in engine.sent_deltas], [4, 5])
+        self.assertEqual(engine.delta_addrs, 3)
+
+        ##
+        ## A peer behind the kept deltas gets the whole list
+        ##
+        self.sent = []
+        engine.handle_mar(MessageMAR(None, 'R2', 2, True), 3.0)
+        self.assertEqual(sorted(self.sent[0][1].exist_list), list('abcdef'))
+
+    def test_chunked_absolute(self):
+        engine = self.engine
+        engine.chunk_size = 2
+        for a in 'abcde':
+            engine.add_local_address(a)
+        engine.tick(1.0)
+        engine.tick(2.0)
+        self.sent = []
+        engine.handle_mar(MessageMAR(None, 'R2', 0), 3.0)
+        self.assertEqual(len(self.sent), 1)
+
+        engine.sent_deltas.clear()
+        self.sent = []
+        engine.handle_mar(MessageMAR(None, 'R2', 0), 3.0)
+        frags = [msg for dest, msg in self.sent]
+        self.assertEqual([(m.frag, m.frags) for m in frags], [(0, 3), (1, 3), (2, 3)])
+        self.assertEqual(sorted(sum([m.exist_list for m in frags], [])), list('abcde'))
+        self.assertEqual(MessageMAU(frags[1].to_dict()).frags, 3)
+
+        ##
+        ## Fragments from R2 are applied only once the last one arrives
+        ##
+        self.node_tracker.router_learned('R2')
+        node = self.node_tracker.router_node('R2')
+        mau = lambda seq, addrs, frag: MessageMAU(None, 'R2', seq, None, None, addrs, frag, 3)
+        engine.handle_mau(mau(4, ['x', 'y'], 0), 4.0)
+        engine.handle_mau(mau(4, ['z'], 1), 4.0)
+        self.assertEqual(self.mapped, set())
+        engine.handle_mau(mau(4, ['w'], 2), 4.0)
+        self.assertEqual(node.mobile_address_sequence, 4)
+        self.assertEqual(self.mapped, set((a, node.maskbit) for a in 'wxyz'))
+
+        ##
+        ## A missing fragment discards the partial update and requests a resend
+        ##
+        engine.handle_mau(mau(5, ['x'], 0), 5.0)
+        engine.handle_mau(mau(5, ['w'], 2), 5.0)
+        self.assertTrue(node.need_mobile_request)
+        self.assertEqual(node.mobile_fragments, None)
+
+    def test_overwrite_addresses(self):
+        self.node_tracker.router_learned('R2')
+        node = self.node_tracker.router_node('R2')
+        node.overwrite_addresses(['a', 'b', 'c'])
+        node.overwrite_addresses(['b', 'c', 'd'])
+        self.assertEqual(self.mapped, set((a, node.maskbit) for a in 'bcd'))
+        node.unmap_all_addresses()
+        self.assertEqual(self.mapped, set())
+
+
 class NeighborTest(unittest.TestCase):
-    def log(self, level, text):
+    def log(self, level, text, *args):
         pass
 
-    def log_hello(self, level, text):
+    def log_hello(self, level, text, *args):
         pass
 
     def send(self, dest, msg):
@@ -148,6 +1084,7 @@ class NeighborTest(unittest.TestCase):
         self.sent = []
         self.neighbors = {}
         self.id = "R1"
+        self.area = '0'
         self.instance = 0
         # Fake configuration
         self.config = EntityBase({
@@ -170,6 +1107,7 @@ class NeighborTest(unittest.TestCase):
         self.assertEqual(msg.id, self.id)
         self.assertEqual(msg.seen_peers, [])
         self.assertEqual(self.local_link_state, None)
+        self.assertEqual(self.engine.next_deadline(1.5), 2.0)
 
     def test_sees_peer(self):
         self.sent = []
@@ -208,13 +1146,53 @@ class NeighborTest(unittest.TestCase):
         keys.sort()
         self.assertEqual(keys, ['R2', 'R3', 'R4', 'R6'])
 
+    def test_subsecond_hello(self):
+        self.config.helloIntervalMs = 250
+        self.config.helloMaxAgeMs   = 700
+        self.engine = HelloProtocol(self, self)
+        self.engine.handle_hello(MessageHELLO(None, 'R2', []), 100.0, 0, 1)
+        for now in [100.1, 100.25, 100.35, 100.6]:
+            self.engine.tick(now)
+        self.assertEqual(len(self.sent), 3)
+        self.assertAlmostEqual(self.engine.next_deadline(100.6), 100.85)
+        self.assertEqual(self.sent[-1][1].seen_peers, ['R2'])
+
+        ##
+        ## The peer's HELLO is expired after 700ms
+        ##
+        self.engine.tick(100.85)
+        self.assertEqual(self.sent[-1][1].seen_peers, [])
+
+    def test_hello_reused(self):
+        self.sent = []
+        self.engine = HelloProtocol(self, self)
+        self.engine.handle_hello(MessageHELLO(None, 'R2', []), 0.5, 0, 1)
+        self.engine.tick(1.0)
+        self.engine.handle_hello(MessageHELLO(None, 'R2', []), 1.5, 0, 1)
+        self.engine.tick(2.0)
+        self.assertEqual(len(self.sent), 2)
+        self.assertTrue(self.sent[0][1] is self.sent[1][1])
+        self.assertTrue(self.sent[0][1].to_dict() is self.sent[1][1].to_dict())
+
+        ##
+        ## A newly seen peer causes a fresh HELLO to be built
+        ##
+        self.engine.handle_hello(MessageHELLO(None, 'R3', []), 2.5, 0, 1)
+        self.engine.tick(3.0)
+        dest, msg = self.sent[2]
+        self.assertFalse(msg is self.sent[1][1])
+        self.assertEqual(sorted(msg.seen_peers), ['R2', 'R3'])
+
 
 class PathTest(unittest.TestCase):
+    spf_algorithm = 'heap'
+
     def setUp(self):
         self.id = 'R1'
+        self.config = EntityBase({'spfAlgorithm' : self.spf_algorithm})
         self.engine = PathEngine(self)
 
-    def log(self, level, text):
+    def log(self, level, text, *args):
         pass
 
     def test_topology1(self):
@@ -228,7 +1206,7 @@ class PathTest(unittest.TestCase):
         collection = { 'R1': LinkState(None, 'R1', 1, {'R2':1}),
                        'R2': LinkState(None, 'R2', 1, {'R1':1, 'R3':1}),
                        'R3': LinkState(None, 'R3', 1, {'R2':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 2)
         self.assertEqual(next_hops['R2'], 'R2')
         self.assertEqual(next_hops['R3'], 'R2')
@@ -256,7 +1234,7 @@ class PathTest(unittest.TestCase):
                        'R4': LinkState(None, 'R4', 1, {'R2':1, 'R5':1}),
                        'R5': LinkState(None, 'R5', 1, {'R3':1, 'R4':1, 'R6':1}),
                        'R6': LinkState(None, 'R6', 1, {'R5':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 5)
         self.assertEqual(next_hops['R2'], 'R2')
         self.assertEqual(next_hops['R3'], 'R2')
@@ -293,7 +1271,7 @@ class PathTest(unittest.TestCase):
                        'R1': LinkState(None, 'R1', 1, {'R3':1, 'R5':1}),
                        'R5': LinkState(None, 'R5', 1, {'R1':1, 'R4':1, 'R6':1}),
                        'R6': LinkState(None, 'R6', 1, {'R5':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 5)
         self.assertEqual(next_hops['R2'], 'R3')
         self.assertEqual(next_hops['R3'], 'R3')
@@ -330,7 +1308,7 @@ class PathTest(unittest.TestCase):
                        'R1': LinkState(None, 'R1', 1, {'R3':1, 'R5':1}),
                        'R5': LinkState(None, 'R5', 1, {'R1':1, 'R4':1, 'R6':1}),
                        'R6': LinkState(None, 'R6', 1, {'R5':1, 'R7':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 6)
         self.assertEqual(next_hops['R2'], 'R3')
         self.assertEqual(next_hops['R3'], 'R3')
@@ -370,7 +1348,7 @@ class PathTest(unittest.TestCase):
                        'R1': LinkState(None, 'R1', 1, {'R3':1, 'R5':1, 'R2':1}),
                        'R5': LinkState(None, 'R5', 1, {'R1':1, 'R4':1, 'R6':1}),
                        'R6': LinkState(None, 'R6', 1, {'R5':1, 'R7':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 6)
         self.assertEqual(next_hops['R2'], 'R2')
         self.assertEqual(next_hops['R3'], 'R3')
@@ -417,7 +1395,7 @@ class PathTest(unittest.TestCase):
                        'R1': LinkState(None, 'R1', 1, {'R3':1, 'R5':1, 'R2':1}),
                        'R5': LinkState(None, 'R5', 1, {'R1':1, 'R4':1, 'R6':1}),
                        'R6': LinkState(None, 'R6', 1, {'R5':1, 'R7':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 6)
         self.assertEqual(next_hops['R2'], 'R2')
         self.assertEqual(next_hops['R3'], 'R3')
@@ -457,7 +1435,7 @@ class PathTest(unittest.TestCase):
                        'R1': LinkState(None, 'R1', 1, {'R3':1, 'R5':1}),
                        'R5': LinkState(None, 'R5', 1, {'R1':1, 'R4':1, 'R6':1}),
                        'R6': LinkState(None, 'R6', 1, {'R5':1, 'R7':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 6)
         self.assertEqual(next_hops['R2'], 'R3')
         self.assertEqual(next_hops['R3'], 'R3')
@@ -497,7 +1475,7 @@ class PathTest(unittest.TestCase):
                        'R1': LinkState(None, 'R1', 1, {'R3':1, 'R5':1}),
                        'R5': LinkState(None, 'R5', 1, {'R1':1, 'R4':1}),
                        'R6': LinkState(None, 'R6', 1, {'R5':1, 'R7':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 4)
         self.assertEqual(next_hops['R2'], 'R3')
         self.assertEqual(next_hops['R3'], 'R3')
@@ -533,7 +1511,7 @@ class PathTest(unittest.TestCase):
                        'R1': LinkState(None, 'R1', 1, {'R3':3,  'R5':10, 'R2':20}),
                        'R5': LinkState(None, 'R5', 1, {'R1':10, 'R4':5,  'R6':2}),
                        'R6': LinkState(None, 'R6', 1, {'R5':2,  'R7':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 6)
         self.assertEqual(next_hops['R2'], 'R3')
         self.assertEqual(next_hops['R3'], 'R3')
@@ -582,7 +1560,7 @@ class PathTest(unittest.TestCase):
                        'R1': LinkState(None, 'R1', 1, {'R3':100, 'R5':10,  'R2':5}),
                        'R5': LinkState(None, 'R5', 1, {'R1':10,  'R4':100, 'R6':2}),
                        'R6': LinkState(None, 'R6', 1, {'R5':2,   'R7':1}) }
-        next_hops, costs, valid_origins = self.engine.calculate_routes(collection)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
         self.assertEqual(len(next_hops), 6)
         self.assertEqual(next_hops['R2'], 'R2')
         self.assertEqual(next_hops['R3'], 'R2')
@@ -634,15 +1612,273 @@ class PathTest(unittest.TestCase):
 
         self.id = 'R3'
         self.engine = PathEngine(self)
-        r3_next_hops, r3_costs, r3_valid_origins = self.engine.calculate_routes(collection)
+        r3_next_hops, r3_costs, r3_valid_origins, r3_ecmp, r3_ecmp_origins = self.engine.calculate_routes(collection)
 
         self.id = 'R1'
         self.engine = PathEngine(self)
-        r1_next_hops, r1_costs, r1_valid_origins = self.engine.calculate_routes(collection)
+        r1_next_hops, r1_costs, r1_valid_origins, r1_ecmp, r1_ecmp_origins = self.engine.calculate_routes(collection)
 
         self.assertEqual(r1_next_hops['R6'], 'R2')
         self.assertEqual(r3_valid_origins['R6'], [])
 
+    def test_valid_origins_with_costs(self):
+        """
+
+        +----+      +====+      +----+      +----+
+        | R2 |--1---| R1 |--1---| R3 |--1---| R4 |
+        +----+      +====+      +----+      +----+
+                       |                       |
+                       1                       |
+                       |                       |
+                    +----+                     |
+                    | R5 |----------2----------+
+                    +----+
+
+        """
+        collection = { 'R1': LinkState(None, 'R1', 1, {'R2':1, 'R3':1, 'R5':1}),
+                       'R2': LinkState(None, 'R2', 1, {'R1':1}),
+                       'R3': LinkState(None, 'R3', 1, {'R1':1, 'R4':1}),
+                       'R4': LinkState(None, 'R4', 1, {'R3':1, 'R5':2}),
+                       'R5': LinkState(None, 'R5', 1, {'R1':1, 'R4':2}) }
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
+        self.assertEqual(dict((dest, sorted(origins)) for dest, origins in valid_origins.items()),
+                         {'R2': ['R3', 'R4', 'R5'],
+                          'R3': ['R2', 'R5'],
+                          'R4': ['R2'],
+                          'R5': ['R2', 'R3']})
+
+    def test_random_valid_origins(self):
+        """
+        Check the valid origins against an all-pairs (Floyd-Warshall) calculation.  Every
+        link has a distinct power-of-two cost so that all shortest paths are unique and an
+        origin is valid for a destination exactly when its distance to the destination is
+        the sum of its distance to us and our distance to the destination.
+        """
+        rand = random.Random(98765)
+        for trial in range(10):
+            ids = ['R%d' % i for i in range(1, 13)]
+            collection = {}
+            for _id in ids:
+                collection[_id] = LinkState(None, _id, 1, {})
+            bits = range(len(ids) * len(ids))
+            rand.shuffle(bits)
+            for a in ids:
+                for b in ids:
+                    if a != b and rand.random() < 0.3:
+                        collection[a].peers[b] = 1L << bits.pop()
+            next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
+
+            dist = {}
+            for a in ids:
+                for b in ids:
+                    if a == b:
+                        dist[a, b] = 0
+                    else:
+                        dist[a, b] = collection[a].peers.get(b)
+            for k in ids:
+                for a in ids:
+                    for b in ids:
+                        if dist[a, k] != None and dist[k, b] != None:
+                            if dist[a, b] == None or dist[a, k] + dist[k, b] < dist[a, b]:
+                                dist[a, b] = dist[a, k] + dist[k, b]
+
+            for dest in next_hops:
+                expected = [origin for origin in next_hops if origin != dest and
+                            dist[origin, self.id] != None and dist[origin, dest] != None and
+                            dist[origin, self.id] + dist[self.id, dest] == dist[origin, dest]]
+                self.assertEqual(sorted(valid_origins[dest]), sorted(expected))
+
+    def test_ecmp_diamond(self):
+        """
+
+        +----+      +----+
+        | R1 |------| R2 |
+        +----+      +----+
+           |           |
+        +====+      +----+
+        | R3 |------| R4 |
+        +====+      +----+
+
+        """
+        collection = { 'R1': LinkState(None, 'R1', 1, {'R2':1, 'R3':1}),
+                       'R2': LinkState(None, 'R2', 1, {'R1':1, 'R4':1}),
+                       'R3': LinkState(None, 'R3', 1, {'R1':1, 'R4':1}),
+                       'R4': LinkState(None, 'R4', 1, {'R2':1, 'R3':1}) }
+        self.id = 'R3'
+        self.engine = PathEngine(self)
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
+        self.assertEqual(next_hops['R2'], 'R1')
+        self.assertEqual(ecmp_next_hops, {'R2': ['R1', 'R4']})
+
+        ##
+        ## The trees from R1 and R4 pass through R2, so R3 is not on them, but R3 is on
+        ## equal-cost paths from each to the other.
+        ##
+        self.assertEqual(valid_origins, {'R1': [], 'R2': [], 'R4': []})
+        self.assertEqual(ecmp_origins, {'R1': ['R4'], 'R2': [], 'R4': ['R1']})
+
+    def test_random_ecmp(self):
+        """
+        Check the equal-cost next hops and origins against the distances between routers.
+        """
+        rand = random.Random(2468)
+        for trial in range(10):
+            ids = ['R%d' % i for i in range(1, 13)]
+            collection = {}
+            for _id in ids:
+                collection[_id] = LinkState(None, _id, 1, {})
+            for a in ids:
+                for b in ids:
+                    if a < b and rand.random() < 0.3:
+                        cost = rand.randint(1, 2)
+                        collection[a].peers[b] = cost
+                        collection[b].peers[a] = cost
+            link_states = self.engine._link_states(collection)
+            next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
+            dist = {}
+            for root in link_states:
+                dist[root] = self.engine._calculate_tree_from_root(root, link_states)[1]
+                dist[root][root] = 0
+            for dest in next_hops:
+                hops = [n for n, c in link_states[self.id].items() if dist[n].get(dest) == costs[dest] - c]
+                if len(hops) > 1:
+                    self.assertEqual(ecmp_next_hops[dest], sorted(hops))
+                else:
+                    self.assertFalse(dest in ecmp_next_hops)
+                expected = [root for root in next_hops
+                            if root != dest and self.id in dist[root] and
+                            dist[root][self.id] + costs[dest] == dist[root].get(dest)]
+                self.assertEqual(sorted(valid_origins[dest] + ecmp_origins[dest]), sorted(expected))
+
+    def test_incremental_matches_full(self):
+        """
+        Routes calculated incrementally after each link-state change must match a full
+        calculation from scratch.
+        """
+        rand = random.Random(4242)
+        ids = ['R%d' % i for i in range(1, 21)]
+        collection = {}
+        for _id in ids:
+            collection[_id] = LinkState(None, _id, 1, {})
+        for a in ids:
+            for b in ids:
+                if a != b and rand.random() < 0.15:
+                    collection[a].peers[b] = rand.randint(1, 3)
+        full_runs = None
+        for step in range(40):
+            a = rand.choice(ids)
+            b = rand.choice(ids)
+            if a == b:
+                continue
+            if rand.random() < 0.3:
+                collection[a].del_peer(b)
+            else:
+                collection[a].peers[b] = rand.randint(1, 3)
+            incremental = self.engine.calculate_routes(collection)
+            full = PathEngine(self).calculate_routes(collection)
+            self.assertEqual(incremental, full)
+            if full_runs == None:
+                full_runs = self.engine.full_runs
+        self.assertEqual(full_runs, 1)
+        self.assertTrue(self.engine.full_runs < 40)
+
+    def test_incremental_single_change(self):
+        """
+
+        +====+      +----+      +----+
+        | R1 |------| R2 |------| R3 |
+        +====+      +----+      +----+
+           |                       |
+           |        +----+         |
+           +--------| R4 |---------+
+                    +----+
+
+        """
+        collection = { 'R1': LinkState(None, 'R1', 1, {'R2':1, 'R4':1}),
+                       'R2': LinkState(None, 'R2', 1, {'R1':1, 'R3':1}),
+                       'R3': LinkState(None, 'R3', 1, {'R2':1, 'R4':1}),
+                       'R4': LinkState(None, 'R4', 1, {'R1':1, 'R3':1}) }
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
+        self.assertEqual(next_hops['R3'], 'R2')
+        self.assertEqual(self.engine.spf_runs, 4)
+
+        collection['R2'].peers['R3'] = 5
+        next_hops, costs, valid_origins, ecmp_next_hops, ecmp_origins = self.engine.calculate_routes(collection)
+        self.assertEqual(next_hops['R3'], 'R4')
+        self.assertEqual(costs['R3'], 2)
+        self.assertEqual(self.engine.full_runs, 1)
+        self.assertTrue(self.engine.spf_runs < 8)
+
+
+class ListPathTest(PathTest):
+    spf_algorithm = 'list'
+
+
+class NodeSetTest(unittest.TestCase):
+    def test_heap_matches_list_ordering(self):
+        """
+        Both node sets must yield nodes in the same (cost, id) order so that ties are
+        broken identically and routes do not depend on the configured algorithm.
+        """
+        rand = random.Random(12345)
+        ids = ['R%d' % i for i in range(40)]
+        costs = dict((_id, None) for _id in ids)
+        costs['R7'] = 0
+        list_set = NodeSet(costs)
+        heap_set = HeapNodeSet(costs)
+        reachable = set(['R7'])
+        for i in range(200):
+            _id = rand.choice(ids)
+            if list_set.contains(_id):
+                cost = rand.randint(1, 5)
+                list_set.set_cost(_id, cost)
+                heap_set.set_cost(_id, cost)
+                reachable.add(_id)
+            if rand.random() < 0.2 and reachable:
+                lowest = list_set.lowest_cost()
+                self.assertEqual(lowest, heap_set.lowest_cost())
+                reachable.remove(lowest)
+            self.assertEqual(list_set.contains(_id), heap_set.contains(_id))
+        self.assertEqual(list_set.empty(), heap_set.empty())
+
+    def test_random_topologies(self):
+        rand = random.Random(54321)
+        for trial in range(20):
+            ids = ['R%d' % i for i in range(1, 16)]
+            collection = {}
+            for _id in ids:
+                collection[_id] = LinkState(None, _id, 1, {})
+            for a in ids:
+                for b in ids:
+                    if a < b and rand.random() < 0.3:
+                        cost = rand.randint(1, 3)
+                        collection[a].peers[b] = cost
+                        collection[b].peers[a] = cost
+            results = []
+            for algorithm in ['list', 'heap']:
+                self.id = 'R1'
+                self.config = EntityBase({'spfAlgorithm' : algorithm})
+                results.append(PathEngine(self).calculate_routes(collection))
+            self.assertEqual(results[0][0], results[1][0])
+            self.assertEqual(results[0][1], results[1][1])
+
+
+class SimulationTest(unittest.TestCase):
+    def test_ring_converges(self):
+        """
+        Run the control-plane benchmark over a small ring and check that every event converges
+        """
+        import router_engine_bench
+        from optparse import Values
+        options = Values(dict(max_routers=8, hop_delay=1.0, settle=6.0, timeout=120.0, seed=1, set=[]))
+        config  = router_engine_bench.router_config(router_engine_bench.QdSchema(), [])
+        results = router_engine_bench.run_topology(options, config, 'ring', 5)
+        self.assertEqual([r['event'] for r in results], ['start', 'join', 'link-down', 'link-up', 'leave'])
+        for result in results:
+            self.assertNotEqual(result['converged'], None)
+        self.assertTrue(results[0]['spf_runs'] > 0)
+        self.assertTrue(results[0]['LSU'] > 0)
+
 
 if __name__ == '__main__':
     unittest.main(main_module())
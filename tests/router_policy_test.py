@@ -125,14 +125,14 @@ class MockPolicyManager(object):
     def __init__(self):
         self.agent = MockAgent()
 
-    def log_debug(self, text):
-        print("DEBUG: %s" % text)
-    def log_info(self, text):
-        print("INFO: %s" % text)
-    def log_trace(self, text):
-        print("TRACE: %s" % text)
-    def log_error(self, text):
-        print("ERROR: %s" % text)
+    def log_debug(self, text, *args):
+        print("DEBUG: %s" % (text % args if args else text))
+    def log_info(self, text, *args):
+        print("INFO: %s" % (text % args if args else text))
+    def log_trace(self, text, *args):
+        print("TRACE: %s" % (text % args if args else text))
+    def log_error(self, text, *args):
+        print("ERROR: %s" % (text % args if args else text))
 
     def get_agent(self):
         return self.agent
@@ -153,6 +153,24 @@ class ManagementTest(system_test.TestCase):
             self.assertTrue([r for r in response.get_dicts() if r['name'] == name],
                             msg="Can't find result with name '%s'" % name)
 
+    def test_query_paging(self):
+        """Query with offset, count and continuation"""
+        attribute_names=['type', 'name']
+        names = [r[1] for r in self.node.query(attribute_names=attribute_names).results]
+        self.assertTrue(len(names) > 4)
+        response = self.node.query(attribute_names=attribute_names, offset=1, count=2)
+        self.assertEqual(names[1:3], [r[1] for r in response.results])
+        self.assertTrue(response.continuation is not None)
+        paged = []
+        response = self.node.query(attribute_names=attribute_names, count=3)
+        while True:
+            self.assertTrue(len(response.results) <= 3)
+            paged += [r[1] for r in response.results]
+            if response.continuation is None: break
+            response = self.node.query(attribute_names=attribute_names, count=3,
+                                       continuation=response.continuation)
+        self.assertEqual(names, paged)
+
     def assertMapSubset(self, small, big):
         """Assert that mapping small is a subset of mapping big"""
         missing = [(k, v) for k, v in small.items() if (k, v) not in big.items()]
@@ -323,6 +341,28 @@ class ManagementTest(system_test.TestCase):
                   if l['owningAddr'] and l['owningAddr'].endswith(path)]
         self.assertTrue(mylink)
 
+    def test_query_filter(self):
+        """Query with a filter, evaluated by the python agent and by the router core agent"""
+        response = self.node.query(type=LISTENER, attribute_names=['name'], filter='name=l1')
+        self.assertEqual([['l1']], response.results)
+        response = self.node.query(type=LISTENER, attribute_names=['name'],
+                                   filter=['name^=l', 'port!=%s' % self.router.ports[1]])
+        self.assertTrue(['l1'] not in response.results)
+        self.assertTrue(['l0'] in response.results)
+
+        links = self.node.query(type=LINK).get_dicts()
+        response = self.node.query(type=LINK, filter='linkDir=in')
+        self.assertEqual(len([l for l in links if l['linkDir'] == 'in']), len(response.results))
+        response = self.node.query(type=LINK, attribute_names=['identity'],
+                                   filter='identity=%s' % links[0]['identity'])
+        self.assertEqual([[links[0]['identity']]], response.results)
+        response = self.node.query(type=LINK, filter='deliveryCount<0')
+        self.assertEqual([], response.results)
+
+        self.assertRaises(NotFoundStatus, self.node.query, type=LINK, filter='nosuch=1')
+        self.assertRaises(BadRequestStatus, self.node.query, type=LINK, filter='deliveryCount>x')
+        self.assertRaises(NotFoundStatus, self.node.query, type=LISTENER, filter='nosuch=1')
+
     def test_connection(self):
         """Verify there is at least one connection"""
         response = self.node.query(type='connection')
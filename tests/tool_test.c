@@ -300,6 +300,41 @@ static char* test_bitmask(void *context)
     if (count != 4)  return "Expected count to be 4";
     if (total != 82) return "Expected bit-number total to be 82";
 
+    //
+    // Bits spread across the full width of the mask
+    //
+    qd_bitmask_clear_all(bm);
+    int high = qd_bitmask_width() - 1;
+    qd_bitmask_set_bit(bm, high);
+    qd_bitmask_set_bit(bm, 1000);
+    qd_bitmask_set_bit(bm, 200);
+    qd_bitmask_set_bit(bm, 130);
+    if (!qd_bitmask_first_set(bm, &num)) return "Expected first set bit (3)";
+    if (num != 130)                      return "Expected first set bit to be 130";
+    qd_bitmask_clear_bit(bm, 130);
+    qd_bitmask_set_bit(bm, 5);
+    if (!qd_bitmask_first_set(bm, &num)) return "Expected first set bit (4)";
+    if (num != 5)                        return "Expected first set bit to be 5";
+    if (!qd_bitmask_value(bm, 1000))     return "Expected bit 1000 to be set";
+    if (qd_bitmask_value(bm, 1001))      return "Expected bit 1001 to be clear";
+
+    total = 0;
+    count = 0;
+    for (QD_BITMASK_EACH(bm, num, c)) {
+        if (num <= total && count > 0) return "Expected bits in ascending order";
+        total = num;
+        count++;
+    }
+    if (count != 4)    return "Expected count to be 4 (2)";
+    if (total != high) return "Expected the last bit to be the highest";
+
+    qd_bitmask_free(bm);
+
+    bm = qd_bitmask(1);
+    if (qd_bitmask_cardinality(bm) != qd_bitmask_width()) return "Expected all bits set";
+    qd_bitmask_clear_bit(bm, 0);
+    if (!qd_bitmask_first_set(bm, &num)) return "Expected first set bit (5)";
+    if (num != 1)                        return "Expected first set bit to be 1";
     qd_bitmask_free(bm);
 
     return 0;